@@ -0,0 +1,62 @@
+# throughput benchmark: bulk transcript jobs against local LLM and trials stubs
+# usage (from the repo root): python -m benchmarks.bench_bulk [--transcripts 100] [--workers 1,4,16]
+import argparse
+import asyncio
+import json
+import time
+import httpx
+from .stubs import start_stubs, serve_in_thread
+from .bench_concurrency import load_app, TRANSCRIPT
+
+
+async def run_job(app_url: str, count: int, workers: int, ndjson: bool) -> dict:
+    # unique transcripts so the LLM response cache doesn't short-circuit extraction
+    transcripts = [f"{TRANSCRIPT} (visit {workers}-{i})" for i in range(count)]
+    async with httpx.AsyncClient(base_url=app_url, timeout=300) as http:
+        started = time.perf_counter()
+        if ndjson:
+            body = "\n".join(json.dumps({"transcript": t}) for t in transcripts)
+            response = await http.post(
+                "/api/v1/transcripts/bulk", params={"workers": workers},
+                content=body, headers={"Content-Type": "application/x-ndjson"},
+            )
+        else:
+            response = await http.post("/api/v1/transcripts/bulk", params={"workers": workers}, json=transcripts)
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        while True:
+            await asyncio.sleep(0.1)
+            job = (await http.get(f"/api/v1/jobs/{job_id}", params={"items": False})).json()
+            if job["status"] in ("done", "failed", "partial", "interrupted"):
+                break
+        wall = time.perf_counter() - started
+    return {
+        "workers": workers,
+        "completed": job["completed"],
+        "failed": job["failed"],
+        "wall_s": wall,
+        "throughput": count / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--trials-latency", type=float, default=0.2)
+    parser.add_argument("--transcripts", type=int, default=100)
+    parser.add_argument("--workers", default="1,4,16")
+    parser.add_argument("--ndjson", action="store_true", help="upload as NDJSON instead of a JSON array")
+    args = parser.parse_args()
+
+    llm_url, trials_url = start_stubs(args.llm_latency, args.trials_latency)
+    app_url = serve_in_thread(load_app(llm_url, trials_url))
+
+    print(f"{'workers':>7} {'done':>5} {'failed':>6} {'wall (s)':>9} {'transcripts/s':>14}")
+    for workers in (int(x) for x in args.workers.split(",")):
+        result = asyncio.run(run_job(app_url, args.transcripts, workers, args.ndjson))
+        print(f"{result['workers']:>7} {result['completed']:>5} {result['failed']:>6} "
+              f"{result['wall_s']:>9.2f} {result['throughput']:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# load benchmark: concurrent transcript uploads against local LLM and trials stubs
+# usage (from the repo root): python -m benchmarks.bench_concurrency [--llm-latency 0.5] [--trials-latency 0.2]
+import argparse
+import asyncio
+import os
+import time
+import httpx
+from .stubs import start_stubs, serve_in_thread
+
+TRANSCRIPT = "Dr: Good morning Mrs. Doe, how have your sugars been? Patient: Not great, my last HbA1c was 8.4..."
+
+
+def load_app(llm_url: str, trials_url: str):
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["OPENAI_BASE_URL"] = llm_url
+    os.environ["CLINICAL_TRIALS_API_URL"] = trials_url
+    from src import main
+    main.base_url = trials_url
+    return main.app
+
+
+async def run_level(app_url: str, concurrency: int) -> dict:
+    async with httpx.AsyncClient(base_url=app_url, timeout=300) as http:
+        async def one():
+            started = time.perf_counter()
+            response = await http.post("/api/v1/transcripts", json={"transcript": TRANSCRIPT})
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "wall_s": wall,
+        "mean_latency_s": sum(latencies) / len(latencies),
+        "throughput_rps": concurrency / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--trials-latency", type=float, default=0.2)
+    parser.add_argument("--levels", default="1,4,16,32")
+    args = parser.parse_args()
+
+    llm_url, trials_url = start_stubs(args.llm_latency, args.trials_latency)
+    app_url = serve_in_thread(load_app(llm_url, trials_url))
+
+    print(f"{'concurrency':>11} {'wall (s)':>9} {'mean lat (s)':>13} {'req/s':>7}")
+    for level in (int(x) for x in args.levels.split(",")):
+        result = asyncio.run(run_level(app_url, level))
+        print(f"{result['concurrency']:>11} {result['wall_s']:>9.2f} "
+              f"{result['mean_latency_s']:>13.2f} {result['throughput_rps']:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# eligibility pre-filter benchmark: time to check a candidate list against a patient, and how many
+# trials in the LLM ranking shortlist the patient is excluded from with and without the filter
+# usage (from the repo root): python -m benchmarks.bench_eligibility [--candidates 200,1000]
+import argparse
+import time
+from .stubs import EXTRACTION, make_study
+from src.eligibility import eligibility_mask, eligible_trials, patient_age, patient_sex
+from src.prerank import prerank_trials
+from src.trial_service import short_trial
+
+RANK_TOP_K = 30
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--candidates", default="200,1000")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    age, sex = patient_age(EXTRACTION["patient_dob"]), patient_sex(EXTRACTION["patient_gender"])
+    print(f"patient: {age:.0f} years, {sex}; shortlist = top {RANK_TOP_K} by pre-rank score")
+    print(f"{'candidates':>10} {'check (ms)':>11} {'us/trial':>9} {'eligible':>9} "
+          f"{'ineligible in shortlist (before/after)':>40}")
+    for count in (int(x) for x in args.candidates.split(",")):
+        trials = [short_trial(make_study(i)) for i in range(count)]
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            mask = eligibility_mask(trials, age, sex)
+        elapsed = (time.perf_counter() - started) / args.repeat
+
+        eligible_ids = {t["nct_id"] for t, keep in zip(trials, mask) if keep}
+        before = prerank_trials(trials, EXTRACTION, RANK_TOP_K)
+        after = prerank_trials(eligible_trials(trials, EXTRACTION), EXTRACTION, RANK_TOP_K)
+        ineligible_before = sum(t["nct_id"] not in eligible_ids for t in before)
+        ineligible_after = sum(t["nct_id"] not in eligible_ids for t in after)
+        print(f"{count:>10} {elapsed * 1000:>11.3f} {elapsed / count * 1e6:>9.2f} {len(eligible_ids):>9} "
+              f"{f'{ineligible_before}/{ineligible_after}':>40}")
+
+
+if __name__ == "__main__":
+    main()
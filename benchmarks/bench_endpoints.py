@@ -0,0 +1,202 @@
+# end-to-end endpoint benchmark: p50/p95/p99 latency and throughput of upload_transcript,
+# get_trial_ranking, ask_ai_about_trial and a trial list page at several concurrency levels,
+# against the stubs (synthetic, replayed or recording answers, with latency and error rates).
+# --json writes the results for regression comparison; --compare checks them against an earlier
+# file and exits 1 when a scenario got slower or lost throughput beyond --threshold.
+# usage (from the repo root): python -m benchmarks.bench_endpoints [--concurrency 1,8,32] [--requests 64]
+#     [--json results.json] [--compare baseline.json] [--replay recording.json]
+#     [--record recording.json --llm-upstream https://api.openai.com/v1 --trials-upstream https://clinicaltrials.gov]
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+import httpx
+from .bench_concurrency import TRANSCRIPT, load_app
+from .stubs import Recording, create_llm_stub, create_trials_stub, serve_in_thread
+
+SCENARIOS = ("upload_transcript", "get_trial_ranking", "ask_ai_about_trial", "trials_page")
+
+
+def request_for(scenario: str, i: int, notes: list):
+    """(method, path, json body, check) of the i-th request of a scenario; check(response) -> ok."""
+    note = notes[i % len(notes)]
+    if scenario == "upload_transcript":
+        body = {"transcript": f"{TRANSCRIPT} [{uuid.uuid4()}]"}
+        return "POST", "/api/v1/transcripts", body, lambda r: r.status_code == 201
+    if scenario == "get_trial_ranking":
+        # recompute and wait for it, so the request covers the LLM ranking call
+        path = f"/api/v1/transcripts/{note['id']}/trials/ranking?refresh=true&wait=60"
+        return "GET", path, None, lambda r: r.status_code == 200 and r.json()["status"] == "ready"
+    if scenario == "ask_ai_about_trial":
+        body = {"clinical_notes_id": note["id"], "nct_id": note["nct_id"],
+                "query": f"Is the patient eligible for this trial? ({uuid.uuid4()})"}
+        return "POST", "/api/v1/trials/ask_ai", body, lambda r: r.status_code == 200
+    return "GET", f"/api/v1/transcripts/{note['id']}/trials?limit=25&sort=relevance", None, \
+        lambda r: r.status_code == 200
+
+
+def percentiles(latencies: list) -> dict:
+    if len(latencies) < 2:
+        value = latencies[0] * 1000 if latencies else 0.0
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {"p50_ms": cuts[49] * 1000, "p95_ms": cuts[94] * 1000, "p99_ms": cuts[98] * 1000}
+
+
+async def run_scenario(http: httpx.AsyncClient, scenario: str, concurrency: int, requests: int, notes: list) -> dict:
+    counter = itertools.count()
+    latencies, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        while (i := next(counter)) < requests:
+            method, path, body, ok = request_for(scenario, i, notes)
+            started = time.perf_counter()
+            try:
+                response = await http.request(method, path, json=body)
+                passed = ok(response)
+            except httpx.HTTPError:
+                passed = False
+            if passed:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": len(latencies) / wall,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        **percentiles(latencies),
+    }
+
+
+async def upload_notes(http: httpx.AsyncClient, count: int) -> list:
+    """Notes for the read and ask-AI scenarios, with their rankings done."""
+    async def one():
+        response = await http.post("/api/v1/transcripts", json={"transcript": f"{TRANSCRIPT} [{uuid.uuid4()}]"})
+        response.raise_for_status()
+        data = response.json()
+        await http.get(f"/api/v1/transcripts/{data['clinical_notes_id']}/trials/ranking?wait=60")
+        return {"id": data["clinical_notes_id"], "nct_id": data["trials"][0]["nct_id"]}
+    return list(await asyncio.gather(*(one() for _ in range(count))))
+
+
+async def run_all(app_url: str, scenarios: list, levels: list, requests: int) -> list:
+    async with httpx.AsyncClient(base_url=app_url, timeout=300) as http:
+        notes = await upload_notes(http, max(levels))
+        results = []
+        for scenario in scenarios:
+            for concurrency in levels:
+                results.append(await run_scenario(http, scenario, concurrency, requests, notes))
+                print_result(results[-1])
+    return results
+
+
+def print_result(r: dict):
+    print(f"{r['scenario']:>20} {r['concurrency']:>5} {r['throughput_rps']:>8.2f} {r['p50_ms']:>9.1f} "
+          f"{r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['errors']:>6}")
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+
+def compare(results: list, baseline_path: str, threshold: float) -> bool:
+    """Print the change of each scenario against the baseline file; True when any regressed."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\ncompared with {baseline.get('commit', '?')} ({baseline_path}), threshold {threshold:.0%}")
+    print(f"{'scenario':>20} {'conc':>5} {'req/s':>16} {'p95 (ms)':>20}")
+    regressed = False
+    for r in results:
+        old = before.get((r["scenario"], r["concurrency"]))
+        if old is None:
+            continue
+        slower = old["p95_ms"] and r["p95_ms"] > old["p95_ms"] * (1 + threshold)
+        fewer = old["throughput_rps"] and r["throughput_rps"] < old["throughput_rps"] * (1 - threshold)
+        worse = bool(slower or fewer or r["errors"] > old["errors"])
+        regressed |= worse
+        flag = "  REGRESSION" if worse else ""
+        rps = f"{old['throughput_rps']:.2f} -> {r['throughput_rps']:.2f}"
+        p95 = f"{old['p95_ms']:.1f} -> {r['p95_ms']:.1f}"
+        print(f"{r['scenario']:>20} {r['concurrency']:>5} {rps:>16} {p95:>20}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=64, help="requests per scenario and concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--trials-latency", type=float, default=0.2)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--trials-error-rate", type=float, default=0.0)
+    parser.add_argument("--replay", help="recording to answer from (synthetic answers for anything not in it)")
+    parser.add_argument("--record", help="recording file to write; needs --llm-upstream and --trials-upstream")
+    parser.add_argument("--llm-upstream", help="OpenAI base url to record from, e.g. https://api.openai.com/v1")
+    parser.add_argument("--trials-upstream", help="ClinicalTrials.gov url to record from, e.g. https://clinicaltrials.gov")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative p95/throughput change that counts as a regression")
+    args = parser.parse_args()
+    if args.record and not (args.llm_upstream and args.trials_upstream):
+        parser.error("--record needs --llm-upstream and --trials-upstream")
+
+    recording = Recording(args.record or args.replay) if (args.record or args.replay) else None
+    llm_stub = create_llm_stub(args.llm_latency, error_rate=args.llm_error_rate, recording=recording,
+                               upstream=args.llm_upstream if args.record else None)
+    trials_stub = create_trials_stub(args.trials_latency, error_rate=args.trials_error_rate, recording=recording,
+                                     upstream=args.trials_upstream if args.record else None)
+    llm_url, trials_url = serve_in_thread(llm_stub), serve_in_thread(trials_stub)
+    app_url = serve_in_thread(load_app(f"{llm_url}/v1", f"{trials_url}/api/v2/studies"))
+    # the app logs every upstream request at INFO, and so would the benchmark's own client
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    levels = [int(x) for x in args.concurrency.split(",")]
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    print(f"{args.requests} requests per level; LLM {args.llm_latency}s, trials {args.trials_latency}s; "
+          f"error rates {args.llm_error_rate}/{args.trials_error_rate}")
+    print(f"{'scenario':>20} {'conc':>5} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'errors':>6}")
+    results = asyncio.run(run_all(app_url, scenarios, levels, args.requests))
+
+    if args.record:
+        recording.save()
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+        "stub_answers": {"llm": llm_stub.state.answers, "trials": trials_stub.state.answers},
+        "results": results,
+    }
+    print(f"stub answers: {report['stub_answers']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
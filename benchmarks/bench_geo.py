@@ -0,0 +1,80 @@
+# distance query benchmark: a page of trials within a radius of the patient, and of all trials by
+# nearest site, from the list's site grid vs a per-site Python haversine scan of the whole list
+# usage (from the repo root): python -m benchmarks.bench_geo [--sizes 200,1000,5000] [--sites 1,20]
+import argparse
+import math
+import random
+import time
+from .stubs import make_study
+from src.geo import EARTH_RADIUS_KM
+from src.trial_lists import build_list_index, page_trials
+from src.trial_service import short_trial
+
+PATIENT = (42.2626, -71.8023)  # Worcester, MA (about 60 km from the Boston sites)
+RADIUS_KM = 100
+
+
+def with_sites(trial: dict, count: int, rng: random.Random) -> dict:
+    """Adds sites scattered over North America and Europe, for multi-site trials."""
+    extra = [[round(rng.uniform(25, 55), 2), round(rng.choice((rng.uniform(-125, -65), rng.uniform(-10, 30))), 2)]
+             for _ in range(count - len(trial["sites"]))]
+    return {**trial, "sites": trial["sites"] + extra}
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def full_scan(trials: list, limit: int, radius_km=None) -> list:
+    nearest = []
+    for trial in trials:
+        distance = min((haversine(*PATIENT, lat, lon) for lat, lon in trial["sites"]), default=math.inf)
+        if radius_km is None or distance <= radius_km:
+            nearest.append((distance, trial))
+    nearest.sort(key=lambda pair: pair[0])
+    return [{**trial, "distance_km": round(distance, 1)} for distance, trial in nearest[:limit]]
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="200,1000,5000")
+    parser.add_argument("--sites", default="1,20", help="minimum sites per trial")
+    parser.add_argument("--limit", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"patient near {PATIENT}; radius {RADIUS_KM} km; page of {args.limit}")
+    print(f"{'trials':>7} {'sites':>7} {'query':>14} {'full scan (ms)':>15} {'indexed (ms)':>13} {'matches':>8}")
+    for size in (int(x) for x in args.sizes.split(",")):
+        base = [short_trial(make_study(i)) for i in range(size)]
+        for sites in (int(x) for x in args.sites.split(",")):
+            rng = random.Random(size * 31 + sites)
+            trials = [with_sites(t, sites, rng) for t in base]
+            site_count = sum(len(t["sites"]) for t in trials)
+            started = time.perf_counter()
+            index = build_list_index(trials)
+            build_ms = (time.perf_counter() - started) * 1000
+            for name, radius in (("within radius", RADIUS_KM), ("nearest first", None)):
+                scan_ms = timed(lambda: full_scan(trials, args.limit, radius), args.repeat)
+                page_ms = timed(lambda: page_trials(
+                    trials, index, "distance", limit=args.limit, near=PATIENT, radius_km=radius
+                ), args.repeat)
+                expected = full_scan(trials, args.limit, radius)
+                page = page_trials(trials, index, "distance", limit=args.limit, near=PATIENT, radius_km=radius)
+                assert [t["distance_km"] for t in page["trials"]] == [t["distance_km"] for t in expected]
+                matches = sum(1 for t in full_scan(trials, size, radius))
+                print(f"{size:>7} {site_count:>7} {name:>14} {scan_ms:>15.3f} {page_ms:>13.3f} {matches:>8}")
+            print(f"{'':>7} {'':>7} {'(index build)':>14} {build_ms:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# pre-ranker benchmark: local BM25 shortlist vs sending the first 40 API results to the LLM
+# usage (from the repo root): python -m benchmarks.bench_prerank
+import math
+import time
+from .stubs import EXTRACTION, make_study
+from src.prerank import prerank_trials
+from src.trial_service import short_trial
+
+LLM_CANDIDATES = 40   # what the LLM-only path ranked: the first 40 results in API order
+SHORTLIST = 30        # what goes to the LLM after pre-ranking
+
+
+def grade(study: dict) -> int:
+    # fixture relevance label: 2 = matches a patient condition and intervention, 1 = one of them
+    protocol = study["protocolSection"]
+    conditions = set(protocol["conditionsModule"]["conditions"])
+    interventions = {i["name"] for i in protocol["armsInterventionsModule"]["interventions"]}
+    return int(bool(conditions & set(EXTRACTION["conditions"]))) + \
+        int(bool(interventions & set(EXTRACTION["interventions"])))
+
+
+def ndcg(grades: list, k: int, ideal: list) -> float:
+    dcg = sum((2 ** g - 1) / math.log2(i + 2) for i, g in enumerate(grades[:k]))
+    idcg = sum((2 ** g - 1) / math.log2(i + 2) for i, g in enumerate(sorted(ideal, reverse=True)[:k]))
+    return dcg / idcg if idcg else 0.0
+
+
+def prompt_tokens(trials: list) -> int:
+    return len(f"Trial list - {trials}") // 4
+
+
+def main():
+    print(f"{'candidates':>10} {'method':>10} {'ms':>8} {'recall':>7} {'ndcg@10':>8} {'prompt tok':>11}")
+    for n in (100, 200, 500, 1000):
+        studies = [make_study(i) for i in range(n)]
+        grades = {study["protocolSection"]["identificationModule"]["nctId"]: grade(study) for study in studies}
+        trials = [short_trial(study) for study in studies]
+        relevant = sum(1 for g in grades.values() if g)
+
+        llm_input = trials[:LLM_CANDIDATES]
+        found = [grades[t["nct_id"]] for t in llm_input]
+        print(f"{n:>10} {'api order':>10} {0:>8.2f} {sum(1 for g in found if g) / relevant:>7.2f} "
+              f"{ndcg(found, 10, list(grades.values())):>8.3f} {prompt_tokens(llm_input):>11}")
+
+        started = time.perf_counter()
+        for _ in range(20):
+            shortlist = prerank_trials(trials, EXTRACTION, SHORTLIST)
+        elapsed = (time.perf_counter() - started) / 20 * 1000
+        found = [grades[t["nct_id"]] for t in shortlist]
+        llm_input = [{k: t[k] for k in ("nct_id", "conditions", "interventions")} for t in shortlist]
+        print(f"{n:>10} {'bm25':>10} {elapsed:>8.2f} {sum(1 for g in found if g) / relevant:>7.2f} "
+              f"{ndcg(found, 10, list(grades.values())):>8.3f} {prompt_tokens(llm_input):>11}")
+
+
+if __name__ == "__main__":
+    main()
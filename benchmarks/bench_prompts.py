@@ -0,0 +1,77 @@
+# prompt size report: input tokens and output budgets before/after the compact prompt builder
+# usage (from the repo root): python -m benchmarks.bench_prompts [--trials 30]
+import argparse
+import json
+from . import stubs
+from src.trial_service import short_trial, long_trial
+from src.prompt_builder import (
+    count_tokens, encoding, ranking_content, ranking_max_tokens, trial_context, ask_ai_content,
+    EXTRACTION_MAX_TOKENS, ASK_AI_MAX_TOKENS,
+)
+
+# a registry-sized criteria list; the stub fixture's eight items are shorter than most real studies
+LONG_ELIGIBILITY = stubs.ELIGIBILITY.format(cond="Type 2 Diabetes").replace("\n\nExclusion Criteria:", "\n" + "\n".join([
+    "* Body mass index between 25 and 45 kg/m2 at screening",
+    "* Treated with metformin at a stable dose of at least 1500 mg/day for 90 days before screening",
+    "* Women of child-bearing potential must use a highly effective method of contraception",
+    "* Willing to perform self-monitoring of blood glucose and complete a patient diary",
+    "* Estimated glomerular filtration rate of at least 45 mL/min/1.73m2 at screening",
+]) + "\n\nExclusion Criteria:") + "\n".join([
+    "* Type 1 diabetes or latent autoimmune diabetes in adults",
+    "* Treatment with any GLP-1 receptor agonist, DPP-4 inhibitor or insulin within 90 days",
+    "* Personal or family history of medullary thyroid carcinoma or multiple endocrine neoplasia type 2",
+    "* Proliferative retinopathy or maculopathy requiring acute treatment",
+    "* Myocardial infarction, stroke or hospitalisation for unstable angina within 180 days",
+    "* Heart failure classified as New York Heart Association class IV",
+    "* Uncontrolled hypertension (systolic blood pressure of 180 mmHg or more)",
+    "* Known or suspected hypersensitivity to the trial product or related products",
+    "* Alanine aminotransferase above 2.5 times the upper limit of normal",
+    "* Any malignant neoplasm within the past 5 years, other than basal or squamous cell skin cancer",
+    "* Use of systemic corticosteroids for more than 14 consecutive days within 90 days",
+    "* Any condition which, in the investigator's opinion, might jeopardise the patient's safety",
+]) + "\n"
+
+QUESTION = "Would the patient's HbA1c and kidney function qualify her, and is her metformin dose a problem?"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trials", type=int, default=30)
+    args = parser.parse_args()
+
+    # the note stores the model output as returned: indented JSON
+    patient_summary = json.dumps(stubs.EXTRACTION, indent=2)
+    ranking_prompt = open("prompts/ranking_prompt.txt", encoding="utf8").read()
+    ask_ai_prompt = open("prompts/ask_ai_prompt.txt", encoding="utf8").read()
+    shortlist = [short_trial(stubs.make_study(i)) for i in range(args.trials)]
+
+    study = stubs.make_study(1)
+    study["protocolSection"]["eligibilityModule"]["eligibilityCriteria"] = LONG_ELIGIBILITY
+    trial = long_trial(study, "NCT00000001")
+
+    rows = [
+        ("rank_trials",
+         f'Trial list - {shortlist}\nSummary - {patient_summary}', 10000,
+         ranking_content(shortlist, patient_summary), ranking_max_tokens(len(shortlist)), ranking_prompt),
+        ("ask_ai",
+         f'Patient Summary:\n{patient_summary}\n\nTrial Details:\n{json.dumps(trial, indent=2)}\n\nUser Question: {QUESTION}',
+         10000,
+         ask_ai_content(QUESTION, patient_summary, trial_context(trial, QUESTION, patient_summary)),
+         ASK_AI_MAX_TOKENS, ask_ai_prompt),
+        ("extract", "", 10000, "", EXTRACTION_MAX_TOKENS, ""),
+    ]
+
+    print(f"token counts from {'tiktoken o200k_base' if encoding() else 'word-piece estimate (tiktoken not installed)'}")
+    print(f"{'call':<12} {'input before':>12} {'input after':>11} {'saved':>6} {'max_tokens before':>17} {'after':>6}")
+    for name, before, before_budget, after, after_budget, prompt in rows:
+        if before:
+            system = count_tokens(prompt)
+            tokens_before, tokens_after = system + count_tokens(before), system + count_tokens(after)
+            saved = f"{1 - tokens_after / tokens_before:.0%}"
+        else:
+            tokens_before = tokens_after = saved = "-"
+        print(f"{name:<12} {tokens_before:>12} {tokens_after:>11} {saved:>6} {before_budget:>17} {after_budget:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# re-match benchmark: finding new trials for stored notes with a fresh search per note vs the
+# incremental re-match (one query for recently updated studies + the inverted note index)
+# usage (from the repo root): python -m benchmarks.bench_rematch [--notes 200,1000]
+# the stub ignores query.cond/query.intr, so the per-note searches are compared on cost only
+import argparse
+import asyncio
+import random
+import time
+from .stubs import CONDITIONS, INTERVENTIONS, create_trials_stub, serve_in_thread
+from src import rematch
+from src.storage import save_data_async, list_keys_async, delete_data_async
+from src.trial_service import get_params, relevant_trials, search_cache
+
+SINCE = "2025-06-01"
+
+
+def make_patients(count: int) -> list:
+    rng = random.Random(count)
+    return [
+        {
+            "conditions": rng.sample(CONDITIONS, rng.randint(1, 2)),
+            "interventions": rng.sample(INTERVENTIONS, rng.randint(1, 2)),
+        }
+        for _ in range(count)
+    ]
+
+
+async def store_notes(patients: list):
+    for key in await list_keys_async("notes/"):
+        await delete_data_async(key)
+    await delete_data_async(rematch.STATE_KEY)
+    for i, patient_data in enumerate(patients):
+        await save_data_async(f"notes/bench-{i:05d}.json", {"patient_data": patient_data, "trials": []})
+
+
+async def per_note_searches(stub, base_url: str, patients: list, limit: int) -> tuple:
+    stub.state.page_requests = 0
+    started = time.perf_counter()
+    for patient_data in patients:
+        search_cache.clear()
+        await relevant_trials(base_url, get_params(patient_data), limit=limit)
+    return time.perf_counter() - started, stub.state.page_requests
+
+
+async def incremental(stub, base_url: str) -> tuple:
+    rematch.note_index = rematch.NoteIndex()
+    stub.state.page_requests = 0
+    started = time.perf_counter()
+    summary = await rematch.run_rematch(base_url, SINCE)
+    return time.perf_counter() - started, stub.state.page_requests, summary
+
+
+async def run(stub, base_url: str, count: int, limit: int):
+    patients = make_patients(count)
+    await store_notes(patients)
+    elapsed, pages = await per_note_searches(stub, base_url, patients, limit)
+    print(f"{count:>6} {'per-note':>12} {pages:>6} {elapsed:>9.2f} {'-':>8}")
+    elapsed, pages, summary = await incremental(stub, base_url)
+    print(f"{count:>6} {'incremental':>12} {pages:>6} {elapsed:>9.2f} {summary['trials_added']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--studies", type=int, default=5000)
+    parser.add_argument("--notes", default="200,1000")
+    parser.add_argument("--limit", type=int, default=200, help="trials fetched per note by the per-note search")
+    args = parser.parse_args()
+
+    stub = create_trials_stub(args.latency, args.studies)
+    base_url = f"{serve_in_thread(stub)}/api/v2/studies"
+
+    print(f"studies updated since {SINCE} out of {args.studies}; per-note search limit {args.limit}")
+    print(f"{'notes':>6} {'method':>12} {'pages':>6} {'time (s)':>9} {'matches':>8}")
+    for count in (int(x) for x in args.notes.split(",")):
+        asyncio.run(run(stub, base_url, count, args.limit))
+
+
+if __name__ == "__main__":
+    main()
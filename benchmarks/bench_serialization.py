@@ -0,0 +1,87 @@
+# response serialization benchmark for a clinical note (short trial records) and a trial batch (detail
+# records), as sent by default: time to validate and serialize through the pydantic response models
+# (what FastAPI did before), with json.dumps, and with records.dumps (orjson, or pydantic-core without
+# it); payload sizes in full, with ?fields= trimming and gzipped; and the memory the interned
+# enum-like values save per record
+# usage (from the repo root): python -m benchmarks.bench_serialization [--sizes 40,400,4000]
+import argparse
+import gzip
+import json
+import time
+import tracemalloc
+from pydantic import TypeAdapter
+from .stubs import make_study
+from src.main import ClinicalNotesResponse, TrialBatchResponse
+from src.records import compact, dumps, orjson
+from src.trial_lists import trim
+from src.trial_service import long_trial, short_trial
+
+PATIENT = {
+    "patient_name": "Jane Doe", "patient_dob": "1971-03-02", "patient_gender": "female",
+    "chief_complaint": "poorly controlled blood sugar", "conditions": ["Type 2 Diabetes", "Hypertension"],
+    "current_medications": ["metformin 1000 mg"], "allergies": [], "past_medical_history": ["Hypertension"],
+    "family_history": [], "social_history": [], "test_results": ["HbA1c 8.4%"], "contradictions": [],
+    "proposed_plan": "add a GLP-1 agonist", "interventions": ["semaglutide"], "concerns": "",
+}
+NOTE_FIELDS = ["conditions", "status", "phases"]
+BATCH_FIELDS = ["title", "status", "phases", "conditions", "locations", "age", "sex"]
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def interned_savings(size: int) -> float:
+    """Bytes per record saved by compact(): records parsed back from JSON, as stored notes and cache files are."""
+    text = json.dumps([short_trial(make_study(i)) for i in range(size)])
+    sizes = []
+    for intern in (False, True):
+        tracemalloc.start()
+        records = json.loads(text)
+        if intern:
+            records = [compact(record) for record in records]
+        sizes.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        del records
+    return (sizes[0] - sizes[1]) / size
+
+
+def report(name: str, size: int, model, content: dict, trimmed: dict, repeat: int):
+    adapter = TypeAdapter(model)
+    pydantic_ms = timed(lambda: adapter.dump_json(adapter.validate_python(content)), repeat)
+    json_ms = timed(lambda: json.dumps(content).encode(), repeat)
+    fast_ms = timed(lambda: dumps(content), repeat)
+    full, small = dumps(content), dumps(trimmed)
+    print(f"{name:>6} {size:>6} {pydantic_ms:>14.3f} {json_ms:>11.3f} {fast_ms:>11.3f} "
+          f"{len(full):>11} {len(gzip.compress(full)):>9} {len(small):>12} {len(gzip.compress(small)):>13}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="40,400,4000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"serializer: {'orjson ' + orjson.__version__ if orjson else 'pydantic-core (orjson not installed)'}; "
+          f"note trimmed to {','.join(NOTE_FIELDS)}, batch to {','.join(BATCH_FIELDS)}")
+    print(f"{'':>6} {'trials':>6} {'pydantic (ms)':>14} {'json (ms)':>11} {'fast (ms)':>11} "
+          f"{'full bytes':>11} {'gzipped':>9} {'fields bytes':>12} {'fields gzipped':>13}")
+    for size in (int(x) for x in args.sizes.split(",")):
+        studies = [make_study(i) for i in range(size)]
+        trials = [{**short_trial(study), "prerank_score": (i * 7919 % 1000) / 100} for i, study in enumerate(studies)]
+        note = {"clinical_notes_id": "bench", "patient_data": PATIENT, "trials": [trim(trial) for trial in trials],
+                "created_at": "2026-01-01T00:00:00", "total_trials_found": size, "cached": False}
+        report("note", size, ClinicalNotesResponse, note,
+               {**note, "trials": [trim(trial, NOTE_FIELDS) for trial in trials]}, args.repeat)
+
+        details = {study["protocolSection"]["identificationModule"]["nctId"]: long_trial(study, "") for study in studies}
+        report("batch", size, TrialBatchResponse, {"trials": {k: trim(v) for k, v in details.items()}},
+               {"trials": {k: trim(v, BATCH_FIELDS) for k, v in details.items()}}, args.repeat)
+    print(f"interned status/phases/sex: {interned_savings(4000):.0f} bytes less per short record")
+
+
+if __name__ == "__main__":
+    main()
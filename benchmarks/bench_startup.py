@@ -0,0 +1,82 @@
+# startup benchmark: import time of src.main and time from process start to the first answered
+# request (/healthz) and to readiness (/readyz) for a uvicorn server, each in a fresh process
+# usage (from the repo root): python -m benchmarks.bench_startup [--repeat 5]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from .stubs import free_port
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import src.main; print(time.perf_counter() - t)"
+
+
+def environment(tmp: str) -> dict:
+    return {
+        **os.environ,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "stub"),
+        "STORAGE_BACKEND": "sqlite",
+        "STORAGE_SQLITE_PATH": os.path.join(tmp, "storage.db"),
+    }
+
+
+def import_time(env: dict) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def wait_for(http: httpx.Client, url: str, started: float, deadline: float) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            if http.get(url).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(url)
+
+
+def server_times(env: dict, health_path: str, ready_path: str) -> tuple:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = started + 60
+        with httpx.Client(timeout=1) as http:
+            first = wait_for(http, f"http://127.0.0.1:{port}{health_path}", started, deadline)
+            ready = wait_for(http, f"http://127.0.0.1:{port}{ready_path}", started, deadline)
+    finally:
+        server.terminate()
+        server.wait()
+    return first, ready
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--health-path", default="/healthz")
+    parser.add_argument("--ready-path", default="/readyz")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = environment(tmp)
+        imports = [import_time(env) for _ in range(args.repeat)]
+        servers = [server_times(env, args.health_path, args.ready_path) for _ in range(args.repeat)]
+
+    print(f"{'':>28} {'median (s)':>11} {'min (s)':>8}")
+    for name, values in (
+        ("import src.main", imports),
+        ("first request", [first for first, _ in servers]),
+        ("ready", [ready for _, ready in servers]),
+    ):
+        print(f"{name:>28} {statistics.median(values):>11.3f} {min(values):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
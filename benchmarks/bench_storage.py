@@ -0,0 +1,72 @@
+# storage micro-benchmark: put/get/list/load_many throughput per backend
+# usage (from the repo root): python -m benchmarks.bench_storage [--ops 2000]
+# the s3 backend is measured against moto's in-process mock when moto is installed
+import argparse
+import os
+import tempfile
+import time
+from .stubs import make_study
+from src import storage
+from src.trial_service import long_trial
+
+
+def measure(backend: storage.StorageBackend, ops: int) -> dict:
+    storage.backend = backend
+    records = [long_trial(make_study(i), f"NCT{i:08d}") for i in range(ops)]
+    keys = [f"saved-trials/{record['nct_id']}.json" for record in records]
+    results = {}
+
+    started = time.perf_counter()
+    for key, record in zip(keys, records):
+        storage.save_data(key, record)
+    results["put/s"] = ops / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for key in keys:
+        storage.load_data(key)
+    results["get/s"] = ops / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(10):
+        listed = storage.list_keys("saved-trials/")
+    results["list/s"] = 10 / (time.perf_counter() - started)
+    assert len(listed) == ops
+
+    started = time.perf_counter()
+    storage.load_many(keys)
+    results["load_many keys/s"] = ops / (time.perf_counter() - started)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [
+            ("memory", lambda: storage.MemoryBackend()),
+            ("sqlite", lambda: storage.SQLiteBackend(os.path.join(tmp, "storage.db"))),
+        ]
+        try:
+            from moto import mock_aws
+            backends.append(("s3 (moto)", None))
+        except ImportError:
+            print("moto not installed, skipping s3")
+
+        print(f"{'backend':>10} {'put/s':>10} {'get/s':>10} {'list/s':>8} {'load_many keys/s':>17}")
+        for name, factory in backends:
+            if factory is None:
+                os.environ.update(AWS_ACCESS_KEY_ID="bench", AWS_SECRET_ACCESS_KEY="bench")
+                with mock_aws():
+                    import boto3
+                    boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="bench")
+                    results = measure(storage.S3Backend("bench", "us-east-1"), args.ops)
+            else:
+                results = measure(factory(), args.ops)
+            print(f"{name:>10} {results['put/s']:>10.0f} {results['get/s']:>10.0f} "
+                  f"{results['list/s']:>8.1f} {results['load_many keys/s']:>17.0f}")
+
+
+if __name__ == "__main__":
+    main()
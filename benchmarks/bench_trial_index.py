@@ -0,0 +1,45 @@
+# local trial index benchmark: build time and query latency over synthetic studies
+# usage (from the repo root): python -m benchmarks.bench_trial_index [--studies 20000]
+import argparse
+import os
+import tempfile
+import time
+from .stubs import make_study
+from src.trial_index import TrialIndex
+
+QUERIES = [
+    {"query.cond": "Type 2 Diabetes OR Hypertension", "query.intr": "Semaglutide OR Metformin"},
+    {"query.cond": "Breast Cancer", "query.intr": "Pembrolizumab"},
+    {"query.cond": "Asthma OR COPD", "query.intr": ""},
+    {"query.cond": "Heart Failure", "query.intr": "Dapagliflozin",
+     "filter.overallStatus": "RECRUITING", "filter.sex": "FEMALE", "filter.age": 62},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--studies", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = TrialIndex(os.path.join(tmp, "trials.db"))
+        started = time.perf_counter()
+        index.load(make_study(i) for i in range(args.studies))
+        print(f"built index of {index.count()} studies in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        seen, changed = index.load(make_study(i) for i in range(args.studies))
+        print(f"no-op refresh of {seen} studies ({changed} changed) in {time.perf_counter() - started:.1f}s")
+
+        for params in QUERIES:
+            for limit in (40, 200):
+                started = time.perf_counter()
+                for _ in range(args.repeat):
+                    trials = index.search(params, limit)
+                elapsed = (time.perf_counter() - started) / args.repeat * 1000
+                print(f"{elapsed:>7.2f} ms  limit={limit:<4} hits={len(trials):<4} {params}")
+
+
+if __name__ == "__main__":
+    main()
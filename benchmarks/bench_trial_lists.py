@@ -0,0 +1,61 @@
+# trial list paging benchmark: a page from the precomputed list index vs filtering and sorting
+# the whole list per request (what the browser did before)
+# usage (from the repo root): python -m benchmarks.bench_trial_lists [--sizes 40,500,5000]
+import argparse
+import json
+import time
+from .stubs import make_study
+from src.trial_service import short_trial
+from src.trial_lists import build_list_index, page_trials, parse_filters, within_age, values_of
+
+QUERIES = {
+    "no filters": {},
+    "recruiting, female, 50-60": {"filters": parse_filters({"status": "RECRUITING", "sex": "FEMALE"}),
+                                  "min_age": 50, "max_age": 60},
+}
+
+
+def full_scan(trials: list, sort: str, limit: int, filters: dict = None, min_age=None, max_age=None) -> list:
+    filters = filters or {}
+    matching = [
+        t for t in trials
+        if all(set(values_of(t, name)) & set(values + (["ALL"] if name == "sex" else [])) for name, values in filters.items())
+        and within_age(t, min_age, max_age)
+    ]
+    key = (lambda t: t["last_update_post_date"]) if sort == "date" else (lambda t: t["prerank_score"])
+    return sorted(matching, key=key, reverse=True)[:limit]
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="40,500,5000")
+    parser.add_argument("--limit", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'trials':>7} {'query':>26} {'full scan (ms)':>15} {'indexed (ms)':>13} {'page bytes (all/3 fields)':>26}")
+    for size in (int(x) for x in args.sizes.split(",")):
+        trials = [{**short_trial(make_study(i)), "prerank_score": (i * 7919 % 1000) / 100} for i in range(size)]
+        started = time.perf_counter()
+        index = build_list_index(trials)
+        build_ms = (time.perf_counter() - started) * 1000
+        for name, query in QUERIES.items():
+            scan_ms = timed(lambda: full_scan(trials, "date", args.limit, **query), args.repeat)
+            page_ms = timed(lambda: page_trials(trials, index, "date", limit=args.limit, **query), args.repeat)
+            full = len(json.dumps(page_trials(trials, index, "date", limit=args.limit, **query)))
+            trimmed = len(json.dumps(page_trials(
+                trials, index, "date", limit=args.limit, fields=["conditions", "status"], **query
+            )))
+            print(f"{size:>7} {name:>26} {scan_ms:>15.3f} {page_ms:>13.3f} {f'{full}/{trimmed}':>26}")
+        print(f"{'':>7} {'(index build, once per note)':>26} {build_ms:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# trial search benchmark: relevant_trials against a local fake ClinicalTrials.gov server, and a timing
+# check that stream_trials parses a page while the request for the next one is in flight
+# usage (from the repo root): python -m benchmarks.bench_trial_search
+import argparse
+import asyncio
+import time
+import httpx
+from .stubs import create_trials_stub, serve_in_thread
+from src import trial_service
+from src.trial_service import relevant_trials, short_trial, search_cache, search_cache_stats, stream_trials
+
+PARAMS = {"query.cond": "Type 2 Diabetes OR Hypertension", "query.intr": "Semaglutide OR Metformin"}
+# the same query as different patients' extractions phrase it
+VARIANTS = [
+    PARAMS,
+    {"query.cond": "hypertension OR type 2 diabetes", "query.intr": "metformin OR semaglutide"},
+    {"query.cond": "Type 2 Diabetes OR HYPERTENSION", "query.intr": "Metformin OR Semaglutide OR metformin"},
+]
+
+
+async def legacy_relevant_trials(base_url: str, params: dict, limit: int) -> list:
+    # the previous implementation: fixed pageSize of 30, strictly sequential pages,
+    # every page fetched up to the page cap and the result truncated afterwards
+    params = {**params, "pageSize": 30}
+    trials = []
+    async with httpx.AsyncClient(timeout=10) as http:
+        for _ in range(max(10, -(-limit // 30))):
+            data = (await http.get(base_url, params=params)).json()
+            trials.extend(short_trial(study) for study in data.get('studies', []))
+            if not data.get('nextPageToken'):
+                break
+            params['pageToken'] = data['nextPageToken']
+    return trials[:limit]
+
+
+async def measure(stub, search, base_url: str, limit: int, repeat: int) -> tuple:
+    stub.state.page_requests = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        trials = await search(base_url, PARAMS, limit)
+    elapsed = (time.perf_counter() - started) / repeat
+    return elapsed, stub.state.page_requests / repeat, len(trials)
+
+
+async def burst(stub, base_url: str, limit: int, size: int) -> tuple:
+    # `size` similar uploads at once, then the same again while the result is cached
+    search_cache.clear()
+    stub.state.page_requests = 0
+    avoided = search_cache_stats()["upstream_searches_avoided"]
+    started = time.perf_counter()
+    await asyncio.gather(*(relevant_trials(base_url, VARIANTS[i % len(VARIANTS)], limit=limit) for i in range(size)))
+    await asyncio.gather(*(relevant_trials(base_url, VARIANTS[i % len(VARIANTS)], limit=limit) for i in range(size)))
+    elapsed = time.perf_counter() - started
+    return elapsed, stub.state.page_requests, search_cache_stats()["upstream_searches_avoided"] - avoided
+
+
+async def overlap(base_url: str, pages: int, parse_ms: float) -> tuple:
+    """(elapsed, request time, parse time) in seconds for `pages` full pages, each study's parse slowed
+    so a page takes about `parse_ms`; elapsed below request + parse time is time the two overlapped."""
+    spent = {"requests": 0.0, "parse": 0.0}
+
+    async def timed_get_json(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await get_json(*args, **kwargs)
+        finally:
+            spent["requests"] += time.perf_counter() - started
+
+    def slow_short_trial(study):
+        started = time.perf_counter()
+        time.sleep(parse_ms / 1000 / trial_service.MAX_PAGE_SIZE)
+        trial = short_trial(study)
+        spent["parse"] += time.perf_counter() - started
+        return trial
+
+    get_json = trial_service.get_json
+    trial_service.get_json, trial_service.short_trial = timed_get_json, slow_short_trial
+    try:
+        started = time.perf_counter()
+        async for _ in stream_trials(base_url, PARAMS, limit=pages * trial_service.MAX_PAGE_SIZE, pages=pages):
+            pass
+        return time.perf_counter() - started, spent["requests"], spent["parse"]
+    finally:
+        trial_service.get_json, trial_service.short_trial = get_json, short_trial
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.15, help="fixed latency per page request")
+    parser.add_argument("--per-study-latency", type=float, default=0.0005, help="extra latency per returned study")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--burst", type=int, default=20, help="concurrent similar searches for the coalescing run")
+    args = parser.parse_args()
+
+    stub = create_trials_stub(args.latency, total_studies=5000, per_study_latency=args.per_study_latency)
+    base_url = serve_in_thread(stub) + "/api/v2/studies"
+
+    async def current(url, params, limit):
+        # measure the search itself, not the search cache
+        search_cache.clear()
+        return await relevant_trials(url, params, limit=limit)
+
+    print(f"{'target':>6} {'impl':>8} {'latency (ms)':>13} {'pages':>6} {'trials':>7}")
+    for limit in (40, 200, 1000):
+        for name, search in (("before", legacy_relevant_trials), ("after", current)):
+            elapsed, pages, count = asyncio.run(measure(stub, search, base_url, limit, args.repeat))
+            print(f"{limit:>6} {name:>8} {elapsed * 1000:>13.1f} {pages:>6.1f} {count:>7}")
+
+    elapsed, pages, avoided = asyncio.run(burst(stub, base_url, 200, args.burst))
+    print(f"\nburst of 2 x {args.burst} similar searches: {elapsed * 1000:.1f} ms, {pages} upstream pages, "
+          f"{avoided} of {2 * args.burst} searches avoided")
+
+    elapsed, requests, parse = asyncio.run(overlap(base_url, 5, 200))
+    print(f"5 pages of {trial_service.MAX_PAGE_SIZE} with ~200 ms parse each: {elapsed * 1000:.1f} ms elapsed, "
+          f"{requests * 1000:.1f} ms in requests + {parse * 1000:.1f} ms parsing "
+          f"({(requests + parse - elapsed) * 1000:.1f} ms overlapped)")
+
+
+if __name__ == "__main__":
+    main()
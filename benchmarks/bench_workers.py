@@ -0,0 +1,136 @@
+# multi-worker load test: closed-loop clients upload a transcript, read the note back and fetch a
+# page of its trials against a uvicorn server with 1, 2, 4 and 8 workers (LLM and trials stubs in
+# their own processes). Reports throughput, upload latency, 404s on reads that landed on another
+# worker than the upload, and 429s from the concurrency limits.
+# usage (from the repo root): python -m benchmarks.bench_workers [--workers 1,2,4,8] [--clients 64] [--duration 15]
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import httpx
+from .bench_concurrency import TRANSCRIPT
+from .stubs import free_port
+
+
+def spawn(args: list, env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", *args, "--log-level", "warning"],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url: str, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    with httpx.Client(timeout=1) as http:
+        while time.perf_counter() < deadline:
+            try:
+                if http.get(url).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.05)
+    raise TimeoutError(url)
+
+
+def start_stub(factory: str, workers: int) -> tuple:
+    port = free_port()
+    process = spawn(["--factory", f"benchmarks.stubs:{factory}", "--port", str(port), "--workers", str(workers)],
+                    dict(os.environ))
+    wait_ready(f"http://127.0.0.1:{port}/docs")
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def run_clients(app_url: str, clients: int, duration: float) -> dict:
+    counts = {"flows": 0, "404": 0, "429": 0, "errors": 0}
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def client(http: httpx.AsyncClient):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            # a unique transcript, so every upload is a new extraction rather than an LLM cache hit
+            upload = await http.post("/api/v1/transcripts", json={"transcript": f"{TRANSCRIPT} [{uuid.uuid4()}]"})
+            if upload.status_code == 429:
+                counts["429"] += 1
+                await asyncio.sleep(float(upload.headers.get("Retry-After", "1")))
+                continue
+            if upload.status_code != 201:
+                counts["errors"] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            notes_id = upload.json()["clinical_notes_id"]
+            for path in (f"/api/v1/transcripts/{notes_id}", f"/api/v1/transcripts/{notes_id}/trials?limit=25"):
+                response = await http.get(path)
+                if response.status_code == 404:
+                    counts["404"] += 1
+            counts["flows"] += 1
+
+    started = time.perf_counter()
+    # a fresh connection per request, so requests are spread over the workers
+    limits = httpx.Limits(max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=app_url, timeout=120, limits=limits) as http:
+        await asyncio.gather(*(client(http) for _ in range(clients)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        **counts,
+        "flows_per_s": counts["flows"] / wall,
+        "p50_s": statistics.median(latencies) if latencies else 0.0,
+        "p95_s": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+    }
+
+
+def run_level(workers: int, args, llm_url: str, trials_url: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "OPENAI_API_KEY": "stub",
+            "OPENAI_BASE_URL": f"{llm_url}/v1",
+            "CLINICAL_TRIALS_API_URL": f"{trials_url}/api/v2/studies",
+            "CTGOV_RATE_LIMIT": "0",
+            "STORAGE_BACKEND": "sqlite",
+            "STORAGE_SQLITE_PATH": os.path.join(tmp, "storage.db"),
+            "SHARED_STATE_DIR": os.path.join(tmp, "state"),
+            "WEB_CONCURRENCY": str(workers),
+            "LLM_MAX_CONCURRENCY": str(args.llm_concurrency),
+        }
+        port = free_port()
+        server = spawn(["src.main:app", "--port", str(port)], env)
+        try:
+            wait_ready(f"http://127.0.0.1:{port}/readyz")
+            return asyncio.run(run_clients(f"http://127.0.0.1:{port}", args.clients, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--llm-concurrency", type=int, default=256, help="LLM_MAX_CONCURRENCY for the deployment")
+    parser.add_argument("--stub-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    stubs = [start_stub("create_llm_stub", args.stub_workers), start_stub("create_trials_stub", args.stub_workers)]
+    (_, llm_url), (_, trials_url) = stubs
+    try:
+        print(f"{args.clients} clients for {args.duration:.0f}s per level; LLM_MAX_CONCURRENCY={args.llm_concurrency}")
+        print(f"{'workers':>7} {'flows/s':>8} {'upload p50 (s)':>15} {'upload p95 (s)':>15} "
+              f"{'404s':>5} {'429s':>5} {'errors':>7}")
+        for workers in (int(x) for x in args.workers.split(",")):
+            result = run_level(workers, args, llm_url, trials_url)
+            print(f"{workers:>7} {result['flows_per_s']:>8.2f} {result['p50_s']:>15.3f} {result['p95_s']:>15.3f} "
+                  f"{result['404']:>5} {result['429']:>5} {result['errors']:>7}")
+    finally:
+        for process, _ in stubs:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+# local stub servers for the OpenAI chat completions API and the ClinicalTrials.gov v2 API
+# used by the benchmarks so that they measure our code and not the network. Answers are
+# synthetic, or replayed from a recording of real responses; with an upstream url a stub proxies
+# to the real API and records what it answers. Latency and error rate are configurable.
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+from typing import Optional
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# the stubs have no request quota, so turn off the client-side ClinicalTrials.gov rate limit,
+# and keep benchmark data out of the local storage file
+# (benchmarks import this module before anything from src)
+os.environ.setdefault("CTGOV_RATE_LIMIT", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+CONDITIONS = [
+    "Type 2 Diabetes", "Hypertension", "Breast Cancer", "Asthma", "Heart Failure",
+    "Chronic Kidney Disease", "Obesity", "Major Depressive Disorder", "COPD", "Migraine",
+    "Rheumatoid Arthritis", "Atrial Fibrillation", "Lung Cancer", "Psoriasis", "Osteoarthritis",
+]
+INTERVENTIONS = [
+    "Metformin", "Semaglutide", "Lisinopril", "Pembrolizumab", "Dapagliflozin", "Exercise Program",
+    "Cognitive Behavioral Therapy", "Insulin Glargine", "Atorvastatin", "Placebo", "Dietary Supplement",
+]
+STATUSES = ["RECRUITING", "RECRUITING", "NOT_YET_RECRUITING", "ACTIVE_NOT_RECRUITING", "COMPLETED"]
+PHASES = [["PHASE1"], ["PHASE2"], ["PHASE3"], ["PHASE2", "PHASE3"], ["PHASE4"], []]
+SITES = [
+    ("Boston", "United States", 42.3601, -71.0589), ("New York", "United States", 40.7128, -74.0060),
+    ("Chicago", "United States", 41.8781, -87.6298), ("Houston", "United States", 29.7604, -95.3698),
+    ("Toronto", "Canada", 43.6532, -79.3832), ("London", "United Kingdom", 51.5072, -0.1276),
+    ("Berlin", "Germany", 52.5200, 13.4050), ("Paris", "France", 48.8566, 2.3522),
+]
+ELIGIBILITY = (
+    "Inclusion Criteria:\n\n* Adults with a confirmed diagnosis of {cond}\n* HbA1c between 7% and 10%\n"
+    "* Able to provide informed consent\n* Stable dose of current therapy for 3 months\n\n"
+    "Exclusion Criteria:\n\n* Pregnancy or breastfeeding\n* Severe renal impairment (eGFR < 30)\n"
+    "* History of pancreatitis\n* Participation in another interventional trial within 30 days\n"
+)
+
+EXTRACTION = {
+    "patient_name": "Jane Doe",
+    "patient_dob": "04/12/1961",
+    "patient_gender": "FEMALE",
+    "chief_complaint": "Poorly controlled blood sugar",
+    "conditions": ["Type 2 Diabetes", "Hypertension"],
+    "current_medications": ["Metformin 1000mg"],
+    "allergies": ["Penicillin"],
+    "past_medical_history": ["Gestational diabetes"],
+    "family_history": ["Father with type 2 diabetes"],
+    "social_history": ["Former smoker"],
+    "test_results": ["HbA1c 8.4%"],
+    "contradictions": [],
+    "proposed_plan": "Add a GLP-1 receptor agonist and review in three months",
+    "interventions": ["Semaglutide", "Metformin"],
+    "concerns": "The patient is worried about weight gain and hypoglycaemia with additional medication.",
+}
+# the one filter.advanced expression the stub understands (used by the re-match job)
+UPDATED_SINCE_RE = re.compile(r"AREA\[LastUpdatePostDate\]RANGE\[(\d{4}-\d{2}-\d{2}),MAX\]")
+
+
+def make_study(index: int) -> dict:
+    rng = random.Random(index)
+    nct_id = f"NCT{index:08d}"
+    conditions = rng.sample(CONDITIONS, rng.randint(1, 3))
+    interventions = rng.sample(INTERVENTIONS, rng.randint(1, 3))
+    sites = rng.sample(SITES, rng.randint(1, 4))
+    min_age = rng.choice(["18 Years", "18 Years", "40 Years", "6 Months", "12 Years"])
+    max_age = rng.choice(["65 Years", "75 Years", "17 Years", None])
+    eligibility = {
+        "eligibilityCriteria": ELIGIBILITY.format(cond=conditions[0]),
+        "sex": rng.choice(["ALL", "ALL", "FEMALE", "MALE"]),
+        "minimumAge": min_age,
+    }
+    if max_age:
+        eligibility["maximumAge"] = max_age
+    year = 2015 + index % 10
+    return {
+        "protocolSection": {
+            "identificationModule": {
+                "nctId": nct_id,
+                "acronym": f"STUDY-{index}",
+                "briefTitle": f"A Study of {interventions[0]} in Patients With {conditions[0]}",
+            },
+            "statusModule": {
+                "overallStatus": rng.choice(STATUSES),
+                "primaryCompletionDateStruct": {"date": f"{year + 3}-06"},
+                "studyFirstPostDateStruct": {"date": f"{year}-01-15"},
+                "lastUpdatePostDateStruct": {"date": f"{year + 1}-{1 + index % 12:02d}-01"},
+            },
+            "designModule": {"studyType": "INTERVENTIONAL", "phases": rng.choice(PHASES)},
+            "sponsorCollaboratorsModule": {"leadSponsor": {"name": f"Sponsor {index % 37}"}},
+            "conditionsModule": {"conditions": conditions},
+            "armsInterventionsModule": {
+                "interventions": [{"type": "DRUG", "name": name} for name in interventions]
+            },
+            "eligibilityModule": eligibility,
+            "contactsLocationsModule": {
+                "locations": [
+                    {"facility": f"{city} Medical Center", "city": city, "country": country,
+                     "geoPoint": {"lat": lat, "lon": lon}}
+                    for city, country, lat, lon in sites
+                ]
+            },
+        }
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def study_status(index: int) -> dict:
+    return make_study(index)["protocolSection"]["statusModule"]
+
+
+def _completion(content: str, prompt_tokens: int) -> dict:
+    return {
+        "id": f"chatcmpl-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "gpt-4o",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+        },
+    }
+
+
+def chat_kind(system: str) -> str:
+    if "transcript" in system:
+        return "extraction"
+    if "relevance" in system:
+        return "ranking"
+    return "ask_ai"
+
+
+def _answer_for(system: str, user: str, structured: bool = False) -> str:
+    # with a json_schema response_format the answer is bare JSON in the requested shape,
+    # otherwise it looks like free-form model output (fenced extraction, {nct_id: [...]} ranking)
+    kind = chat_kind(system)
+    if kind == "extraction":
+        if structured:
+            return json.dumps(EXTRACTION)
+        return "```json\n" + json.dumps(EXTRACTION, indent=2) + "\n```"
+    if kind == "ranking":
+        ids = list(dict.fromkeys(re.findall(r"NCT\d{8}", user)))[:10]
+        if structured:
+            return json.dumps({"trials": [
+                {"nct_id": nct_id, "explanation": f"{nct_id} targets the patient's primary condition.",
+                 "relevance_score": 10 - i % 5}
+                for i, nct_id in enumerate(ids)
+            ]})
+        ranking = {nct_id: [f"{nct_id} targets the patient's primary condition.", 10 - i % 5]
+                   for i, nct_id in enumerate(ids)}
+        return json.dumps(ranking, indent=4)
+    return "The patient appears to meet the main inclusion criteria for this trial. " * 4
+
+
+def _chunks(content: str):
+    # stream the answer roughly a word at a time, like the real API
+    for word in re.findall(r"\S+\s*", content):
+        chunk = {
+            "id": "chatcmpl-stream",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "gpt-4o",
+            "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+        }
+        yield chunk
+    yield {"id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+           "model": "gpt-4o", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+
+
+class Recording:
+    """Upstream responses keyed on the request: chat completions (with the kind of call, so a
+    prompt that changed since the recording still replays an answer of the right kind) and
+    ClinicalTrials.gov bodies. Stored as one JSON file."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.chat = {}
+        self.studies = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.chat, self.studies = data.get("chat", {}), data.get("studies", {})
+
+    @staticmethod
+    def chat_key(system: str, user: str) -> str:
+        return hashlib.sha256(json.dumps([system, user]).encode()).hexdigest()
+
+    @staticmethod
+    def studies_key(path: str, params) -> str:
+        return path + "?" + "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+    def chat_answer(self, system: str, user: str) -> tuple:
+        """(content, how) for a chat request: the recorded answer to the same messages, else one
+        to the same kind of call, else (None, "synthetic")."""
+        entry = self.chat.get(self.chat_key(system, user))
+        if entry:
+            return entry["content"], "replayed"
+        kind = chat_kind(system)
+        same_kind = [e for e in self.chat.values() if e["kind"] == kind]
+        if same_kind:
+            return same_kind[len(user) % len(same_kind)]["content"], "replayed_kind"
+        return None, "synthetic"
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump({"chat": self.chat, "studies": self.studies}, f)
+
+
+def _injected_error(rng: random.Random, error_rate: float) -> bool:
+    return bool(error_rate) and rng.random() < error_rate
+
+
+def create_llm_stub(latency: float = 0.5, token_latency: float = 0.01, error_rate: float = 0.0,
+                    recording: Optional[Recording] = None, upstream: Optional[str] = None) -> FastAPI:
+    """`upstream` (an OpenAI base url) makes the stub a recording proxy; `recording` replays."""
+    stub = FastAPI()
+    rng = random.Random(11)
+    stub.state.answers = {"replayed": 0, "replayed_kind": 0, "synthetic": 0, "recorded": 0, "errors": 0}
+
+    async def recorded_answer(request: Request, body: dict, system: str, user: str) -> str:
+        async with httpx.AsyncClient(timeout=120) as http:
+            response = await http.post(
+                f"{upstream}/chat/completions", json={**body, "stream": False},
+                headers={"Authorization": request.headers.get("authorization", "")},
+            )
+        response.raise_for_status()
+        content = response.json()["choices"][0]["message"]["content"]
+        recording.chat[Recording.chat_key(system, user)] = {"kind": chat_kind(system), "content": content}
+        return content
+
+    @stub.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user = next((m["content"] for m in messages if m["role"] == "user"), "")
+        if _injected_error(rng, error_rate):
+            stub.state.answers["errors"] += 1
+            await asyncio.sleep(latency)
+            return JSONResponse({"error": {"message": "stub error", "type": "server_error"}}, status_code=500)
+        structured = (body.get("response_format") or {}).get("type") == "json_schema"
+        if upstream and recording is not None:
+            content, how = await recorded_answer(request, body, system, user), "recorded"
+        else:
+            await asyncio.sleep(latency)
+            content, how = recording.chat_answer(system, user) if recording is not None else (None, "synthetic")
+            content = content if content is not None else _answer_for(system, user, structured)
+        stub.state.answers[how] += 1
+        if body.get("stream"):
+            async def events():
+                for chunk in _chunks(content):
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(token_latency)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+        return JSONResponse(_completion(content, (len(system) + len(user)) // 4))
+
+    return stub
+
+
+def create_trials_stub(latency: float = 0.2, total_studies: int = 2000, per_study_latency: float = 0.0,
+                       error_rate: float = 0.0, recording: Optional[Recording] = None,
+                       upstream: Optional[str] = None) -> FastAPI:
+    """`upstream` (e.g. https://clinicaltrials.gov) makes the stub a recording proxy; `recording` replays."""
+    stub = FastAPI()
+    rng = random.Random(7)
+
+    @stub.middleware("http")
+    async def inject_errors(request: Request, call_next):
+        if _injected_error(rng, error_rate):
+            stub.state.answers["errors"] += 1
+            await asyncio.sleep(latency)
+            return JSONResponse({"error": "stub overloaded"}, status_code=503)
+        return await call_next(request)
+
+    stub.state.page_requests = 0
+    stub.state.detail_requests = 0
+    stub.state.answers = {"replayed": 0, "synthetic": 0, "recorded": 0, "errors": 0}
+
+    async def recorded(request: Request) -> Optional[JSONResponse]:
+        """The recorded (or, when proxying, freshly recorded) body for this request, if any."""
+        if recording is None:
+            return None
+        key = Recording.studies_key(request.url.path, request.query_params)
+        if upstream:
+            async with httpx.AsyncClient(timeout=60) as http:
+                response = await http.get(f"{upstream}{request.url.path}", params=dict(request.query_params))
+            response.raise_for_status()
+            recording.studies[key] = response.json()
+            stub.state.answers["recorded"] += 1
+            return JSONResponse(recording.studies[key])
+        if key not in recording.studies:
+            return None
+        await asyncio.sleep(latency)
+        stub.state.answers["replayed"] += 1
+        return JSONResponse(recording.studies[key])
+
+    @stub.get("/api/v2/studies")
+    async def studies(request: Request):
+        stub.state.page_requests += 1
+        replayed = await recorded(request)
+        if replayed is not None:
+            return replayed
+        stub.state.answers["synthetic"] += 1
+        ids = request.query_params.get("filter.ids")
+        if ids:
+            await asyncio.sleep(latency)
+            return JSONResponse({"studies": [make_study(int(nct_id[3:])) for nct_id in ids.split(",")
+                                             if int(nct_id[3:]) < total_studies]})
+        page_size = int(request.query_params.get("pageSize", 10))
+        offset = int(request.query_params.get("pageToken", 0))
+        matching = matching_indices(request.query_params)
+        total = total_studies if matching is None else len(matching)
+        end = min(offset + page_size, total)
+        await asyncio.sleep(latency + per_study_latency * (end - offset))
+        indices = range(offset, end) if matching is None else matching[offset:end]
+        body = {"studies": [make_study(i) for i in indices]}
+        if end < total:
+            body["nextPageToken"] = str(end)
+        return JSONResponse(body)
+
+    # filter.advanced (only AREA[LastUpdatePostDate]RANGE[since,MAX]) and filter.overallStatus
+    def matching_indices(query):
+        since = UPDATED_SINCE_RE.search(query.get("filter.advanced", ""))
+        statuses = set(filter(None, query.get("filter.overallStatus", "").split(",")))
+        if not since and not statuses:
+            return None
+        matching = []
+        for i in range(total_studies):
+            status = study_status(i)
+            if since and status["lastUpdatePostDateStruct"]["date"] < since.group(1):
+                continue
+            if statuses and status["overallStatus"] not in statuses:
+                continue
+            matching.append(i)
+        return matching
+
+    @stub.get("/api/v2/studies/{nct_id}")
+    async def study(nct_id: str, request: Request):
+        stub.state.detail_requests += 1
+        replayed = await recorded(request)
+        if replayed is not None:
+            return replayed
+        stub.state.answers["synthetic"] += 1
+        await asyncio.sleep(latency)
+        return JSONResponse(make_study(int(nct_id[3:])))
+
+    return stub
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app, port: int = None) -> str:
+    """Run an ASGI app with uvicorn on a daemon thread and return its base url."""
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+def start_stubs(llm_latency: float = 0.5, trials_latency: float = 0.2, total_studies: int = 2000):
+    """Start both stubs and return (openai_base_url, trials_base_url)."""
+    llm_url = serve_in_thread(create_llm_stub(llm_latency))
+    trials_url = serve_in_thread(create_trials_stub(trials_latency, total_studies))
+    return f"{llm_url}/v1", f"{trials_url}/api/v2/studies"
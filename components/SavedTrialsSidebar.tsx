@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { TrialDetails, getSavedTrials } from '../lib/api-service';
+import { TrialDetails, getAllSavedTrials } from '../lib/api-service';
 
 interface SavedTrialsSidebarProps {
   isOpen: boolean;
@@ -21,8 +21,7 @@ export default function SavedTrialsSidebar({ isOpen, onClose, refreshTrigger }:
   const loadSavedTrials = async () => {
     setLoading(true);
     try {
-      const response = await getSavedTrials();
-      setSavedTrials(response.trials);
+      setSavedTrials(await getAllSavedTrials());
     } catch (error) {
       console.error('Error loading saved trials:', error);
     } finally {
@@ -1,13 +1,23 @@
-import React, { useState, useEffect } from 'react';
-import { TrialData, TrialDetails, TrialRanking, getTrialDetails, getTrialRanking, askAI, saveTrial, removeSavedTrial, getSavedTrials } from '../lib/api-service';
+import React, { useState, useEffect, useRef } from 'react';
+import { TrialData, TrialDetails, TrialListQuery, TrialRanking, getTrialDetails, getTrialDetailsBatch, getTrialRanking, getTrialsPage, askAIStream, saveTrial, removeSavedTrial, getAllSavedTrials } from '../lib/api-service';
 
 interface TrialsTableProps {
+  // trials streamed during upload; once the note is stored, pages come from the server
   trials: TrialData[];
   clinicalNotesId: string;
+  streaming?: boolean;
   onTrialSaved?: () => void;
 }
 
-export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: TrialsTableProps) {
+const PAGE_SIZE = 20;
+// details prefetched for listed rows; the long eligibility criteria are loaded when a row is expanded
+const PREFETCH_FIELDS: (keyof TrialDetails)[] = [
+  'acronym', 'title', 'primary_completion_date', 'study_first_post_date', 'last_update_post_date', 'study_type',
+  'status', 'sponsor', 'conditions', 'interventions', 'locations', 'age', 'sex', 'phases',
+];
+const PREFETCH_DELAY_MS = 300;
+
+export default function TrialsTable({ trials, clinicalNotesId, streaming = false, onTrialSaved }: TrialsTableProps) {
   const [expandedTrial, setExpandedTrial] = useState<string | null>(null);
   const [trialDetails, setTrialDetails] = useState<{ [key: string]: TrialDetails }>({});
   const [loadingDetails, setLoadingDetails] = useState<{ [key: string]: boolean }>({});
@@ -20,14 +30,69 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
   const [savingTrial, setSavingTrial] = useState<{ [key: string]: boolean }>({});
   const [savedTrialIds, setSavedTrialIds] = useState<Set<string>>(new Set());
   const [searchQuery, setSearchQuery] = useState('');
+  const [pageTrials, setPageTrials] = useState<TrialData[] | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [totalTrials, setTotalTrials] = useState(0);
+  const [loadingPage, setLoadingPage] = useState(false);
+  const [statusFilter, setStatusFilter] = useState('');
+  const [sort, setSort] = useState<TrialListQuery['sort']>('score');
+  // IDs whose details were requested, so each row is prefetched at most once
+  const requestedDetails = useRef<Set<string>>(new Set());
+
+  const loadTrialsPage = async (cursor?: string) => {
+    setLoadingPage(true);
+    try {
+      const response = await getTrialsPage(clinicalNotesId, {
+        status: statusFilter || undefined,
+        sort,
+        limit: PAGE_SIZE,
+        cursor,
+      });
+      setPageTrials(prev => (cursor && prev ? [...prev, ...response.trials] : response.trials));
+      setNextCursor(response.next_cursor);
+      setTotalTrials(response.total);
+    } catch (error) {
+      console.error('Error loading trials page:', error);
+    } finally {
+      setLoadingPage(false);
+    }
+  };
+
+  useEffect(() => {
+    // Filtering, sorting and paging happen on the server once the note is stored
+    if (streaming) {
+      setPageTrials(null);
+      return;
+    }
+    loadTrialsPage();
+  }, [clinicalNotesId, streaming, statusFilter, sort]);
+
+  const listedTrials = pageTrials ?? trials;
 
   useEffect(() => {
     // Load saved trial IDs on mount
     loadSavedTrialIds();
   }, []);
 
-  // Filter trials based on search query
-  const filteredTrials = trials.filter(trial => 
+  useEffect(() => {
+    // Prefetch details for the listed rows with a single batch request, once the list has settled
+    if (streaming) return;
+    const timer = setTimeout(() => {
+      const missing = listedTrials.map(trial => trial.nct_id).filter(nctId => !requestedDetails.current.has(nctId));
+      if (missing.length === 0) return;
+      missing.forEach(nctId => requestedDetails.current.add(nctId));
+      getTrialDetailsBatch(missing, PREFETCH_FIELDS)
+        .then(response => setTrialDetails(prev => ({ ...response.trials, ...prev })))
+        .catch(error => {
+          missing.forEach(nctId => requestedDetails.current.delete(nctId));
+          console.error('Error prefetching trial details:', error);
+        });
+    }, PREFETCH_DELAY_MS);
+    return () => clearTimeout(timer);
+  }, [listedTrials, streaming]);
+
+  // Filter the loaded trials based on search query
+  const filteredTrials = listedTrials.filter(trial => 
     trial.nct_id.toLowerCase().includes(searchQuery.toLowerCase())
   );
 
@@ -37,8 +102,8 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
 
   const loadSavedTrialIds = async () => {
     try {
-      const response = await getSavedTrials();
-      const ids = new Set(response.trials.map(trial => trial.nct_id));
+      const trials = await getAllSavedTrials({ fields: ['nct_id'] });
+      const ids = new Set(trials.map(trial => trial.nct_id));
       setSavedTrialIds(ids);
     } catch (error) {
       console.error('Error loading saved trial IDs:', error);
@@ -53,16 +118,19 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
 
     setExpandedTrial(nctId);
 
-    if (!trialDetails[nctId]) {
-      setLoadingDetails({ ...loadingDetails, [nctId]: true });
+    // prefetched details are shown right away; the full record adds the eligibility criteria
+    if (trialDetails[nctId]?.eligibility_criteria === undefined) {
+      requestedDetails.current.add(nctId);
+      const prefetched = Boolean(trialDetails[nctId]);
+      if (!prefetched) setLoadingDetails({ ...loadingDetails, [nctId]: true });
       try {
         const details = await getTrialDetails(nctId);
-        setTrialDetails({ ...trialDetails, [nctId]: details });
+        setTrialDetails(prev => ({ ...prev, [nctId]: details }));
       } catch (error) {
         console.error('Error fetching trial details:', error);
         alert('Failed to load trial details');
       } finally {
-        setLoadingDetails({ ...loadingDetails, [nctId]: false });
+        if (!prefetched) setLoadingDetails({ ...loadingDetails, [nctId]: false });
       }
     }
   };
@@ -100,8 +168,11 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
 
     setLoadingAI({ ...loadingAI, [nctId]: true });
     try {
-      const response = await askAI(clinicalNotesId, nctId, query);
-      setAiAnswer({ ...aiAnswer, [nctId]: response.answer });
+      setAiAnswer(prev => ({ ...prev, [nctId]: '' }));
+      const response = await askAIStream(clinicalNotesId, nctId, query, text => {
+        setAiAnswer(prev => ({ ...prev, [nctId]: (prev[nctId] || '') + text }));
+      });
+      setAiAnswer(prev => ({ ...prev, [nctId]: response.answer }));
     } catch (error) {
       console.error('Error asking AI:', error);
       alert('Failed to get AI response');
@@ -146,7 +217,7 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
     <div style={{ marginTop: '32px' }}>
       <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '16px' }}>
         <h2 style={{ fontSize: '24px', fontWeight: 'bold', margin: 0 }}>
-          Relevant Clinical Trials ({showRanked ? (filteredRankedTrials?.length || 0) : filteredTrials.length})
+          Relevant Clinical Trials ({showRanked ? (filteredRankedTrials?.length || 0) : pageTrials ? totalTrials : filteredTrials.length})
         </h2>
         <button
           onClick={handleAIRanking}
@@ -166,11 +237,38 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
         </button>
       </div>
 
+      {/* Server-side filter and sort */}
+      {!showRanked && (
+        <div style={{ display: 'flex', gap: '8px', marginBottom: '8px' }}>
+          <select
+            value={statusFilter}
+            onChange={(e) => setStatusFilter(e.target.value)}
+            disabled={streaming}
+            style={{ padding: '8px', fontSize: '14px', border: '1px solid #ddd', borderRadius: '4px' }}
+          >
+            <option value="">All statuses</option>
+            <option value="RECRUITING">Recruiting</option>
+            <option value="NOT_YET_RECRUITING">Not yet recruiting</option>
+            <option value="ENROLLING_BY_INVITATION">Enrolling by invitation</option>
+          </select>
+          <select
+            value={sort}
+            onChange={(e) => setSort(e.target.value as TrialListQuery['sort'])}
+            disabled={streaming}
+            style={{ padding: '8px', fontSize: '14px', border: '1px solid #ddd', borderRadius: '4px' }}
+          >
+            <option value="score">Best match</option>
+            <option value="relevance">AI relevance</option>
+            <option value="date">Recently updated</option>
+          </select>
+        </div>
+      )}
+
       {/* Search Bar */}
       <div style={{ marginBottom: '16px' }}>
         <input
           type="text"
-          placeholder="🔍 Search trials by NCT ID..."
+          placeholder="🔍 Search loaded trials by NCT ID..."
           value={searchQuery}
           onChange={(e) => setSearchQuery(e.target.value)}
           style={{
@@ -205,6 +303,7 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
       </div>
       <div style={{ overflowX: 'auto' }}>
         {!showRanked ? (
+          <>
           <table style={{ width: '100%', borderCollapse: 'collapse', border: '1px solid #ddd' }}>
             <thead>
               <tr style={{ backgroundColor: '#4CAF50', color: 'white' }}>
@@ -334,7 +433,7 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
                                   Eligibility Criteria
                                 </td>
                                 <td style={{ padding: '8px', whiteSpace: 'pre-wrap' }}>
-                                  {trialDetails[trial.nct_id].eligibility_criteria}
+                                  {trialDetails[trial.nct_id].eligibility_criteria ?? 'Loading...'}
                                 </td>
                               </tr>
                             </tbody>
@@ -405,6 +504,25 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
             ))}
           </tbody>
         </table>
+        {pageTrials && nextCursor && (
+          <button
+            onClick={() => loadTrialsPage(nextCursor)}
+            disabled={loadingPage}
+            style={{
+              marginTop: '12px',
+              padding: '8px 16px',
+              backgroundColor: '#4CAF50',
+              color: 'white',
+              border: 'none',
+              borderRadius: '4px',
+              cursor: loadingPage ? 'not-allowed' : 'pointer',
+              fontSize: '14px',
+            }}
+          >
+            {loadingPage ? 'Loading...' : `Load more (${pageTrials.length} of ${totalTrials})`}
+          </button>
+        )}
+        </>
         ) : (
           <table style={{ width: '100%', borderCollapse: 'collapse', border: '1px solid #ddd' }}>
             <thead>
@@ -547,7 +665,7 @@ export default function TrialsTable({ trials, clinicalNotesId, onTrialSaved }: T
                                     Eligibility Criteria
                                   </td>
                                   <td style={{ padding: '8px', whiteSpace: 'pre-wrap' }}>
-                                    {trialDetails[trial.nct_id].eligibility_criteria}
+                                    {trialDetails[trial.nct_id].eligibility_criteria ?? 'Loading...'}
                                   </td>
                                 </tr>
                               </tbody>
@@ -23,6 +23,50 @@ export interface TrialData {
   nct_id: string;
   conditions: string;
   interventions: string;
+  prerank_score?: number;
+  status?: string;
+  phases?: string;
+  sex?: string;
+  min_age?: number | null;
+  max_age?: number | null;
+  countries?: string[];
+  sites?: [number, number][];
+  last_update_post_date?: string;
+  // kilometres to the nearest site, when the list was requested with `near`
+  distance_km?: number | null;
+}
+
+// Server-side filters, sort and pagination for trial lists (comma-separated values match any)
+export interface TrialListQuery {
+  status?: string;
+  phase?: string;
+  sex?: string;
+  country?: string;
+  min_age?: number;
+  max_age?: number;
+  sort?: 'score' | 'relevance' | 'date' | 'distance';
+  // [latitude, longitude] of the patient; needed for sort 'distance' and radius_km
+  near?: [number, number];
+  radius_km?: number;
+  cursor?: string;
+  limit?: number;
+  fields?: string[];
+}
+
+export interface TrialPage<T> {
+  trials: T[];
+  next_cursor: string | null;
+  total: number;
+}
+
+function trialListParams(query: TrialListQuery = {}): string {
+  const params = new URLSearchParams();
+  Object.entries(query).forEach(([key, value]) => {
+    if (value === undefined || value === null || value === '') return;
+    params.set(key, Array.isArray(value) ? value.join(',') : String(value));
+  });
+  const text = params.toString();
+  return text ? `?${text}` : '';
 }
 
 export interface ClinicalNotesResponse {
@@ -31,6 +75,7 @@ export interface ClinicalNotesResponse {
   trials: TrialData[];
   created_at: string;
   total_trials_found: number;
+  cached?: boolean;
 }
 
 export interface TrialDetails {
@@ -59,7 +104,10 @@ export interface TrialRanking {
 }
 
 export interface TrialRankingResponse {
+  status: 'pending' | 'ready' | 'failed';
   trials: TrialRanking[];
+  error?: string | null;
+  cached?: boolean;
 }
 
 // Upload transcript and get clinical notes + trials
@@ -79,6 +127,74 @@ export async function uploadTranscript(transcript: string): Promise<ClinicalNote
   return response.json();
 }
 
+// Read a server-sent event stream from a fetch response and hand each event to onEvent
+async function readEventStream(response: Response, onEvent: (event: string, data: any) => void): Promise<void> {
+  const reader = response.body!.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const messages = buffer.split('\n\n');
+    buffer = messages.pop() || '';
+    for (const message of messages) {
+      let event = 'message';
+      let data = '';
+      for (const line of message.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
+export interface TranscriptStreamHandlers {
+  onPatientData: (clinicalNotesId: string, patientData: PatientData, createdAt: string) => void;
+  onTrials: (trials: TrialData[]) => void;
+}
+
+// Upload transcript and receive patient data, then the updated trial list after each result page
+export async function uploadTranscriptStream(transcript: string, handlers: TranscriptStreamHandlers): Promise<ClinicalNotesResponse> {
+  const response = await fetch(`${API_BASE_URL}/api/v1/transcripts/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ transcript }),
+  });
+
+  if (!response.ok) {
+    throw new Error(`Failed to upload transcript: ${response.statusText}`);
+  }
+
+  let result: ClinicalNotesResponse | null = null;
+  let error: string | null = null;
+  await readEventStream(response, (event, data) => {
+    if (event === 'patient_data') handlers.onPatientData(data.clinical_notes_id, data.patient_data, data.created_at);
+    else if (event === 'trials') handlers.onTrials(data.trials);
+    else if (event === 'done') result = data;
+    else if (event === 'error') error = data.detail;
+  });
+
+  if (error || !result) {
+    throw new Error(`Failed to upload transcript: ${error || 'stream ended early'}`);
+  }
+  return result;
+}
+
+// Get a page of the trials found for a clinical note
+export async function getTrialsPage(clinicalNotesId: string, query: TrialListQuery = {}): Promise<TrialPage<TrialData>> {
+  const response = await fetch(`${API_BASE_URL}/api/v1/transcripts/${clinicalNotesId}/trials${trialListParams(query)}`);
+
+  if (!response.ok) {
+    throw new Error(`Failed to get trials: ${response.statusText}`);
+  }
+
+  return response.json();
+}
+
 // Get trial details by NCT ID
 export async function getTrialDetails(nctId: string): Promise<TrialDetails> {
   const response = await fetch(`${API_BASE_URL}/api/v1/trials/${nctId}`);
@@ -90,21 +206,52 @@ export async function getTrialDetails(nctId: string): Promise<TrialDetails> {
   return response.json();
 }
 
-// Get AI-ranked trials for a clinical note
-export async function getTrialRanking(clinicalNotesId: string): Promise<TrialRankingResponse> {
-  const response = await fetch(`${API_BASE_URL}/api/v1/transcripts/${clinicalNotesId}/trials/ranking`);
+export interface TrialDetailsBatchResponse {
+  trials: { [nctId: string]: TrialDetails };
+}
+
+// Get trial details for many NCT IDs in one request; `fields` limits the details to those fields (and nct_id)
+export async function getTrialDetailsBatch(nctIds: string[], fields?: (keyof TrialDetails)[]): Promise<TrialDetailsBatchResponse> {
+  const response = await fetch(`${API_BASE_URL}/api/v1/trials/batch${trialListParams({ fields })}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ nct_ids: nctIds }),
+  });
 
   if (!response.ok) {
-    throw new Error(`Failed to get trial ranking: ${response.statusText}`);
+    throw new Error(`Failed to get trial details: ${response.statusText}`);
   }
 
   return response.json();
 }
 
+// Get AI-ranked trials for a clinical note (ranked in the background after upload, waits while pending)
+export async function getTrialRanking(clinicalNotesId: string): Promise<TrialRankingResponse> {
+  for (let attempt = 0; attempt < 5; attempt++) {
+    const response = await fetch(`${API_BASE_URL}/api/v1/transcripts/${clinicalNotesId}/trials/ranking?wait=30`);
+
+    if (!response.ok) {
+      throw new Error(`Failed to get trial ranking: ${response.statusText}`);
+    }
+
+    const ranking: TrialRankingResponse = await response.json();
+    if (ranking.status === 'failed') {
+      throw new Error(`Failed to get trial ranking: ${ranking.error}`);
+    }
+    if (ranking.status === 'ready') {
+      return ranking;
+    }
+  }
+  throw new Error('Failed to get trial ranking: timed out');
+}
+
 export interface AskAIResponse {
   nct_id: string;
   query: string;
   answer: string;
+  cached?: boolean;
 }
 
 // Ask AI about a specific trial
@@ -128,6 +275,38 @@ export async function askAI(clinicalNotesId: string, nctId: string, query: strin
   return response.json();
 }
 
+// Ask AI about a specific trial, receiving the answer token by token
+export async function askAIStream(clinicalNotesId: string, nctId: string, query: string, onToken: (text: string) => void): Promise<AskAIResponse> {
+  const response = await fetch(`${API_BASE_URL}/api/v1/trials/ask_ai/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({
+      clinical_notes_id: clinicalNotesId,
+      nct_id: nctId,
+      query: query,
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error(`Failed to ask AI: ${response.statusText}`);
+  }
+
+  let result: AskAIResponse | null = null;
+  let error: string | null = null;
+  await readEventStream(response, (event, data) => {
+    if (event === 'token') onToken(data.text);
+    else if (event === 'done') result = data;
+    else if (event === 'error') error = data.detail;
+  });
+
+  if (error || !result) {
+    throw new Error(`Failed to ask AI: ${error || 'stream ended early'}`);
+  }
+  return result;
+}
+
 export interface SaveTrialResponse {
   message: string;
   nct_id: string;
@@ -146,13 +325,11 @@ export async function saveTrial(nctId: string): Promise<SaveTrialResponse> {
   return response.json();
 }
 
-export interface SavedTrialsResponse {
-  trials: TrialDetails[];
-}
+export type SavedTrialsResponse = TrialPage<TrialDetails>;
 
-// Get all saved trials
-export async function getSavedTrials(): Promise<SavedTrialsResponse> {
-  const response = await fetch(`${API_BASE_URL}/api/v1/trials/saved`);
+// Get a page of saved trials
+export async function getSavedTrials(query: TrialListQuery = {}): Promise<SavedTrialsResponse> {
+  const response = await fetch(`${API_BASE_URL}/api/v1/trials/saved${trialListParams(query)}`);
 
   if (!response.ok) {
     throw new Error(`Failed to get saved trials: ${response.statusText}`);
@@ -161,6 +338,18 @@ export async function getSavedTrials(): Promise<SavedTrialsResponse> {
   return response.json();
 }
 
+// Get all saved trials, following next_cursor through every page
+export async function getAllSavedTrials(query: TrialListQuery = {}): Promise<TrialDetails[]> {
+  const trials: TrialDetails[] = [];
+  let cursor: string | undefined;
+  do {
+    const response = await getSavedTrials({ limit: 500, ...query, cursor });
+    trials.push(...response.trials);
+    cursor = response.next_cursor ?? undefined;
+  } while (cursor);
+  return trials;
+}
+
 // Remove a saved trial
 export async function removeSavedTrial(nctId: string): Promise<SaveTrialResponse> {
   const response = await fetch(`${API_BASE_URL}/api/v1/trials/${nctId}/save`, {
@@ -177,8 +366,13 @@ export async function removeSavedTrial(nctId: string): Promise<SaveTrialResponse
 // Check if a trial is saved
 export async function isTrialSaved(nctId: string): Promise<boolean> {
   try {
-    const response = await getSavedTrials();
-    return response.trials.some(trial => trial.nct_id === nctId);
+    let cursor: string | undefined;
+    do {
+      const response = await getSavedTrials({ fields: ['nct_id'], limit: 500, cursor });
+      if (response.trials.some(trial => trial.nct_id === nctId)) return true;
+      cursor = response.next_cursor ?? undefined;
+    } while (cursor);
+    return false;
   } catch (error) {
     console.error('Error checking if trial is saved:', error);
     return false;
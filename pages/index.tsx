@@ -3,7 +3,7 @@ import FileUpload from '../components/FileUpload';
 import PatientDataTable from '../components/PatientDataTable';
 import TrialsTable from '../components/TrialsTable';
 import SavedTrialsSidebar from '../components/SavedTrialsSidebar';
-import { uploadTranscript, ClinicalNotesResponse, getSavedTrials } from '../lib/api-service';
+import { uploadTranscriptStream, ClinicalNotesResponse, getSavedTrials } from '../lib/api-service';
 
 export default function Home() {
   const [isLoading, setIsLoading] = useState(false);
@@ -18,10 +18,10 @@ export default function Home() {
     const fetchSavedTrialsCount = async () => {
       try {
         console.log('Fetching saved trials count, refreshTrigger:', refreshTrigger);
-        const savedTrialsData = await getSavedTrials();
-        console.log('Saved trials data:', savedTrialsData);
-        console.log('Saved trials count:', savedTrialsData.trials.length);
-        setSavedTrialsCount(savedTrialsData.trials.length);
+        // one ID is enough: total counts every saved trial, not just the page
+        const savedTrialsData = await getSavedTrials({ fields: ['nct_id'], limit: 1 });
+        console.log('Saved trials count:', savedTrialsData.total);
+        setSavedTrialsCount(savedTrialsData.total);
       } catch (error) {
         console.error('Error fetching saved trials count:', error);
         setSavedTrialsCount(0);
@@ -41,7 +41,21 @@ export default function Home() {
     setResponse(null);
 
     try {
-      const result = await uploadTranscript(content);
+      // Show patient data as soon as it is extracted and refresh the trial list as each page arrives
+      const result = await uploadTranscriptStream(content, {
+        onPatientData: (clinicalNotesId, patientData, createdAt) => setResponse({
+          clinical_notes_id: clinicalNotesId,
+          patient_data: patientData,
+          trials: [],
+          created_at: createdAt,
+          total_trials_found: 0,
+        }),
+        onTrials: trials => setResponse(prev => prev && {
+          ...prev,
+          trials: trials,
+          total_trials_found: trials.length,
+        }),
+      });
       setResponse(result);
     } catch (err) {
       setError(err instanceof Error ? err.message : 'An error occurred');
@@ -103,6 +117,7 @@ export default function Home() {
               <TrialsTable 
                 trials={response.trials} 
                 clinicalNotesId={response.clinical_notes_id}
+                streaming={isLoading}
                 onTrialSaved={() => {
                   console.log('Trial saved callback triggered');
                   setRefreshTrigger(prev => {
@@ -0,0 +1,174 @@
+# imports
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+Ttl = Union[float, Callable[[Any], float]]
+# how long a read or write of the shared file waits for another process's write; these run on the
+# event loop, so a busy file counts as a miss (or a skipped write) rather than holding the loop
+BUSY_TIMEOUT_MS = 50
+
+class TTLCache:
+    """In-process LRU cache with per-entry expiry and single-flight fetches.
+
+    When `path` is set, entries are mirrored to a SQLite file and reloaded on
+    start-up, so the cache survives restarts; a miss in memory is looked up in
+    the file, so worker processes sharing it see each other's entries (a file
+    busy with another process's write counts as a miss, and a write that can't
+    get it is skipped, see BUSY_TIMEOUT_MS). A `ttl`
+    can be a number of seconds or a callable that derives it from the value;
+    a ttl <= 0 means the value is returned but not cached.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl: Ttl = 3600, path: Optional[str] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._open(path)
+
+    def _open(self, path: str):
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, expires_at REAL, value TEXT)"
+            )
+            self._db.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+            rows = self._db.execute(
+                "SELECT key, expires_at, value FROM entries ORDER BY rowid DESC LIMIT ?", (self.max_entries,)
+            ).fetchall()
+            for key, expires_at, value in reversed(rows):
+                self._entries[key] = (expires_at, json.loads(value))
+            self._db.commit()
+            # loading waits as long as it must; lookups afterwards don't
+            self._db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            logger.info(f"Cache {self.name} loaded {len(rows)} entries from {path}")
+        except sqlite3.Error as e:
+            logger.error(f"Cache {self.name} could not open {path}, running in memory only: {e}")
+            self._db = None
+
+    def _persist(self, sql: str, args: tuple):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(sql, args)
+            self._db.commit()
+        except sqlite3.OperationalError as e:
+            # typically another worker writing; the entry stays cached in memory
+            self._db.rollback()
+            logger.warning(f"Cache {self.name} write skipped: {e}")
+        except sqlite3.Error as e:
+            logger.error(f"Cache {self.name} write failed: {e}")
+
+    def _load(self, key: str) -> Optional[tuple]:
+        """An entry another process wrote to the shared file, now kept in memory too."""
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT expires_at, value FROM entries WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Cache {self.name} read failed: {e}")
+            return None
+        if row is None:
+            return None
+        entry = (row[0], json.loads(row[1]))
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key) or self._load(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self._persist("DELETE FROM entries WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[Ttl] = None):
+        ttl = self.ttl if ttl is None else ttl
+        seconds = ttl(value) if callable(ttl) else ttl
+        if seconds <= 0:
+            return
+        expires_at = time.time() + seconds
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            self._persist(
+                "INSERT OR REPLACE INTO entries (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, json.dumps(value)),
+            )
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._persist("DELETE FROM entries WHERE key = ?", (evicted,))
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._persist("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._persist("DELETE FROM entries", ())
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: Optional[Ttl] = None) -> Any:
+        """Return the cached value or await `fetch()`; concurrent misses share one fetch."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        return await asyncio.shield(self.fetching(key, fetch, ttl))
+
+    def fetching(self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: Optional[Ttl] = None) -> asyncio.Future:
+        """The in-flight fetch of `key`, started now with `fetch()` unless one is already running."""
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(key, fetch, ttl))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        else:
+            self.coalesced += 1
+        return task
+
+    async def _fetch_and_store(self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: Optional[Ttl]) -> Any:
+        value = await fetch()
+        self.set(key, value, ttl)
+        return value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "persistent": self._db is not None,
+        }
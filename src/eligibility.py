@@ -0,0 +1,101 @@
+# Rule-based eligibility pre-filter: drops trials the patient is plainly excluded from by age, sex
+# or recruitment status before pre-ranking and LLM ranking. Checks run as numpy array comparisons
+# over the candidate list, using the min_age/max_age/sex/status fields of the short trial records.
+import os
+import re
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+
+# ELIGIBILITY_FILTER=false turns the pre-filter off; ELIGIBLE_STATUSES are the overall statuses kept
+ELIGIBILITY_FILTER = os.getenv('ELIGIBILITY_FILTER', 'true').lower() == 'true'
+ELIGIBLE_STATUSES = tuple(
+    s for s in os.getenv('ELIGIBLE_STATUSES', 'RECRUITING,NOT_YET_RECRUITING,ENROLLING_BY_INVITATION').split(',') if s
+)
+
+AGE_UNITS = {"year": 1.0, "month": 1 / 12, "week": 1 / 52, "day": 1 / 365, "hour": 1 / 8760, "minute": 1 / 525600}
+AGE_RE = re.compile(r"\s*(\d+(?:\.\d+)?)\s*([a-z]+?)s?\s*$")
+STATED_AGE_RE = re.compile(r"^\s*(\d{1,3})\s*(?:y|yo|yrs?|years?)?(?:[\s-]*old)?\s*$", re.IGNORECASE)
+DOB_FORMATS = ("%m/%d/%Y", "%d/%m/%Y", "%Y-%m-%d", "%m-%d-%Y", "%d.%m.%Y", "%B %d, %Y", "%b %d, %Y",
+               "%d %B %Y", "%d %b %Y", "%m/%d/%y", "%Y")
+
+def parse_age(text: Optional[str]) -> Optional[float]:
+    """'18 Years' -> 18.0, '6 Months' -> 0.5; None for missing or unparseable ages."""
+    match = AGE_RE.match((text or "").lower())
+    if not match or match.group(2) not in AGE_UNITS:
+        return None
+    return float(match.group(1)) * AGE_UNITS[match.group(2)]
+
+def patient_age(dob: Optional[str], today: Optional[date] = None) -> Optional[float]:
+    """Age in years from the extracted date of birth (or a stated age such as '62 years old').
+
+    Whole years from 2 years up, since trials state adult limits in whole
+    years ('65 Years' includes a 65.9 year old); fractional below that.
+    """
+    text = (dob or "").strip()
+    if not text:
+        return None
+    stated = STATED_AGE_RE.match(text)
+    if stated and len(stated.group(1)) < 4:
+        return float(stated.group(1))
+    today = today or datetime.utcnow().date()
+    for fmt in DOB_FORMATS:
+        try:
+            born = datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+        if born > today:
+            return None
+        years = today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+        return float(years) if years >= 2 else (today - born).days / 365.25
+    return None
+
+def patient_sex(gender: Optional[str]) -> Optional[str]:
+    """'Female', 'F', 'woman' -> 'FEMALE'; 'Male', 'M', 'man' -> 'MALE'; None when unknown."""
+    value = (gender or "").strip().lower()
+    if value.startswith(("f", "w", "girl")):
+        return "FEMALE"
+    if value.startswith(("m", "boy")):
+        return "MALE"
+    return None
+
+def eligibility_mask(
+    trials: List[Dict], age: Optional[float], sex: Optional[str], statuses: Iterable[str] = ELIGIBLE_STATUSES
+) -> np.ndarray:
+    """Boolean array: True where nothing known about the trial excludes the patient.
+
+    Unknown values never exclude: a trial without an age bound, or a patient
+    without a parsed age, passes the age check; likewise for sex and status.
+    """
+    n = len(trials)
+    mask = np.ones(n, dtype=bool)
+    if n == 0:
+        return mask
+    if age is not None:
+        min_age = np.array([t.get("min_age") for t in trials], dtype=float)
+        max_age = np.array([t.get("max_age") for t in trials], dtype=float)
+        # None becomes nan, and comparisons with nan are False
+        mask &= ~(min_age > age) & ~(max_age < age)
+    if sex is not None:
+        trial_sex = np.array([str(t.get("sex") or "ALL").upper() for t in trials])
+        mask &= (trial_sex == "ALL") | (trial_sex == sex)
+    statuses = list(statuses)
+    if statuses:
+        status = np.array([str(t.get("status") or "UNKNOWN").upper() for t in trials])
+        mask &= np.isin(status, statuses) | (status == "UNKNOWN")
+    return mask
+
+def eligible_trials(trials: List[Dict], patient_data: Dict, today: Optional[date] = None) -> List[Dict]:
+    """`trials` without those the patient is excluded from (unchanged when ELIGIBILITY_FILTER is off)."""
+    if not ELIGIBILITY_FILTER or not trials:
+        return trials
+    mask = eligibility_mask(
+        trials, patient_age(patient_data.get("patient_dob"), today), patient_sex(patient_data.get("patient_gender"))
+    )
+    return [trial for trial, keep in zip(trials, mask) if keep]
+
+def status_filter() -> Dict[str, str]:
+    """Search params that have ClinicalTrials.gov (or the local index) drop ineligible statuses upstream."""
+    if not ELIGIBILITY_FILTER or not ELIGIBLE_STATUSES:
+        return {}
+    return {"filter.overallStatus": ','.join(ELIGIBLE_STATUSES)}
@@ -0,0 +1,125 @@
+# Trial site locations: a grid index over the geoPoint coordinates of every site in a trial list,
+# built with numpy. A radius query only measures the sites in grid cells that overlap the
+# radius's bounding box; a nearest-site sort measures all of them in one vectorized pass.
+import hashlib
+import math
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# sites kept per trial record (after merging sites closer than ~1 km) and the grid cell size in degrees
+GEO_MAX_SITES = int(os.getenv('GEO_MAX_SITES', '100'))
+GEO_CELL_DEGREES = 1.0
+
+EARTH_RADIUS_KM = 6371.0
+LON_CELLS = int(round(360 / GEO_CELL_DEGREES))
+
+# numpy copies of recently queried site grids, keyed on the grid's content hash
+SITE_ARRAYS_CACHE_SIZE = 64
+_site_arrays: "OrderedDict[str, Tuple[np.ndarray, ...]]" = OrderedDict()
+
+def site_points(locations: List[Dict]) -> List[List[float]]:
+    """[lat, lon] of each site with a geoPoint, rounded to 2 decimals and deduplicated, at most GEO_MAX_SITES."""
+    points = {}
+    for location in locations:
+        point = location.get('geoPoint') if isinstance(location, dict) else None
+        if not point or point.get('lat') is None or point.get('lon') is None:
+            continue
+        key = (round(float(point['lat']), 2), round(float(point['lon']), 2))
+        points.setdefault(key, None)
+        if len(points) >= GEO_MAX_SITES:
+            break
+    return [list(key) for key in points]
+
+def parse_point(text: str) -> Tuple[float, float]:
+    """'42.36,-71.06' -> (42.36, -71.06); raises ValueError for anything else."""
+    try:
+        lat, lon = (float(part) for part in text.split(','))
+    except (ValueError, AttributeError):
+        raise ValueError("near must be 'latitude,longitude'")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("near is out of range")
+    return lat, lon
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def cell_keys(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    rows = np.floor((np.asarray(lats) + 90) / GEO_CELL_DEGREES).astype(np.int64)
+    cols = np.floor((np.asarray(lons) + 180) / GEO_CELL_DEGREES).astype(np.int64) % LON_CELLS
+    return rows * LON_CELLS + cols
+
+def build_site_index(trials: List[Dict]) -> Dict:
+    """Sites of all trials sorted by grid cell: parallel lat/lon/trial-position lists plus each
+    site's cell key and a content hash (JSON-serializable, stored with the trial list index)."""
+    lats, lons, owners = [], [], []
+    for i, trial in enumerate(trials):
+        for lat, lon in trial.get("sites") or []:
+            lats.append(lat)
+            lons.append(lon)
+            owners.append(i)
+    lats, lons, owners = np.array(lats, dtype=float), np.array(lons, dtype=float), np.array(owners, dtype=np.int64)
+    keys = cell_keys(lats, lons)
+    order = np.argsort(keys, kind="stable")
+    lats, lons, owners = lats[order], lons[order], owners[order]
+    digest = hashlib.sha1(lats.tobytes() + lons.tobytes() + owners.tobytes()).hexdigest()[:12]
+    return {
+        "version": digest,
+        "keys": keys[order].tolist(),
+        "lat": lats.tolist(),
+        "lon": lons.tolist(),
+        "trial": owners.tolist(),
+    }
+
+def radius_cells(lat: float, lon: float, radius_km: float) -> Optional[List[int]]:
+    """Keys of the grid cells overlapping the radius's bounding box, or None when it spans most of the globe."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    if dlat >= 45 or abs(lat) + dlat >= 89:
+        return None
+    dlon = dlat / math.cos(math.radians(abs(lat) + dlat))
+    rows = range(int((lat - dlat + 90) // GEO_CELL_DEGREES), int((lat + dlat + 90) // GEO_CELL_DEGREES) + 1)
+    first, last = int((lon - dlon + 180) // GEO_CELL_DEGREES), int((lon + dlon + 180) // GEO_CELL_DEGREES)
+    cols = {col % LON_CELLS for col in range(first, min(last, first + LON_CELLS - 1) + 1)}
+    return [row * LON_CELLS + col for row in rows for col in cols]
+
+def site_arrays(index: Dict) -> Tuple[np.ndarray, ...]:
+    """(keys, lat, lon, trial) arrays of a site grid, reused across requests for the same grid."""
+    version = index.get("version")
+    arrays = _site_arrays.get(version) if version else None
+    if arrays is None:
+        arrays = (np.asarray(index["keys"], dtype=np.int64), np.asarray(index["lat"], dtype=float),
+                  np.asarray(index["lon"], dtype=float), np.asarray(index["trial"], dtype=np.int64))
+        if version:
+            _site_arrays[version] = arrays
+            if len(_site_arrays) > SITE_ARRAYS_CACHE_SIZE:
+                _site_arrays.popitem(last=False)
+    else:
+        _site_arrays.move_to_end(version)
+    return arrays
+
+def trial_distances(index: Dict, size: int, lat: float, lon: float, radius_km: Optional[float] = None) -> np.ndarray:
+    """Distance in km from (lat, lon) to each trial's nearest site; inf for trials without sites
+    (and, with radius_km, for trials with no site within it)."""
+    distances = np.full(size, np.inf)
+    if not index["keys"]:
+        return distances
+    keys, lats, lons, owners = site_arrays(index)
+    cells = radius_cells(lat, lon, radius_km) if radius_km is not None else None
+    if cells is None:
+        sites = np.arange(len(keys))
+    else:
+        cells = np.asarray(sorted(cells), dtype=np.int64)
+        starts, ends = np.searchsorted(keys, cells, "left"), np.searchsorted(keys, cells, "right")
+        sites = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends) if e > s] or [np.arange(0)])
+    if not len(sites):
+        return distances
+    site_distances = haversine_km(lat, lon, lats[sites], lons[sites])
+    if radius_km is not None:
+        within = site_distances <= radius_km
+        sites, site_distances = sites[within], site_distances[within]
+    np.minimum.at(distances, owners[sites], site_distances)
+    return distances
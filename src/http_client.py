@@ -0,0 +1,229 @@
+# Shared HTTP client for ClinicalTrials.gov: pooled keep-alive connections (HTTP/2 when the
+# h2 package is installed), retries with jittered exponential backoff, a client-side rate
+# limiter and a circuit breaker. Every call is timed so connection reuse and retry cost show up
+# in stats().
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Optional
+import httpx
+from .telemetry import ctgov_seconds
+from .workers import worker_rate, worker_slots
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CTGOV_TIMEOUT = float(os.getenv('CTGOV_TIMEOUT', '10'))
+CTGOV_MAX_CONNECTIONS = int(os.getenv('CTGOV_MAX_CONNECTIONS', '20'))
+CTGOV_RETRIES = int(os.getenv('CTGOV_RETRIES', '3'))
+CTGOV_BACKOFF_BASE = float(os.getenv('CTGOV_BACKOFF_BASE', '0.5'))
+CTGOV_BACKOFF_MAX = float(os.getenv('CTGOV_BACKOFF_MAX', '8'))
+# ClinicalTrials.gov allows roughly 50 requests per minute per IP (split between workers); 0 disables the limiter
+CTGOV_RATE_LIMIT = float(os.getenv('CTGOV_RATE_LIMIT', str(50 / 60)))
+CTGOV_RATE_BURST = int(os.getenv('CTGOV_RATE_BURST', '10'))
+CTGOV_BREAKER_THRESHOLD = int(os.getenv('CTGOV_BREAKER_THRESHOLD', '5'))
+CTGOV_BREAKER_COOLDOWN = float(os.getenv('CTGOV_BREAKER_COOLDOWN', '30'))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+class CircuitOpenError(httpx.HTTPError):
+    pass
+
+class RateLimiter:
+    """Token bucket: `rate` requests per second on average, bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> float:
+        """Wait for a token; returns the time spent waiting."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return waited
+            delay = (1 - self.tokens) / self.rate
+            waited += delay
+            await asyncio.sleep(delay)
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failed calls and lets one probe through after `cooldown`."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"ClinicalTrials.gov circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop = None
+rate_limiter = RateLimiter(worker_rate(CTGOV_RATE_LIMIT), worker_slots(CTGOV_RATE_BURST))
+breaker = CircuitBreaker(CTGOV_BREAKER_THRESHOLD, CTGOV_BREAKER_COOLDOWN)
+counters = {
+    "calls": 0,
+    "failed_calls": 0,
+    "attempts": 0,
+    "retries": 0,
+    "new_connections": 0,
+    "rejected_open_circuit": 0,
+    "rate_limit_wait_s": 0.0,
+    "retry_wait_s": 0.0,
+}
+recent_calls = deque(maxlen=50)
+
+def get_client() -> httpx.AsyncClient:
+    """The shared client, created on first use in the running event loop."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=CTGOV_TIMEOUT,
+            http2=HTTP2,
+            limits=httpx.Limits(
+                max_connections=CTGOV_MAX_CONNECTIONS,
+                max_keepalive_connections=CTGOV_MAX_CONNECTIONS,
+            ),
+        )
+        _client_loop = loop
+    return _client
+
+async def close_client():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client, _client_loop = None, None
+
+def backoff_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+    # full jitter, but never sooner than the server's Retry-After
+    delay = random.uniform(0, min(CTGOV_BACKOFF_MAX, CTGOV_BACKOFF_BASE * 2 ** attempt))
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(float(retry_after), CTGOV_BACKOFF_MAX))
+    return delay
+
+async def get_json(url: str, params: Optional[dict] = None) -> dict:
+    """GET a ClinicalTrials.gov url and return the decoded JSON body.
+
+    Raises httpx.HTTPError (CircuitOpenError while the breaker is open) once
+    retries are exhausted or for non-retryable statuses.
+    """
+    counters["calls"] += 1
+    if not breaker.allow():
+        counters["rejected_open_circuit"] += 1
+        counters["failed_calls"] += 1
+        raise CircuitOpenError("ClinicalTrials.gov circuit breaker is open")
+
+    started = time.perf_counter()
+    connections = []
+    async def trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            connections.append(event_name)
+
+    call = {"url": httpx.URL(url).path, "attempts": 0, "rate_limit_wait_ms": 0.0, "retry_wait_ms": 0.0}
+    async def take_token():
+        # every attempt, retries included, takes a token and counts its wait
+        waited = await rate_limiter.acquire()
+        counters["rate_limit_wait_s"] += waited
+        call["rate_limit_wait_ms"] = round(call["rate_limit_wait_ms"] + waited * 1000, 1)
+
+    await take_token()
+    try:
+        for attempt in range(CTGOV_RETRIES + 1):
+            call["attempts"] += 1
+            counters["attempts"] += 1
+            response = None
+            attempt_started = time.perf_counter()
+            try:
+                response = await get_client().get(url, params=params, extensions={"trace": trace})
+                call["status"] = response.status_code
+                ctgov_seconds.observe(time.perf_counter() - attempt_started, status=str(response.status_code))
+                if response.status_code not in RETRY_STATUSES or attempt == CTGOV_RETRIES:
+                    response.raise_for_status()
+                    data = response.json()
+                    breaker.record_success()
+                    return data
+            except httpx.TransportError as e:
+                call["status"] = type(e).__name__
+                ctgov_seconds.observe(time.perf_counter() - attempt_started, status=type(e).__name__)
+                if attempt == CTGOV_RETRIES:
+                    raise
+            delay = backoff_delay(attempt, response)
+            counters["retries"] += 1
+            counters["retry_wait_s"] += delay
+            call["retry_wait_ms"] += round(delay * 1000, 1)
+            await asyncio.sleep(delay)
+            await take_token()
+    except httpx.HTTPStatusError as e:
+        # 4xx other than 429 means the request was wrong, not that the service is down
+        if e.response.status_code in RETRY_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        counters["failed_calls"] += 1
+        raise
+    except httpx.HTTPError:
+        breaker.record_failure()
+        counters["failed_calls"] += 1
+        raise
+    finally:
+        breaker.probing = False
+        counters["new_connections"] += len(connections)
+        call["new_connections"] = len(connections)
+        call["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        recent_calls.append(call)
+
+def stats() -> dict:
+    attempts = counters["attempts"]
+    return {
+        **counters,
+        "connection_reuse_rate": 1 - counters["new_connections"] / attempts if attempts else 0.0,
+        "http2": HTTP2,
+        "circuit": breaker.state,
+        "recent_calls": list(recent_calls),
+    }
@@ -0,0 +1,131 @@
+# Background jobs: a list of items processed by a bounded pool of asyncio workers.
+# Job records (status, per-item progress and results) are written to storage under
+# jobs/{job_id}.json every JOB_SAVE_INTERVAL seconds while the job runs, so any worker process
+# can report progress. Each write refreshes the job's heartbeat; a job whose heartbeat stops
+# (its process was stopped) is reported as interrupted.
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from .storage import save_data_async, load_data_async
+from .telemetry import request_timings
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+JOB_SAVE_INTERVAL = float(os.getenv('JOB_SAVE_INTERVAL', '1'))
+# JOB_STALE_SECONDS: a queued or running job with no heartbeat for this long is marked interrupted
+JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', '60'))
+
+running_jobs: Dict[str, asyncio.Task] = {}
+
+def job_key(job_id: str) -> str:
+    return f'jobs/{job_id}.json'
+
+def new_job(kind: str, total: int, workers: int) -> Dict:
+    return {
+        "job_id": str(uuid.uuid4()),
+        "kind": kind,
+        "status": "queued",
+        "created_at": datetime.utcnow().isoformat(),
+        "heartbeat_at": datetime.utcnow().isoformat(),
+        "finished_at": None,
+        "workers": workers,
+        "total": total,
+        "completed": 0,
+        "failed": 0,
+        "items": [{"index": i, "status": "queued"} for i in range(total)],
+    }
+
+async def run_job(job: Dict, items: List, handler: Callable[[object], Awaitable[Dict]], workers: int):
+    queue: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        queue.put_nowait((index, item))
+    save_lock = asyncio.Lock()
+
+    async def save():
+        # snapshot under the lock so writes land in order and never see a half-updated record
+        async with save_lock:
+            job["heartbeat_at"] = datetime.utcnow().isoformat()
+            await save_data_async(job_key(job["job_id"]), json.loads(json.dumps(job)))
+
+    async def save_periodically():
+        # one write per interval rather than one per item, which rewrote the whole record N times
+        while not finished.is_set():
+            try:
+                await asyncio.wait_for(finished.wait(), JOB_SAVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await save()
+
+    async def worker():
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            entry = job["items"][index]
+            entry["status"] = "running"
+            # each item collects its own stage timings instead of the submitting request's
+            timings = {}
+            request_timings.set(timings)
+            started = time.perf_counter()
+            try:
+                entry["result"] = await handler(item)
+                entry["status"] = "done"
+                job["completed"] += 1
+            except Exception as e:
+                logger.error(f"Job {job['job_id']} item {index} failed: {str(e)}")
+                entry["status"] = "failed"
+                entry["error"] = str(e)
+                job["failed"] += 1
+            entry["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            entry["stage_timings"] = dict(timings)
+
+    job["status"] = "running"
+    await save()
+    # the saver is stopped rather than cancelled so that no interval write can land after the final one
+    finished = asyncio.Event()
+    saver = asyncio.create_task(save_periodically())
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(workers, len(items)) or 1)))
+    finally:
+        finished.set()
+        await saver
+    job["status"] = "done" if job["failed"] == 0 else ("failed" if job["completed"] == 0 else "partial")
+    job["finished_at"] = datetime.utcnow().isoformat()
+    await save()
+    logger.info(f"Job {job['job_id']} finished: {job['completed']} done, {job['failed']} failed")
+
+async def start_job(kind: str, items: List, handler: Callable[[object], Awaitable[Dict]], workers: int) -> Dict:
+    """Store a new job record and process its items in the background; returns the record."""
+    job = new_job(kind, len(items), workers)
+    if not await save_data_async(job_key(job["job_id"]), job):
+        raise RuntimeError("Failed to store job")
+    task = asyncio.create_task(run_job(job, items, handler, workers))
+    running_jobs[job["job_id"]] = task
+    task.add_done_callback(lambda _: running_jobs.pop(job["job_id"], None))
+    return job
+
+def is_stale(job: Dict) -> bool:
+    if job.get("status") not in ("queued", "running") or job["job_id"] in running_jobs:
+        return False
+    # records stored before heartbeats were added fall back to their creation time
+    heartbeat = datetime.fromisoformat(job.get("heartbeat_at") or job["created_at"])
+    return datetime.utcnow() - heartbeat > timedelta(seconds=JOB_STALE_SECONDS)
+
+async def load_job(job_id: str) -> Optional[Dict]:
+    """The job record; a job whose process stopped mid-run is marked interrupted and stored so."""
+    job = await load_data_async(job_key(job_id))
+    if job and is_stale(job):
+        logger.warning(f"Job {job_id} has had no heartbeat since {job.get('heartbeat_at')}; marking it interrupted")
+        job["status"] = "interrupted"
+        job["finished_at"] = datetime.utcnow().isoformat()
+        for entry in job.get("items", []):
+            if entry["status"] in ("queued", "running"):
+                entry["status"] = "interrupted"
+        await save_data_async(job_key(job_id), job)
+    return job
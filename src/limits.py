@@ -0,0 +1,98 @@
+# Request-level concurrency limits with bounded queueing and backpressure. A limit admits `limit`
+# holders at once and queues up to `max_queue` more for at most `timeout` seconds; anything beyond
+# that is rejected with Overloaded, which the API answers with 429 Too Many Requests and a
+# Retry-After estimated from how long recent holders kept their slot. Background work (rankings,
+# bulk jobs) waits for a slot instead of being rejected.
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+from .telemetry import Collected, register
+
+class Overloaded(Exception):
+    """A concurrency limit is full and its queue is too; retry after `retry_after` seconds."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Too many concurrent {name} requests, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+class ConcurrencyLimit:
+    def __init__(self, name: str, limit: int, max_queue: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        # moving average of how long a slot is held, seeded with a guess until something finishes
+        self.mean_hold = 1.0
+        self._semaphore = asyncio.Semaphore(limit)
+        limits[name] = self
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead of a new request has likely drained (1 to 60)."""
+        return max(1, min(60, math.ceil(self.mean_hold * (self.waiting + 1) / self.limit)))
+
+    def reject(self):
+        self.rejected += 1
+        raise Overloaded(self.name, self.retry_after())
+
+    async def acquire(self, background: bool = False) -> float:
+        """Take a slot, queueing if need be; returns the time it was taken (pass it to release)."""
+        if not background and self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.reject()
+        self.waiting += 1
+        try:
+            acquire = self._semaphore.acquire()
+            await (acquire if background else asyncio.wait_for(acquire, self.timeout))
+            timed_out = False
+        except asyncio.TimeoutError:
+            timed_out = True
+        finally:
+            self.waiting -= 1
+        if timed_out:
+            self.reject()
+        self.active += 1
+        self.admitted += 1
+        return time.monotonic()
+
+    def release(self, acquired_at: float):
+        self.active -= 1
+        self.mean_hold += 0.1 * (time.monotonic() - acquired_at - self.mean_hold)
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self, background: bool = False):
+        acquired_at = await self.acquire(background)
+        try:
+            yield
+        finally:
+            self.release(acquired_at)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "mean_hold_seconds": self.mean_hold,
+        }
+
+limits: Dict[str, ConcurrencyLimit] = {}
+
+def limit_stats() -> Dict[str, dict]:
+    return {name: limit.stats() for name, limit in limits.items()}
+
+def _field(field):
+    return lambda: {(("limit", name),): stats[field] for name, stats in limit_stats().items()}
+
+register(Collected("concurrency_limit_active", "Slots in use per concurrency limit.", "gauge", _field("active")))
+register(Collected("concurrency_limit_waiting", "Requests queued per concurrency limit.", "gauge", _field("waiting")))
+register(Collected("concurrency_limit_rejected_total", "Requests rejected with 429 per concurrency limit.",
+                   "counter", _field("rejected")))
@@ -1,37 +1,154 @@
-def extract_patient_data(client, model, prompt,transcript,temperature,max_tokens):
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": transcript}
-        ],
-        temperature=temperature,
-        max_tokens=max_tokens
+# imports
+import hashlib
+import json
+import os
+import time
+from functools import lru_cache
+from .cache import TTLCache
+from .http_client import RateLimiter
+from .limits import ConcurrencyLimit
+from .prompt_builder import ranking_content, ask_ai_content
+from .telemetry import llm_seconds, llm_tokens, llm_cache_lookups
+from .workers import shared_path, worker_rate, worker_slots
+
+# LLM response cache configuration (LLM_CACHE_PATH enables on-disk persistence, LLM_CACHE_TTL=0 disables caching)
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '1024'))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', '86400'))
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '')
+
+# OpenAI limits for the whole deployment (split between workers): concurrent requests in flight and,
+# optionally, requests per second (0 = unlimited)
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+LLM_RATE_LIMIT = float(os.getenv('LLM_RATE_LIMIT', '0'))
+LLM_RATE_BURST = int(os.getenv('LLM_RATE_BURST', '10'))
+# requests waiting for a free LLM slot, and how long they wait, before API calls get a 429
+LLM_QUEUE_SIZE = int(os.getenv('LLM_QUEUE_SIZE', '32'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '10'))
+
+llm_limit = ConcurrencyLimit("llm", worker_slots(LLM_MAX_CONCURRENCY), LLM_QUEUE_SIZE, LLM_QUEUE_TIMEOUT)
+llm_rate_limiter = RateLimiter(worker_rate(LLM_RATE_LIMIT), worker_slots(LLM_RATE_BURST))
+llm_cache = TTLCache("llm", max_entries=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL, path=shared_path("llm-cache", LLM_CACHE_PATH))
+llm_metrics = {"upstream_calls": 0, "upstream_seconds": 0.0, "saved_seconds": 0.0}
+
+@lru_cache(maxsize=32)
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+def completion_key(model, prompt, user_content, temperature, response_format=None):
+    # content-addressed: the same model, system prompt, input, temperature and output schema give the same key
+    material = json.dumps([model, prompt_hash(prompt), user_content, temperature, response_format], sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+def cached_completion(key, function):
+    cached = llm_cache.get(key)
+    llm_cache_lookups.inc(function=function, result="miss" if cached is None else "hit")
+    if cached is not None:
+        llm_metrics["saved_seconds"] += cached["latency"]
+    return cached
+
+def store_completion(key, content, latency, function, usage=None, finish_reason="stop"):
+    llm_metrics["upstream_calls"] += 1
+    llm_metrics["upstream_seconds"] += latency
+    llm_seconds.observe(latency, function=function)
+    if usage is not None:
+        llm_tokens.observe(usage.prompt_tokens, function=function, kind="prompt")
+        llm_tokens.observe(usage.completion_tokens, function=function, kind="completion")
+    # only complete answers are cached; one cut off at max_tokens ("length") or filtered is asked again
+    if finish_reason == "stop":
+        llm_cache.set(key, {"content": content, "latency": latency})
+
+async def chat_completion(client, model, prompt, user_content, temperature, max_tokens, response_format=None,
+                          function="chat_completion", background=False, use_cache=True):
+    """Run a chat completion through the response cache; returns (content, cached).
+
+    `function` names the caller in the latency, token and cache metrics.
+    Raises Overloaded when the LLM budget and its queue are full, unless
+    `background`, in which case it waits for a slot. With `use_cache` off the
+    model is always called, and its answer replaces the cached one.
+    """
+    key = completion_key(model, prompt, user_content, temperature, response_format)
+    options = {"response_format": response_format} if response_format else {}
+    cached = cached_completion(key, function) if use_cache else None
+    if cached is not None:
+        return cached["content"], True
+    async with llm_limit.slot(background):
+        await llm_rate_limiter.acquire()
+        started = time.perf_counter()
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": user_content}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **options
+        )
+    content = response.choices[0].message.content
+    store_completion(
+        key, content, time.perf_counter() - started, function, response.usage, response.choices[0].finish_reason
     )
-    return response.choices[0].message.content
-
-def rank_trials(client, model, prompt, trials_list, llm_output, temperature,max_tokens):
-    user_content = f'Trial list - {trials_list}\nSummary - {llm_output}'
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": user_content}
-        ],
-        temperature=temperature,
-        max_tokens=max_tokens
+    return content, False
+
+def llm_cache_stats():
+    calls = llm_metrics["upstream_calls"]
+    return {
+        **llm_cache.stats(),
+        **llm_metrics,
+        "mean_upstream_latency": llm_metrics["upstream_seconds"] / calls if calls else 0.0,
+    }
+
+async def extract_patient_data(client, model, prompt,transcript,temperature,max_tokens,response_format=None,
+                               background=False):
+    return await chat_completion(
+        client, model, prompt, transcript, temperature, max_tokens, response_format, "extract_patient_data",
+        background
     )
-    return response.choices[0].message.content
-
-def ask_ai(client, model, prompt, query, llm_output, trial_input, temperature, max_tokens):
-    user_content = f'Patient Summary:\n{llm_output}\n\nTrial Details:\n{trial_input}\n\nUser Question: {query}'
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": user_content}
-        ],
-        temperature=temperature,
-        max_tokens=max_tokens
+
+async def rank_trials(client, model, prompt, trials_list, llm_output, temperature,max_tokens,response_format=None,
+                      use_cache=True):
+    user_content = ranking_content(trials_list, llm_output)
+    # rankings are computed in the background, so they wait for the LLM rather than being rejected
+    return await chat_completion(
+        client, model, prompt, user_content, temperature, max_tokens, response_format, "rank_trials", True,
+        use_cache
     )
-    return response.choices[0].message.content
+
+async def ask_ai(client, model, prompt, query, llm_output, trial_input, temperature, max_tokens):
+    user_content = ask_ai_content(query, llm_output, trial_input)
+    return await chat_completion(client, model, prompt, user_content, temperature, max_tokens, function="ask_ai")
+
+async def ask_ai_stream(client, model, prompt, query, llm_output, trial_input, temperature, max_tokens):
+    """Yield (text, cached) pieces of the answer; a cached answer arrives as a single piece."""
+    user_content = ask_ai_content(query, llm_output, trial_input)
+    key = completion_key(model, prompt, user_content, temperature)
+    cached = cached_completion(key, "ask_ai_stream")
+    if cached is not None:
+        yield cached["content"], True
+        return
+    answer = []
+    usage = None
+    finish_reason = None
+    async with llm_limit.slot():
+        await llm_rate_limiter.acquire()
+        started = time.perf_counter()
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": user_content}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            # with include_usage the last chunk has no choices, only the token counts
+            usage = chunk.usage or usage
+            if chunk.choices:
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+            if chunk.choices and chunk.choices[0].delta.content:
+                answer.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content, False
+    store_completion(key, ''.join(answer), time.perf_counter() - started, "ask_ai_stream", usage, finish_reason)
@@ -1,20 +1,45 @@
 #imports
 import os
 import json
+import asyncio
 import logging
 import uuid
 import uvicorn
-import re
+import threading
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from openai import OpenAI
-from typing import List, Dict
-from fastapi import FastAPI, HTTPException
+from typing import Any, List, Dict, Optional, Tuple
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from .llm_service import extract_patient_data, rank_trials, ask_ai
-from .trial_service import get_params, relevant_trials, trials_long
-from .storage import save_data, load_data, delete_data, list_keys
+from .llm_service import extract_patient_data, rank_trials, ask_ai, ask_ai_stream, llm_cache_stats
+from .trial_service import (
+    MAX_PAGE_SIZE as MAX_SEARCH_CANDIDATES, get_params, relevant_trials, stream_search, trials_long, trials_long_many,
+    trial_cache, search_cache_stats
+)
+from .jobs import start_job, load_job
+from .rematch import REMATCH_INTERVAL, note_lock, rematch_running, run_rematch, rematch_loop
+from .prerank import prerank_trials
+from .eligibility import eligible_trials, status_filter
+from .geo import parse_point
+from .trial_lists import MAX_PAGE_SIZE, build_list_index, current_index, list_version, page_trials, parse_filters, trim
+from .records import FastJSONResponse, parse_fields
+from .structured import response_format, parse_json, conform, parse_stats
+from .prompt_builder import (
+    EXTRACTION_MAX_TOKENS, ASK_AI_MAX_TOKENS, PromptFile, encoding, ranking_max_tokens, trial_context
+)
+from . import http_client
+from .limits import ConcurrencyLimit, Overloaded, limit_stats
+from .workers import HOST, PORT, WEB_CONCURRENCY, check_shared_state, is_leader
+from .telemetry import span, render, register_caches, request_timings, server_timing, http_seconds, stage_seconds
+from .storage import (
+    save_data_async, load_data_async, delete_data_async, list_keys_async, load_many_async, storage_stats,
+    get_backend, check_storage_async, close_storage, STORAGE_BACKEND
+)
 
 # Configure logging (container-friendly - no file logging)
 logging.basicConfig(
@@ -27,8 +52,32 @@ logger = logging.getLogger(__name__)
 #loading environment variables
 load_dotenv()
 
+# startup: dependencies are initialized by a background warm-up, so the server accepts connections
+# (and answers /healthz) right away and /readyz turns ready once the warm-up is done;
+# the scheduled re-match of stored notes runs for as long as the app does (in one worker only).
+# shutdown: stop background tasks and close the upstream clients
+startup = {"status": "starting", "started_at": time.time()}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_shared_state(STORAGE_BACKEND)
+    warm_up_task = asyncio.create_task(warm_up())
+    rematch_task = None
+    if REMATCH_INTERVAL > 0 and is_leader("rematch"):
+        logger.info(f"Re-matching stored notes every {REMATCH_INTERVAL:.0f}s")
+        rematch_task = asyncio.create_task(rematch_loop(base_url, REMATCH_INTERVAL))
+    yield
+    for task in (warm_up_task, rematch_task):
+        if task is not None:
+            task.cancel()
+    await http_client.close_client()
+    if _client is not None:
+        await _client.close()
+    await asyncio.to_thread(close_storage)
+    logger.info("Shut down cleanly")
+
 #initialize fastapi app
-app = FastAPI(title = "Clinical Notes and Trials", version = "1.0.0")
+app = FastAPI(title = "Clinical Notes and Trials", version = "1.0.0", lifespan=lifespan)
 logger.info("FastAPI app initialized")
 
 #CORS configuration
@@ -42,6 +91,40 @@ app.add_middleware(
 )
 logger.info(f"CORS middleware configured with origins: {cors_origins}")
 
+# gzip responses of at least GZIP_MIN_SIZE bytes for clients that accept it (0 turns it off);
+# server-sent event streams are never compressed
+gzip_min_size = int(os.getenv('GZIP_MIN_SIZE', '1000'))
+if gzip_min_size > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=gzip_min_size)
+
+# a full concurrency limit answers 429 with a Retry-After estimate
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, e: Overloaded) -> JSONResponse:
+    return JSONResponse(status_code=429, content={"detail": str(e)}, headers={"Retry-After": str(e.retry_after)})
+
+# request latency and stage timings; for streamed responses the latency is time to first byte
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    timings = {}
+    request_timings.set(timings)
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    http_seconds.observe(
+        time.perf_counter() - started,
+        method=request.method, route=getattr(route, "path", "unmatched"), status=str(response.status_code)
+    )
+    if timings:
+        response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+register_caches(lambda: {
+    "trials": trial_cache.stats(),
+    "searches": search_cache_stats(),
+    "llm": llm_cache_stats(),
+    "storage": storage_stats(),
+})
+
 #pydantic models for api responses
 class PatientData(BaseModel):
     patient_name: str
@@ -60,13 +143,12 @@ class PatientData(BaseModel):
     interventions: List[str]
     concerns: str
 
-class TrialData(BaseModel):
-    nct_id: str
-    conditions: str
-    interventions: str
-
-class TrialDataList(BaseModel):
-    trials: List[TrialData]
+class TrialPage(BaseModel):
+    # trials are trimmed to the requested fields, so they are plain dicts
+    trials: List[Dict]
+    next_cursor: Optional[str] = None
+    # trials passing the filters
+    total: int
 
 class TrialDataLong(BaseModel):
     nct_id: str
@@ -86,6 +168,12 @@ class TrialDataLong(BaseModel):
     phases: str
     eligibility_criteria: str
     
+class TrialBatchRequest(BaseModel):
+    nct_ids: List[str]
+
+class TrialBatchResponse(BaseModel):
+    trials: Dict[str, TrialDataLong]
+
 class TranscriptUploadRequest(BaseModel):
     transcript: str
 
@@ -95,6 +183,13 @@ class ClinicalNotesResponse(BaseModel):
     trials: List[Dict]
     created_at: str
     total_trials_found: int
+    cached: bool = False
+
+class BulkJobResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    workers: int
 
 class TrialRanking(BaseModel):
     nct_id: str
@@ -102,28 +197,351 @@ class TrialRanking(BaseModel):
     relevance_score: int
 
 class TrialRankingList(BaseModel):
+    status: str = "ready"
     trials: List[TrialRanking]
+    error: Optional[str] = None
+    cached: bool = False
 
+# schema-constrained output formats for the extraction and ranking calls
+patient_data_format = response_format(PatientData, "patient_data")
+ranking_format = response_format(TrialRankingList, "trial_ranking", fields=("trials",))
 
 class AskAIRequest(BaseModel):
     clinical_notes_id: str
     nct_id: str
     query: str
 
-#initialize llm and api clients
-def read_text_file(file_path):
-    with open(file_path, 'r',encoding="utf8") as file:
-        file_content = file.read()
-    return file_content
+#llm client and prompts, created and read on first use (prompts are re-read when they change on disk)
+_client = None
+_client_lock = threading.Lock()
+
+def llm_client():
+    """The OpenAI client. Created lazily because importing openai is the slowest part of startup."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import AsyncOpenAI
+                _client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 model = "gpt-4o"
-clinical_notes_prompt = read_text_file("prompts/clinical_notes_prompt.txt")
-ranking_prompt = read_text_file("prompts/ranking_prompt.txt")
-ask_ai_prompt = read_text_file("prompts/ask_ai_prompt.txt")
+clinical_notes_prompt = PromptFile("prompts/clinical_notes_prompt.txt")
+ranking_prompt = PromptFile("prompts/ranking_prompt.txt")
+ask_ai_prompt = PromptFile("prompts/ask_ai_prompt.txt")
+prompt_files = (clinical_notes_prompt, ranking_prompt, ask_ai_prompt)
 temperature = 0.2
-max_tokens = 10000
-base_url = "https://clinicaltrials.gov/api/v2/studies"
+max_batch_size = 1000
+bulk_workers = int(os.getenv("BULK_WORKERS", "8"))
+bulk_max_workers = 32
+max_bulk_items = 1000
+search_candidates = int(os.getenv("SEARCH_CANDIDATES", "200"))
+display_limit = 40
+default_page_size = 100
+rank_top_k = 30
+max_ranking_wait = 120
+ranking_stale_after = 300
+base_url = os.getenv("CLINICAL_TRIALS_API_URL", "https://clinicaltrials.gov/api/v2/studies")
+
+# per-worker limits on concurrent transcript uploads and ask-AI questions; requests over a limit
+# wait in a queue of up to request_queue_size for request_queue_timeout seconds, then get a 429
+upload_concurrency = int(os.getenv("UPLOAD_CONCURRENCY", "32"))
+ask_ai_concurrency = int(os.getenv("ASK_AI_CONCURRENCY", "32"))
+request_queue_size = int(os.getenv("REQUEST_QUEUE_SIZE", "64"))
+request_queue_timeout = float(os.getenv("REQUEST_QUEUE_TIMEOUT", "5"))
+upload_limit = ConcurrencyLimit("transcripts", upload_concurrency, request_queue_size, request_queue_timeout)
+ask_ai_limit = ConcurrencyLimit("ask_ai", ask_ai_concurrency, request_queue_size, request_queue_timeout)
+
+#server-sent events helpers
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class EventStream(StreamingResponse):
+    """A streamed response that calls `on_close` once it is done, however the stream ended."""
+
+    def __init__(self, events, on_close=None):
+        super().__init__(
+            events,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+def sse_response(events, on_close=None) -> StreamingResponse:
+    return EventStream(events, on_close)
+
+async def limited_stream(limit: ConcurrencyLimit, events) -> StreamingResponse:
+    """Stream `events` holding a slot of `limit` until the response ends (429 when none is free)."""
+    acquired_at = await limit.acquire()
+    return sse_response(events, lambda: limit.release(acquired_at))
+
+def elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+# saved trials with their list index, loaded once and dropped when this worker saves or removes one;
+# with several workers the stored keys are compared too, since another worker may have changed them
+saved_trials: Dict[str, Any] = {}
+saved_trials_changes = 0
+
+def forget_saved_trials():
+    global saved_trials_changes
+    saved_trials.clear()
+    saved_trials_changes += 1
+
+async def saved_trials_list() -> Tuple[List[Dict], Dict]:
+    cached = dict(saved_trials)
+    keys = sorted(await list_keys_async('saved-trials/')) if WEB_CONCURRENCY > 1 or not cached else None
+    if cached and (keys is None or keys == cached["keys"]):
+        return cached["trials"], cached["index"]
+    changes = saved_trials_changes
+    loaded = await load_many_async(keys)
+    trials_list = [loaded[key] for key in keys if loaded.get(key)]
+    index = build_list_index(trials_list)
+    # a save or removal while loading may not be in what was loaded; keep it for this response only
+    if changes == saved_trials_changes:
+        saved_trials.update(keys=keys, trials=trials_list, index=index)
+    return trials_list, index
+
+#background trial ranking
+ranking_tasks: Dict[str, asyncio.Task] = {}
+
+def parse_ranking(ranking_json: str) -> List[Dict]:
+    ranking_data = parse_json(ranking_json)
+    if isinstance(ranking_data, dict) and isinstance(ranking_data.get("trials"), list):
+        entries = ranking_data["trials"]
+    elif isinstance(ranking_data, dict):
+        # free-form output in the older {nct_id: [explanation, score]} shape
+        entries = [
+            {
+                "nct_id": nct_id,
+                "explanation": data[0] if isinstance(data, list) and len(data) > 0 else "No explanation",
+                "relevance_score": data[1] if isinstance(data, list) and len(data) > 1 else 0
+            }
+            for nct_id, data in ranking_data.items()
+        ]
+    else:
+        entries = ranking_data if isinstance(ranking_data, list) else []
+    ranked_trials = []
+    for entry in entries:
+        trial = conform(entry, TrialRanking)
+        if trial["nct_id"]:
+            # an entry cut off by the output budget keeps its place in the ranking
+            trial["explanation"] = trial["explanation"] or "No explanation"
+            ranked_trials.append(trial)
+    return ranked_trials
+
+def parse_patient_data(llm_output: str) -> PatientData:
+    """PatientData from the extraction output, repairing malformed JSON and missing fields locally."""
+    return PatientData(**conform(parse_json(llm_output), PatientData))
+
+async def compute_ranking(
+    clinical_notes_id: str, trials_list: List[Dict], patient_summary: str, use_cache: bool = True
+) -> Dict:
+    key = f'notes/{clinical_notes_id}.json'
+    ranking_json = ""
+    try:
+        # trials are already sorted by the local pre-ranker, only the best go to the LLM
+        shortlist = [
+            {"nct_id": t["nct_id"], "conditions": t["conditions"], "interventions": t["interventions"]}
+            for t in trials_list[:rank_top_k]
+        ]
+        logger.info(f"Ranking {len(shortlist)} of {len(trials_list)} trials for {clinical_notes_id}")
+        with span("rank", trials=len(shortlist)):
+            ranking_json, cached = await rank_trials(
+                llm_client(), model, ranking_prompt.text, shortlist, patient_summary, temperature,
+                ranking_max_tokens(len(shortlist)), ranking_format, use_cache
+            )
+        ranking = {"status": "ready", "trials": parse_ranking(ranking_json), "cached": cached}
+        logger.info(f"Ranked {len(ranking['trials'])} trials for {clinical_notes_id}")
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse AI ranking response: {e}")
+        logger.error(f"Raw response was: {ranking_json[:500]}")
+        ranking = {"status": "failed", "trials": [], "error": f"Failed to parse AI ranking response: {str(e)}"}
+    except Exception as e:
+        logger.error(f"Error ranking trials: {str(e)}")
+        logger.exception("Full traceback:")
+        ranking = {"status": "failed", "trials": [], "error": f"Error ranking trials: {str(e)}"}
+    ranking["updated_at"] = datetime.utcnow().isoformat()
+
+    async with note_lock(clinical_notes_id):
+        note = await load_data_async(key)
+        # a re-match may have changed the list while the model was ranking; the ranking
+        # endpoint then recomputes it for the new list
+        if note and list_version(note["trials"]) == list_version(trials_list):
+            note["ranking"] = ranking
+            note["list_index"] = build_list_index(note["trials"], ranking)
+            await save_data_async(key, note)
+    return ranking
+
+def schedule_ranking(
+    clinical_notes_id: str, trials_list: List[Dict], patient_summary: str, use_cache: bool = True
+) -> asyncio.Task:
+    """Start ranking the note's trials unless it is already being ranked; use_cache=False asks the model again."""
+    task = ranking_tasks.get(clinical_notes_id)
+    if task is None:
+        task = asyncio.create_task(compute_ranking(clinical_notes_id, trials_list, patient_summary, use_cache))
+        ranking_tasks[clinical_notes_id] = task
+        task.add_done_callback(lambda _: ranking_tasks.pop(clinical_notes_id, None))
+    return task
+
+def ranking_is_stale(ranking: Dict) -> bool:
+    # notes stored before rankings were precomputed have none; a pending ranking with no
+    # task is left over from a restart if it has not been updated for a while
+    if not ranking:
+        return True
+    if ranking.get("status") != "pending":
+        return False
+    updated_at = datetime.fromisoformat(ranking.get("updated_at", "1970-01-01T00:00:00"))
+    return (datetime.utcnow() - updated_at).total_seconds() > ranking_stale_after
+
+def new_note_record(patient_data: PatientData, trials_list: List[Dict], timestamp: str, patient_summary: str) -> Dict:
+    return {
+        "patient_data": patient_data.dict(),
+        "trials": trials_list,
+        "created_at": timestamp,
+        "patient_summary": patient_summary,
+        "ranking": {"status": "pending", "updated_at": timestamp},
+        "list_index": build_list_index(trials_list)
+    }
+
+async def search_eligible(params: Dict, patient_data: Dict) -> tuple:
+    """(candidates, eligible candidates) for a search, fetching more candidates while too few of a
+    truncated result are eligible to fill the display list."""
+    limit = search_candidates
+    while True:
+        candidates = await relevant_trials(base_url, params, limit=limit)
+        with span("eligibility", candidates=len(candidates)):
+            eligible = eligible_trials(candidates, patient_data)
+        if len(eligible) >= display_limit or len(candidates) < limit or limit >= MAX_SEARCH_CANDIDATES:
+            return candidates, eligible
+        limit = min(limit * 2, MAX_SEARCH_CANDIDATES)
+        logger.info(f"Only {len(eligible)} of {len(candidates)} candidates eligible, searching for {limit}")
+
+async def process_transcript(transcript: str, background: bool = False) -> ClinicalNotesResponse:
+    """Extract patient data, search and pre-rank trials, store the note and schedule its ranking.
+
+    Raises Overloaded when the LLM is busy, unless `background` (bulk jobs), which waits instead.
+    """
+    clinical_notes_id = str(uuid.uuid4())
+    timestamp = datetime.utcnow().isoformat()
+    logger.info(f"Processing transcript {clinical_notes_id}")
+    
+    with span("extract"):
+        llm_output, cached = await extract_patient_data(
+            llm_client(), model, clinical_notes_prompt.text, transcript, temperature, EXTRACTION_MAX_TOKENS,
+            patient_data_format, background
+        )
+        patient_data = parse_patient_data(llm_output)
+        patient_summary = json.dumps(patient_data.dict())
+    logger.info(f"Extracted patient data for {clinical_notes_id} (cached: {cached})")
+    
+    with span("search"):
+        params = {**get_params(patient_data.dict()), **status_filter()}
+        candidates, eligible = await search_eligible(params, patient_data.dict())
+    with span("prerank", candidates=len(eligible)):
+        trials_list = prerank_trials(eligible, patient_data.dict(), display_limit)
+    logger.info(
+        f"Found {len(candidates)} trials for {clinical_notes_id}, {len(eligible)} eligible, kept {len(trials_list)}"
+    )
+    
+    with span("store"):
+        stored = await save_data_async(
+            f'notes/{clinical_notes_id}.json',
+            new_note_record(patient_data, trials_list, timestamp, patient_summary)
+        )
+    if not stored:
+        raise RuntimeError("Failed to store clinical notes")
+    schedule_ranking(clinical_notes_id, trials_list, patient_summary)
+
+    logger.info(f"Clinical notes {clinical_notes_id} stored successfully, timings: {request_timings.get()}")
+    
+    return ClinicalNotesResponse(
+        clinical_notes_id=clinical_notes_id,
+        patient_data=patient_data,
+        trials=[trim(trial) for trial in trials_list],
+        created_at=timestamp,
+        total_trials_found=len(trials_list),
+        cached=cached
+    )
+
+async def process_bulk_transcript(transcript: str) -> Dict:
+    notes = await process_transcript(transcript, background=True)
+    return {
+        "clinical_notes_id": notes.clinical_notes_id,
+        "total_trials_found": notes.total_trials_found,
+        "cached": notes.cached
+    }
+
+def parse_bulk_transcripts(body: bytes, content_type: str) -> List[str]:
+    if "ndjson" in content_type or "jsonl" in content_type:
+        entries = [json.loads(line) for line in body.decode("utf8").splitlines() if line.strip()]
+    else:
+        data = json.loads(body)
+        entries = data["transcripts"] if isinstance(data, dict) else data
+    transcripts = [entry["transcript"] if isinstance(entry, dict) else entry for entry in entries]
+    if not all(isinstance(transcript, str) for transcript in transcripts):
+        raise ValueError("every transcript must be a string")
+    return transcripts
+
+def trial_list_query(
+    status: Optional[str] = None, phase: Optional[str] = None, sex: Optional[str] = None,
+    country: Optional[str] = None, min_age: Optional[float] = None, max_age: Optional[float] = None,
+    sort: str = "score", cursor: Optional[str] = None, limit: int = default_page_size, fields: Optional[str] = None,
+    near: Optional[str] = None, radius_km: Optional[float] = None
+) -> Dict:
+    try:
+        point = parse_point(near) if near else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if radius_km is not None and radius_km <= 0:
+        raise HTTPException(status_code=400, detail="radius_km must be positive")
+    return {
+        "filters": parse_filters({"status": status, "phase": phase, "sex": sex, "country": country}),
+        "min_age": min_age,
+        "max_age": max_age,
+        "sort": sort,
+        "cursor": cursor,
+        "limit": max(1, min(limit, MAX_PAGE_SIZE)),
+        "fields": parse_fields(fields),
+        "near": point,
+        "radius_km": radius_km,
+    }
+
+def trial_list_page(trials: List[Dict], index: Dict, query: Dict) -> Dict:
+    """A TrialPage as a dict, sent as is rather than re-validated (see records.py)."""
+    try:
+        return page_trials(trials, index, **query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def warm_up():
+    """Create the storage backend and OpenAI client and read the prompts off the event loop."""
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(get_backend)
+        await asyncio.to_thread(lambda: [prompt.text for prompt in prompt_files])
+        await asyncio.to_thread(llm_client)
+        await asyncio.to_thread(encoding)
+        startup.update(status="ready", warm_up_ms=elapsed_ms(started))
+        logger.info(f"Warm-up finished in {startup['warm_up_ms']} ms")
+    except Exception as e:
+        startup.update(status="failed", error=str(e), warm_up_ms=elapsed_ms(started))
+        logger.error(f"Warm-up failed: {str(e)}")
+
+def check_prompts() -> Dict[str, Any]:
+    try:
+        for prompt in prompt_files:
+            prompt.text
+        return {"ok": True}
+    except OSError as e:
+        return {"ok": False, "error": str(e)}
 
 #async api endpoints
 
@@ -132,45 +550,64 @@ base_url = "https://clinicaltrials.gov/api/v2/studies"
 async def healthcheck():
     return {"status": "ok"}
 
-# POST endpoint to upload transcript and get clinical notes + trials
+# Liveness: the process is up and serving requests
+@app.get("/healthz")
+async def liveness() -> Dict[str, Any]:
+    return {"status": "ok", "uptime_s": round(time.time() - startup["started_at"], 1)}
+
+# Readiness: warm-up done and storage, OpenAI client and prompts usable (503 otherwise).
+# An open ClinicalTrials.gov circuit is reported but doesn't make the instance unready,
+# since every instance shares the same upstream
+@app.get("/readyz")
+async def readiness(response: Response) -> Dict[str, Any]:
+    checks = {
+        "warm_up": {"ok": startup["status"] == "ready", **{k: v for k, v in startup.items() if k != "started_at"}},
+        "storage": await check_storage_async(),
+        # created by the warm-up; no request is sent, so this doesn't spend OpenAI quota
+        "llm_client": {"ok": _client is not None and bool(_client.api_key), "created": _client is not None, "model": model},
+        "prompts": await asyncio.to_thread(check_prompts),
+    }
+    ready = all(check["ok"] for check in checks.values())
+    circuit = http_client.breaker.state
+    checks["clinical_trials"] = {"ok": circuit != "open", "circuit": circuit}
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "not_ready", "checks": checks}
+
+# Prometheus metrics: LLM/ClinicalTrials.gov/storage latency, token usage, cache hit rates, stage timings
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    return Response(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# GET endpoint to inspect cache hit/miss counters
+@app.get("/api/v1/cache/stats")
+async def get_cache_stats() -> Dict[str, Dict]:
+    return {
+        "trials": trial_cache.stats(),
+        "searches": search_cache_stats(),
+        "storage": storage_stats(),
+        "llm": llm_cache_stats(),
+        "llm_output": parse_stats
+    }
+
+# GET endpoint to inspect the concurrency limits of this worker (slots in use, queued and rejected requests)
+@app.get("/api/v1/limits/stats")
+async def get_limit_stats() -> Dict[str, Any]:
+    return {"worker_pid": os.getpid(), "workers": WEB_CONCURRENCY, "limits": limit_stats()}
+
+# GET endpoint to inspect ClinicalTrials.gov client timings, retries and circuit state
+@app.get("/api/v1/upstream/stats")
+async def get_upstream_stats() -> Dict:
+    return http_client.stats()
+
+# POST endpoint to upload transcript and get clinical notes + trials (429 with Retry-After when at capacity)
 @app.post("/api/v1/transcripts", status_code=201)
 async def upload_transcript(request: TranscriptUploadRequest) -> ClinicalNotesResponse:
     try:
-        clinical_notes_id = str(uuid.uuid4())
-        timestamp = datetime.utcnow().isoformat()
-        logger.info(f"Processing transcript {clinical_notes_id}")
-        
-        patient_summary = extract_patient_data(
-            client, model, clinical_notes_prompt, request.transcript, temperature, max_tokens
-        )
-        logger.info(f"LLM extraction completed for {clinical_notes_id}")
-        
-        patient_summary = re.sub(r'^```json|```$', '', patient_summary)
-        patient_data_dict = json.loads(patient_summary)
-        logger.info(f"Parsed LLM output for {clinical_notes_id}")
-        
-        patient_data = PatientData(**patient_data_dict)
-        params = get_params(patient_summary)
-        trials_list = relevant_trials(base_url, params)
-        logger.info(f"Found {len(trials_list)} trials for {clinical_notes_id}")
-        
-        save_data(f'notes/{clinical_notes_id}.json', {
-            "patient_data": patient_data.dict(),
-            "trials": trials_list,
-            "created_at": timestamp,
-            "patient_summary": patient_summary
-        })
-
-        logger.info(f"Clinical notes {clinical_notes_id} stored successfully")
-        
-        return ClinicalNotesResponse(
-            clinical_notes_id=clinical_notes_id,
-            patient_data=patient_data,
-            trials=trials_list,
-            created_at=timestamp,
-            total_trials_found=len(trials_list)
-        )
-    
+        async with upload_limit.slot():
+            return await process_transcript(request.transcript)
+    except Overloaded:
+        raise
     except json.JSONDecodeError as e:
         logger.error(f"JSON parsing error: {str(e)}")
         raise HTTPException(status_code=400, detail="Invalid LLM response format")
@@ -178,94 +615,246 @@ async def upload_transcript(request: TranscriptUploadRequest) -> ClinicalNotesRe
         logger.error(f"Error processing transcript: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing transcript: {str(e)}")
 
+# POST endpoint to upload many transcripts as a background job
+# body: JSON array (of strings or {"transcript": ...}), {"transcripts": [...]}, or NDJSON with one per line
+@app.post("/api/v1/transcripts/bulk", status_code=202)
+async def upload_transcripts_bulk(request: Request, workers: Optional[int] = None) -> BulkJobResponse:
+    try:
+        transcripts = parse_bulk_transcripts(await request.body(), request.headers.get("content-type", ""))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bulk upload: {str(e)}")
+    if not transcripts:
+        raise HTTPException(status_code=400, detail="No transcripts in request")
+    if len(transcripts) > max_bulk_items:
+        raise HTTPException(status_code=400, detail=f"At most {max_bulk_items} transcripts per job")
+    workers = max(1, min(workers or bulk_workers, bulk_max_workers))
+    try:
+        job = await start_job("transcripts", transcripts, process_bulk_transcript, workers)
+    except Exception as e:
+        logger.error(f"Error starting bulk job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error starting bulk job: {str(e)}")
+    logger.info(f"Started job {job['job_id']} for {len(transcripts)} transcripts with {workers} workers")
+    return BulkJobResponse(job_id=job["job_id"], status=job["status"], total=job["total"], workers=workers)
+
+# GET endpoint to retrieve the progress and per-item results of a background job
+@app.get("/api/v1/jobs/{job_id}")
+async def get_job(job_id: str, items: bool = True) -> Dict[str, Any]:
+    job = await load_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not items:
+        job.pop("items", None)
+    return job
+
+# POST endpoint to match studies updated since the last run (or since=YYYY-MM-DD) against all stored notes
+# new matches join each note's trials (capped at REMATCH_MAX_TRIALS) and its ranking is recomputed on next read
+@app.post("/api/v1/rematch")
+async def rematch_notes(since: Optional[str] = None) -> Dict[str, Any]:
+    if since:
+        try:
+            since = datetime.strptime(since, "%Y-%m-%d").date().isoformat()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="since must be a date (YYYY-MM-DD)")
+    if rematch_running():
+        raise HTTPException(status_code=409, detail="A re-match is already running")
+    try:
+        return await run_rematch(base_url, since)
+    except Exception as e:
+        logger.error(f"Error re-matching notes: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error re-matching notes: {str(e)}")
+
+# POST endpoint to upload transcript and stream clinical notes + trials as server-sent events
+# events: patient_data, trials (current pre-ranked list, after each result page), done (full response + stage timings), error
+# (with retry_after when the LLM is busy); 429 when too many uploads are in progress
+@app.post("/api/v1/transcripts/stream")
+async def upload_transcript_stream(request: TranscriptUploadRequest) -> StreamingResponse:
+    async def events():
+        started = time.perf_counter()
+        stage_timings = {}
+        clinical_notes_id = str(uuid.uuid4())
+        timestamp = datetime.utcnow().isoformat()
+        try:
+            logger.info(f"Streaming transcript {clinical_notes_id}")
+            with span("extract"):
+                llm_output, cached = await extract_patient_data(
+                    llm_client(), model, clinical_notes_prompt.text, request.transcript, temperature, EXTRACTION_MAX_TOKENS,
+                    patient_data_format
+                )
+                patient_data = parse_patient_data(llm_output)
+                patient_summary = json.dumps(patient_data.dict())
+            stage_timings["extract_ms"] = elapsed_ms(started)
+            yield sse_event("patient_data", {
+                "clinical_notes_id": clinical_notes_id,
+                "patient_data": patient_data.dict(),
+                "created_at": timestamp,
+                "cached": cached,
+                "elapsed_ms": stage_timings["extract_ms"]
+            })
+
+            params = {**get_params(patient_data.dict()), **status_filter()}
+            candidates = []
+            trials_list = []
+            try:
+                async for page in stream_search(base_url, params, limit=search_candidates):
+                    candidates.extend(eligible_trials(page, patient_data.dict()))
+                    trials_list = prerank_trials(candidates, patient_data.dict(), display_limit)
+                    stage_timings.setdefault("first_trials_ms", elapsed_ms(started))
+                    yield sse_event("trials", {
+                        "trials": [trim(trial) for trial in trials_list],
+                        "total_trials_found": len(trials_list),
+                        "elapsed_ms": elapsed_ms(started)
+                    })
+            except Exception as e:
+                logger.error(f"Error fetching trials for {clinical_notes_id}: {str(e)}")
+            stage_timings["search_ms"] = elapsed_ms(started)
+            # the search loop yields events, so it is timed directly rather than in a span
+            stage_seconds.observe((stage_timings["search_ms"] - stage_timings["extract_ms"]) / 1000, stage="search")
+
+            with span("store"):
+                stored = await save_data_async(
+                    f'notes/{clinical_notes_id}.json',
+                    new_note_record(patient_data, trials_list, timestamp, patient_summary)
+                )
+            if not stored:
+                raise RuntimeError("Failed to store clinical notes")
+            schedule_ranking(clinical_notes_id, trials_list, patient_summary)
+            stage_timings["store_ms"] = elapsed_ms(started)
+            logger.info(f"Clinical notes {clinical_notes_id} streamed and stored, timings: {stage_timings}")
+
+            yield sse_event("done", {
+                **ClinicalNotesResponse(
+                    clinical_notes_id=clinical_notes_id,
+                    patient_data=patient_data,
+                    trials=[trim(trial) for trial in trials_list],
+                    created_at=timestamp,
+                    total_trials_found=len(trials_list),
+                    cached=cached
+                ).dict(),
+                "stage_timings": stage_timings,
+                "elapsed_ms": elapsed_ms(started)
+            })
+        except Overloaded as e:
+            yield sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON parsing error: {str(e)}")
+            yield sse_event("error", {"detail": "Invalid LLM response format"})
+        except Exception as e:
+            logger.error(f"Error processing transcript: {str(e)}")
+            yield sse_event("error", {"detail": f"Error processing transcript: {str(e)}"})
+
+    return await limited_stream(upload_limit, events())
+
 # GET endpoint to retrieve stored clinical notes
-@app.get("/api/v1/transcripts/{clinical_notes_id}")
-async def get_clinical_notes(clinical_notes_id: str) -> ClinicalNotesResponse:
-    note = load_data(f'notes/{clinical_notes_id}.json')
+# fields: comma-separated trial fields to return (nct_id is always included)
+@app.get("/api/v1/transcripts/{clinical_notes_id}", response_model=ClinicalNotesResponse)
+async def get_clinical_notes(clinical_notes_id: str, fields: Optional[str] = None) -> Response:
+    note = await load_data_async(f'notes/{clinical_notes_id}.json')
     if not note:
         logger.warning(f"Clinical notes {clinical_notes_id} not found")
         raise HTTPException(status_code=404, detail="Clinical notes not found")
-    return ClinicalNotesResponse(
-        clinical_notes_id=clinical_notes_id,
-        patient_data=PatientData(**note["patient_data"]),
-        trials=note["trials"],
-        created_at=note["created_at"],
-        total_trials_found=len(note["trials"])
-    )
-
-# GET endpoint to retrieve trials for a specific clinical note
-@app.get("/api/v1/transcripts/{clinical_notes_id}/trials")
-async def get_trials_for_notes(clinical_notes_id: str) -> TrialDataList:
-    note = load_data(f'notes/{clinical_notes_id}.json')
+    selected = parse_fields(fields)
+    return FastJSONResponse({
+        "clinical_notes_id": clinical_notes_id,
+        "patient_data": note["patient_data"],
+        "trials": [trim(trial, selected) for trial in note["trials"]],
+        "created_at": note["created_at"],
+        "total_trials_found": len(note["trials"]),
+        "cached": False,
+    })
+
+# GET endpoint to retrieve a page of the trials for a specific clinical note
+# filters: status, phase, sex, country (comma-separated values), min_age/max_age (years, overlapping the
+# trial's age range); sort: score (pre-rank), relevance (AI ranking), date (last update) or distance;
+# near=lat,lon adds distance_km to the nearest site, radius_km keeps trials with a site within it;
+# fields: comma-separated fields to return; cursor: next_cursor of the previous page
+@app.get("/api/v1/transcripts/{clinical_notes_id}/trials", response_model=TrialPage)
+async def get_trials_for_notes(clinical_notes_id: str, query: Dict = Depends(trial_list_query)) -> Response:
+    note = await load_data_async(f'notes/{clinical_notes_id}.json')
     if not note:
         logger.warning(f"Trials for clinical notes {clinical_notes_id} not found")
         raise HTTPException(status_code=404, detail="Trials not found for this clinical note")
     trials = note["trials"]
-    logger.info(f"Trials: {trials}")
-    return TrialDataList(trials=trials)
-
-# GET endpoint to retrieve trial ranking for a specific clinical note
+    index = current_index(trials, note.get("list_index"), note.get("ranking"))
+    page = trial_list_page(trials, index, query)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Trials: {page['trials']}")
+    return FastJSONResponse(page)
+
+# GET endpoint to retrieve the precomputed trial ranking for a specific clinical note
+# status is pending (202), ready or failed; wait=<seconds> blocks until the ranking is ready
+# and refresh=true recomputes it
 @app.get("/api/v1/transcripts/{clinical_notes_id}/trials/ranking")
-async def get_trial_ranking(clinical_notes_id: str) -> TrialRankingList:
-    note = load_data(f'notes/{clinical_notes_id}.json')
+async def get_trial_ranking(
+    clinical_notes_id: str, response: Response, wait: float = 0, refresh: bool = False
+) -> TrialRankingList:
+    key = f'notes/{clinical_notes_id}.json'
+    note = await load_data_async(key)
     if not note:
         logger.warning(f"Clinical notes {clinical_notes_id} not found")
         raise HTTPException(status_code=404, detail="Clinical notes not found")
+
+    ranking = note.get("ranking") or {}
+    if refresh or (clinical_notes_id not in ranking_tasks and ranking_is_stale(ranking)):
+        logger.info(f"Scheduling ranking for {clinical_notes_id}")
+        # a refresh asks the model again rather than getting its cached answer back
+        schedule_ranking(clinical_notes_id, note["trials"], note["patient_summary"], use_cache=not refresh)
+        ranking = {"status": "pending"}
+
+    deadline = time.monotonic() + min(wait, max_ranking_wait)
+    while ranking.get("status") == "pending" and time.monotonic() < deadline:
+        task = ranking_tasks.get(clinical_notes_id)
+        if task is not None:
+            try:
+                ranking = await asyncio.wait_for(asyncio.shield(task), timeout=deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+        else:
+            # computed by another worker - poll storage
+            await asyncio.sleep(0.5)
+            note = await load_data_async(key)
+            ranking = (note.get("ranking") or {}) if note else {}
+
+    if ranking.get("status") == "pending":
+        response.status_code = 202
+    return TrialRankingList(
+        status=ranking.get("status", "pending"),
+        trials=ranking.get("trials", []),
+        error=ranking.get("error"),
+        cached=ranking.get("cached", False)
+    )
+
+# GET endpoint to retrieve a page of the saved trials (MUST be before {nct_id} route)
+# takes the same filter, sort, fields and cursor parameters as the trials of a clinical note
+@app.get("/api/v1/trials/saved", response_model=TrialPage)
+async def get_saved_trials(query: Dict = Depends(trial_list_query)) -> Response:
+    trials_list, index = await saved_trials_list()
+    page = trial_list_page(trials_list, index, query)
+    logger.info(f"Returning {len(page['trials'])} of {len(trials_list)} saved trials")
+    return FastJSONResponse(page)
+
+# POST endpoint to retrieve details for many trials in one request
+# fields: comma-separated fields to return per trial, e.g. to leave out eligibility_criteria
+@app.post("/api/v1/trials/batch", response_model=TrialBatchResponse)
+async def get_trial_details_batch(request: TrialBatchRequest, fields: Optional[str] = None) -> Response:
+    if len(request.nct_ids) > max_batch_size:
+        raise HTTPException(status_code=400, detail=f"At most {max_batch_size} NCT IDs per request")
     try:
-        trials_list = note["trials"]
-        patient_summary = note["patient_summary"]
-        logger.info(f"Ranking {len(trials_list)} trials for {clinical_notes_id}")
-        ranking_json = rank_trials(
-            client, model, ranking_prompt, trials_list, patient_summary, temperature, max_tokens
-        )
-        logger.info(f"AI ranking response: {ranking_json}")
-        cleaned_json = ranking_json.strip()
-        if cleaned_json.startswith('```'):
-            cleaned_json = re.sub(r'^```(?:json)?\s*\n?', '', cleaned_json)
-            cleaned_json = re.sub(r'\n?```\s*$', '', cleaned_json)
-        logger.info(f"Cleaned JSON: {cleaned_json}")
-        ranking_data = json.loads(cleaned_json)
-        ranked_trials = []
-        for nct_id, data in ranking_data.items():
-            ranked_trials.append({
-                "nct_id": nct_id,
-                "explanation": data[0] if isinstance(data, list) and len(data) > 0 else "No explanation",
-                "relevance_score": int(data[1]) if isinstance(data, list) and len(data) > 1 else 0
-            })
-        logger.info(f"Ranked {len(ranked_trials)} trials")
-        return TrialRankingList(trials=ranked_trials)
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse AI ranking response: {e}")
-        logger.error(f"Raw response was: {ranking_json[:500]}")
-        raise HTTPException(status_code=500, detail=f"Failed to parse AI ranking response: {str(e)}")
-    except KeyError as e:
-        logger.error(f"Missing key in ranking data: {e}")
-        raise HTTPException(status_code=500, detail=f"Missing key in ranking data: {str(e)}")
+        trials = await trials_long_many(base_url, request.nct_ids)
+        logger.info(f"Retrieved {len(trials)} trial details in batch")
+        selected = parse_fields(fields)
+        return FastJSONResponse({"trials": {nct_id: trim(trial, selected) for nct_id, trial in trials.items()}})
     except Exception as e:
-        logger.error(f"Error ranking trials: {str(e)}")
-        logger.exception("Full traceback:")
-        raise HTTPException(status_code=500, detail=f"Error ranking trials: {str(e)}")
-
-# GET endpoint to retrieve all saved trials (MUST be before {nct_id} route)
-@app.get("/api/v1/trials/saved")
-async def get_saved_trials() -> Dict[str, List[Dict]]:
-    trial_keys = list_keys('saved-trials/')
-    trials_list = []
-    for key in trial_keys:
-        trial_data = load_data(key)
-        if trial_data:
-            trials_list.append(trial_data)
-    logger.info(f"Returning {len(trials_list)} saved trials")
-    return {
-        "trials": trials_list
-    }
+        logger.error(f"Error retrieving trial batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error retrieving trial details: {str(e)}")
 
 # POST endpoint to save a trial
 @app.post("/api/v1/trials/{nct_id}/save")
 async def save_trial(nct_id: str) -> Dict[str, str]:
     try:
-        trial = trials_long(base_url, nct_id)
-        save_data(f'saved-trials/{nct_id}.json', trial)
+        trial = await trials_long(base_url, nct_id)
+        if not await save_data_async(f'saved-trials/{nct_id}.json', trial):
+            raise RuntimeError("Failed to store trial")
+        forget_saved_trials()
         logger.info(f"Saved trial {nct_id}")
         return {
             "message": "Trial saved successfully",
@@ -278,11 +867,12 @@ async def save_trial(nct_id: str) -> Dict[str, str]:
 # DELETE endpoint to remove a saved trial
 @app.delete("/api/v1/trials/{nct_id}/save")
 async def remove_saved_trial(nct_id: str) -> Dict[str, str]:
-    trial_data = load_data(f'saved-trials/{nct_id}.json')
+    trial_data = await load_data_async(f'saved-trials/{nct_id}.json')
     if not trial_data:
         logger.warning(f"Trial {nct_id} not found in saved trials")
         raise HTTPException(status_code=404, detail="Trial not found in saved trials")
-    delete_data(f'saved-trials/{nct_id}.json')
+    await delete_data_async(f'saved-trials/{nct_id}.json')
+    forget_saved_trials()
     logger.info(f"Removed trial {nct_id} from saved trials")
     return {
         "message": "Trial removed successfully",
@@ -290,52 +880,108 @@ async def remove_saved_trial(nct_id: str) -> Dict[str, str]:
     }
 
 # GET endpoint to retrieve trial details by NCT ID (MUST be after /saved route)
-@app.get("/api/v1/trials/{nct_id}")
-async def get_trial_details(nct_id: str) -> TrialDataLong:
+# fields: comma-separated fields to return, like the batch endpoint
+@app.get("/api/v1/trials/{nct_id}", response_model=TrialDataLong)
+async def get_trial_details(nct_id: str, fields: Optional[str] = None) -> Response:
     try:
-        trial = trials_long(base_url, nct_id)
-        logger.info(f"url for {nct_id} = {base_url}/{nct_id}")
+        trial = await trials_long(base_url, nct_id)
         logger.info(f"Retrieved trial details for {nct_id}")
-        logger.info(f"Trial details: {trial}")
-        return trial
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Trial details: {trial}")
+        return FastJSONResponse(trim(trial, parse_fields(fields)))
     except Exception as e:
         logger.error(f"Error retrieving trial {nct_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error retrieving trial details: {str(e)}")
 
 # POST endpoint to ask AI about a specific trial
 @app.post("/api/v1/trials/ask_ai")
-async def ask_ai_about_trial(request: AskAIRequest) -> Dict[str, str]:
+async def ask_ai_about_trial(request: AskAIRequest) -> Dict[str, Any]:
     try:
-        note = load_data(f'notes/{request.clinical_notes_id}.json')
+        note = await load_data_async(f'notes/{request.clinical_notes_id}.json')
         if not note:
             raise HTTPException(status_code=404, detail="Clinical notes not found")
 
-        trial_details = trials_long(base_url, request.nct_id)
-        patient_summary = note["patient_summary"]
-        trial_input = json.dumps(trial_details, indent=2)
-        logger.info(f"Asking AI about trial {request.nct_id}: {request.query}")
-
-        ai_response = ask_ai(
-            client, model, ask_ai_prompt, request.query, 
-            patient_summary, trial_input, temperature, max_tokens
-        )
-        logger.info(f"AI response: {ai_response}")
+        async with ask_ai_limit.slot():
+            with span("context"):
+                trial_details = await trials_long(base_url, request.nct_id)
+                patient_summary = note["patient_summary"]
+                trial_input = trial_context(trial_details, request.query, patient_summary)
+            logger.info(f"Asking AI about trial {request.nct_id}")
+
+            with span("answer"):
+                ai_response, cached = await ask_ai(
+                    llm_client(), model, ask_ai_prompt.text, request.query, 
+                    patient_summary, trial_input, temperature, ASK_AI_MAX_TOKENS
+                )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"AI response for {request.nct_id} to {request.query!r}: {ai_response}")
 
         return {
             "nct_id": request.nct_id,
             "query": request.query,
-            "answer": ai_response
+            "answer": ai_response,
+            "cached": cached
         }
 
-    except HTTPException:
+    except (HTTPException, Overloaded):
         raise
     except Exception as e:
         logger.error(f"Error in ask_ai: {str(e)}")
         logger.exception("Full traceback:")
         raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
 
+# POST endpoint to ask AI about a specific trial, streaming the answer as server-sent events
+# events: token (answer fragments), done (full answer + timings), error (with retry_after when the LLM is busy);
+# 429 when too many questions are in progress
+@app.post("/api/v1/trials/ask_ai/stream")
+async def ask_ai_about_trial_stream(request: AskAIRequest) -> StreamingResponse:
+    started = time.perf_counter()
+    note = await load_data_async(f'notes/{request.clinical_notes_id}.json')
+    if not note:
+        raise HTTPException(status_code=404, detail="Clinical notes not found")
+
+    async def events():
+        try:
+            with span("context"):
+                trial_details = await trials_long(base_url, request.nct_id)
+                trial_input = trial_context(trial_details, request.query, note["patient_summary"])
+            context_ms = elapsed_ms(started)
+            logger.info(f"Streaming AI answer about trial {request.nct_id}")
+
+            answer = []
+            first_token_ms = None
+            cached = False
+            async for token, cached in ask_ai_stream(
+                llm_client(), model, ask_ai_prompt.text, request.query,
+                note["patient_summary"], trial_input, temperature, ASK_AI_MAX_TOKENS
+            ):
+                if first_token_ms is None:
+                    first_token_ms = elapsed_ms(started)
+                answer.append(token)
+                yield sse_event("token", {"text": token})
+
+            yield sse_event("done", {
+                "nct_id": request.nct_id,
+                "query": request.query,
+                "answer": ''.join(answer),
+                "cached": cached,
+                "stage_timings": {"context_ms": context_ms, "first_token_ms": first_token_ms},
+                "elapsed_ms": elapsed_ms(started)
+            })
+        except Overloaded as e:
+            yield sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error(f"Error in ask_ai stream: {str(e)}")
+            yield sse_event("error", {"detail": f"Error processing question: {str(e)}"})
+
+    return await limited_stream(ask_ai_limit, events())
+
 #main function to run app
 if __name__ == "__main__":
-    logger.info("Starting ElevenLabs API Server on host=0.0.0.0, port=8007")
-    uvicorn.run(app, host="0.0.0.0", port=8007)
+    logger.info(f"Starting ElevenLabs API Server on host={HOST}, port={PORT} with {WEB_CONCURRENCY} worker(s)")
+    if WEB_CONCURRENCY > 1:
+        # workers are separate processes that import the app themselves
+        uvicorn.run("src.main:app", host=HOST, port=PORT, workers=WEB_CONCURRENCY)
+    else:
+        uvicorn.run(app, host=HOST, port=PORT)
 
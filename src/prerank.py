@@ -0,0 +1,78 @@
+# imports
+import re
+from collections import Counter
+from typing import Dict, List
+import numpy as np
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# query field weights: terms from the patient's conditions and interventions drive the score,
+# the chief complaint only nudges it
+FIELD_WEIGHTS = {
+    "conditions": 1.0,
+    "interventions": 0.8,
+    "chief_complaint": 0.3,
+}
+
+STOPWORDS = {
+    "a", "an", "and", "or", "of", "the", "in", "on", "with", "for", "to", "by", "at", "as",
+    "is", "no", "not", "type", "listed", "unknown", "disease", "disorder", "syndrome",
+}
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+def query_weights(patient_data: Dict) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        value = patient_data.get(field) or []
+        text = ' '.join(value) if isinstance(value, list) else str(value)
+        for token in set(tokenize(text)):
+            weights[token] = max(weights.get(token, 0.0), weight)
+    return weights
+
+def trial_text(trial: Dict) -> str:
+    return f"{trial.get('conditions', '')} {trial.get('interventions', '')}"
+
+def bm25_scores(trials: List[Dict], patient_data: Dict) -> np.ndarray:
+    """BM25 relevance of each trial's conditions/interventions to the patient's summary.
+
+    Only query terms are counted, so the term-frequency matrix is
+    (trials x query terms) and the scoring itself is a handful of array ops.
+    """
+    weights = query_weights(patient_data)
+    if not trials or not weights:
+        return np.zeros(len(trials))
+    terms = list(weights)
+    column = {term: i for i, term in enumerate(terms)}
+
+    tf = np.zeros((len(trials), len(terms)))
+    lengths = np.empty(len(trials))
+    for row, trial in enumerate(trials):
+        tokens = tokenize(trial_text(trial))
+        lengths[row] = len(tokens)
+        for token, count in Counter(tokens).items():
+            col = column.get(token)
+            if col is not None:
+                tf[row, col] = count
+
+    n = len(trials)
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((n - df + 0.5) / (df + 0.5))
+    avg_length = max(lengths.mean(), 1.0)
+    norm = K1 * (1 - B + B * lengths / avg_length)
+    saturated = tf * (K1 + 1) / (tf + norm[:, None])
+    return saturated @ (idf * np.array([weights[term] for term in terms]))
+
+def prerank_trials(trials: List[Dict], patient_data: Dict, top_k: int) -> List[Dict]:
+    """Top `top_k` trials by local BM25 score, each tagged with its `prerank_score`.
+
+    Ties keep the order ClinicalTrials.gov returned them in.
+    """
+    scores = bm25_scores(trials, patient_data)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [{**trials[i], "prerank_score": round(float(scores[i]), 3)} for i in order]
@@ -0,0 +1,201 @@
+# imports
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Set, Tuple
+from .prerank import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Output budgets per call (max_tokens). The ranking returns at most RANKING_MAX_RESULTS entries
+# of a 25-50 word explanation and a score; ask_ai answers in at most 150 words.
+EXTRACTION_MAX_TOKENS = int(os.getenv('EXTRACTION_MAX_TOKENS', '1500'))
+RANKING_TOKENS_PER_TRIAL = int(os.getenv('RANKING_TOKENS_PER_TRIAL', '100'))
+RANKING_MAX_RESULTS = 10
+ASK_AI_MAX_TOKENS = int(os.getenv('ASK_AI_MAX_TOKENS', '400'))
+
+# Input budget for the eligibility criteria sent with an ask_ai question
+ELIGIBILITY_MAX_TOKENS = int(os.getenv('ELIGIBILITY_MAX_TOKENS', '400'))
+
+# Prompt files are re-read when they change on disk, checked at most every PROMPT_RELOAD_INTERVAL seconds (0 = never)
+PROMPT_RELOAD_INTERVAL = float(os.getenv('PROMPT_RELOAD_INTERVAL', '2'))
+
+# columns of the trial table sent for ranking
+RANKING_FIELDS = ("nct_id", "conditions", "interventions")
+
+# detail fields sent with an ask_ai question, in order, with their labels
+TRIAL_FIELDS = (
+    ("nct_id", "NCT ID"),
+    ("title", "Title"),
+    ("acronym", "Acronym"),
+    ("status", "Status"),
+    ("phases", "Phases"),
+    ("study_type", "Study type"),
+    ("sponsor", "Sponsor"),
+    ("conditions", "Conditions"),
+    ("interventions", "Interventions"),
+    ("age", "Age"),
+    ("sex", "Sex"),
+    ("locations", "Locations"),
+    ("primary_completion_date", "Primary completion"),
+    ("last_update_post_date", "Last update"),
+)
+
+EMPTY_VALUES = {"", "Unknown", "Not Available", "Not available", "No locations listed",
+                "No conditions listed", "No interventions listed"}
+
+SECTION_RE = re.compile(r"^(?:key\s+)?(?:inclusion|exclusion)\s+criteria\s*:?$", re.IGNORECASE)
+BULLET_RE = re.compile(r"^(?:[*\-•]|\d+[.)])\s*")
+PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+class PromptFile:
+    """A system prompt read from disk on first use and re-read when its modification time changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._text = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def text(self) -> str:
+        now = time.monotonic()
+        if self._text is not None and (PROMPT_RELOAD_INTERVAL <= 0 or now - self._checked < PROMPT_RELOAD_INTERVAL):
+            return self._text
+        with self._lock:
+            self._checked = now
+            mtime = os.stat(self.path).st_mtime_ns
+            if self._text is None or mtime != self._mtime:
+                with open(self.path, 'r', encoding="utf8") as file:
+                    self._text = file.read()
+                if self._mtime is not None:
+                    logger.info(f"Reloaded prompt {self.path}")
+                self._mtime = mtime
+        return self._text
+
+@lru_cache(maxsize=1)
+def encoding():
+    """The tiktoken encoding when tiktoken is installed (and its vocabulary available), else None."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # cached, so this is logged once per process
+        logger.warning(f"tiktoken unavailable ({e}); prompt budgets use an estimate from word pieces, not token counts")
+        return None
+
+def count_tokens(text: str) -> int:
+    """Token count of `text`; an estimate from word pieces when tiktoken is not available."""
+    enc = encoding()
+    if enc is not None:
+        return len(enc.encode(text))
+    return sum(math.ceil(len(piece) / 4) for piece in PIECE_RE.findall(text))
+
+def cell(value) -> str:
+    text = ', '.join(map(str, value)) if isinstance(value, list) else str(value)
+    return ' '.join(text.replace('|', '/').split())
+
+def trials_table(trials: List[Dict], fields: Tuple[str, ...] = RANKING_FIELDS) -> str:
+    """One line per trial with `|`-separated columns; the header names the columns once."""
+    lines = ['|'.join(fields)]
+    lines.extend('|'.join(cell(trial.get(field, '')) for field in fields) for trial in trials)
+    return '\n'.join(lines)
+
+def compact_summary(patient_summary: str) -> str:
+    """The extracted patient JSON without empty fields or indentation (unchanged if it doesn't parse)."""
+    try:
+        data = json.loads(patient_summary)
+    except (json.JSONDecodeError, TypeError):
+        return patient_summary
+    if not isinstance(data, dict):
+        return patient_summary
+    return json.dumps({k: v for k, v in data.items() if v not in ("", [], None)}, separators=(',', ':'))
+
+def summary_terms(patient_summary: str) -> Set[str]:
+    try:
+        data = json.loads(patient_summary)
+    except (json.JSONDecodeError, TypeError):
+        return set(tokenize(str(patient_summary)))
+    if not isinstance(data, dict):
+        return set(tokenize(str(data)))
+    return set(tokenize(' '.join(cell(v) for k, v in data.items() if k != "patient_name")))
+
+def criteria_sections(text: str) -> List[Tuple[str, List[str]]]:
+    """Split eligibility text into (heading, items); text before any heading has an empty heading."""
+    sections: List[Tuple[str, List[str]]] = [("", [])]
+    for line in text.splitlines():
+        line = ' '.join(line.split())
+        if not line:
+            continue
+        if SECTION_RE.match(line):
+            sections.append((line.rstrip(':'), []))
+        else:
+            sections[-1][1].append(BULLET_RE.sub('', line))
+    return [(heading, items) for heading, items in sections if heading or items]
+
+def trim_eligibility(text: str, terms: Set[str], max_tokens: int = ELIGIBILITY_MAX_TOKENS) -> str:
+    """Eligibility criteria cut down to `max_tokens`, keeping the items that mention `terms`.
+
+    Items are ranked by how many of the terms they share, then by position
+    (sponsors list the defining criteria first), and the ones that fit are
+    printed in their original order with a count of what was left out.
+    """
+    sections = criteria_sections(text or '')
+    rendered = '\n'.join(
+        '\n'.join(([f"{heading}:"] if heading else []) + [f"- {item}" for item in items])
+        for heading, items in sections
+    )
+    if count_tokens(rendered) <= max_tokens:
+        return rendered
+
+    candidates = []
+    for s, (heading, items) in enumerate(sections):
+        for i, item in enumerate(items):
+            overlap = len(terms.intersection(tokenize(item)))
+            candidates.append((-overlap, i, s, item))
+    budget = max_tokens - sum(count_tokens(heading) + 1 for heading, _ in sections if heading)
+    kept = set()
+    for _, i, s, item in sorted(candidates):
+        cost = count_tokens(item) + 1
+        if cost <= budget:
+            kept.add((s, i))
+            budget -= cost
+
+    lines = []
+    for s, (heading, items) in enumerate(sections):
+        if heading:
+            lines.append(f"{heading}:")
+        lines.extend(f"- {item}" for i, item in enumerate(items) if (s, i) in kept)
+        omitted = sum(1 for i in range(len(items)) if (s, i) not in kept)
+        if omitted:
+            lines.append(f"({omitted} more omitted)")
+    return '\n'.join(lines)
+
+def trial_context(trial: Dict, query: str, patient_summary: str,
+                  eligibility_tokens: int = ELIGIBILITY_MAX_TOKENS) -> str:
+    """A detail record as `Label: value` lines, skipping empty fields, with trimmed eligibility."""
+    lines = [
+        f"{label}: {cell(trial[field])}"
+        for field, label in TRIAL_FIELDS
+        if field in trial and cell(trial[field]) not in EMPTY_VALUES
+    ]
+    criteria = trial.get("eligibility_criteria", "")
+    if criteria and criteria not in EMPTY_VALUES:
+        terms = summary_terms(patient_summary) | set(tokenize(query))
+        lines.append("Eligibility criteria:\n" + trim_eligibility(criteria, terms, eligibility_tokens))
+    return '\n'.join(lines)
+
+def ranking_content(trials: List[Dict], patient_summary: str) -> str:
+    return f"Trials:\n{trials_table(trials)}\nSummary - {compact_summary(patient_summary)}"
+
+def ranking_max_tokens(trial_count: int) -> int:
+    return 50 + RANKING_TOKENS_PER_TRIAL * min(trial_count, RANKING_MAX_RESULTS)
+
+def ask_ai_content(query: str, patient_summary: str, trial_input: str) -> str:
+    return f'Patient Summary:\n{compact_summary(patient_summary)}\n\nTrial Details:\n{trial_input}\n\nUser Question: {query}'
@@ -0,0 +1,42 @@
+# Compact trial records and fast JSON responses. Records stay plain dicts (trial lists, eligibility,
+# pre-ranking and storage all work on them), but their enum-like values are interned so the thousands
+# of records held by the search and detail caches share one string per status, phase, sex and study
+# type. Large responses skip re-validation through the pydantic models and are serialized with
+# orjson, or with pydantic-core's serializer (as fast as FastAPI's own path) if orjson is missing.
+import sys
+from typing import Any, Dict, List, Optional
+from fastapi.responses import Response
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# fields with a small set of repeated values
+ENUM_FIELDS = ("status", "phases", "sex", "study_type")
+
+def compact(record: Dict) -> Dict:
+    """Intern the enum-like values of a trial record in place; returns the record."""
+    for field in ENUM_FIELDS:
+        value = record.get(field)
+        if type(value) is str:
+            record[field] = sys.intern(value)
+    return record
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return to_json(value)
+
+class FastJSONResponse(Response):
+    """A JSON response for content that is already JSON-compatible (dicts of plain values)."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """'title,status' -> ['title', 'status']; None when no fields were asked for."""
+    selected = [field.strip() for field in fields.split(",") if field.strip()] if fields else []
+    return selected or None
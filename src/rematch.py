@@ -0,0 +1,206 @@
+# Incremental re-matching of stored notes: studies updated since the last run are fetched with one
+# paginated query and tested against every note through an inverted index of the notes' condition
+# terms, so a run costs work proportional to the number of changed studies rather than a search
+# per patient. New matches join the note's trial list (which keeps its best REMATCH_MAX_TRIALS by
+# pre-rank score) and its ranking is recomputed on next read.
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from .eligibility import eligible_trials
+from .http_client import get_json
+from .prerank import tokenize, prerank_trials
+from .storage import list_keys_async, load_many_async, load_data_async, save_data_async
+from .telemetry import span
+from .trial_lists import build_list_index
+from .trial_service import short_trial, MAX_PAGE_SIZE
+from .workers import is_locked, shared_lock
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# REMATCH_INTERVAL: seconds between scheduled runs in the API process (0 = only on demand)
+REMATCH_INTERVAL = float(os.getenv('REMATCH_INTERVAL', '0'))
+REMATCH_STATUSES = os.getenv('REMATCH_STATUSES', 'RECRUITING,NOT_YET_RECRUITING')
+REMATCH_LOOKBACK_DAYS = int(os.getenv('REMATCH_LOOKBACK_DAYS', '1'))
+REMATCH_MAX_PAGES = int(os.getenv('REMATCH_MAX_PAGES', '50'))
+# REMATCH_MAX_TRIALS: most trials a note keeps after re-matching (the number a new note lists)
+REMATCH_MAX_TRIALS = int(os.getenv('REMATCH_MAX_TRIALS', '40'))
+
+STATE_KEY = 'rematch/state.json'
+
+def phrases(values: List[str]) -> List[frozenset]:
+    return [terms for terms in (frozenset(tokenize(value)) for value in values) if terms]
+
+class NoteIndex:
+    """Inverted index from condition terms to the notes whose condition phrases contain them.
+
+    A study matches a note the way a live search with the note's get_params
+    would: one of the note's condition phrases appears in the study's
+    conditions and, if the note has interventions, one of them appears in
+    the study's interventions (a phrase appears when all its terms do).
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Set[Tuple[str, int]]] = defaultdict(set)
+        self.conditions: Dict[str, List[frozenset]] = {}
+        self.interventions: Dict[str, List[frozenset]] = {}
+        self.trials: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.conditions)
+
+    def add(self, note_id: str, note: dict):
+        patient_data = note.get("patient_data") or {}
+        self.conditions[note_id] = phrases(patient_data.get("conditions") or [])
+        self.interventions[note_id] = phrases(patient_data.get("interventions") or [])
+        self.trials[note_id] = {trial["nct_id"] for trial in note.get("trials", [])}
+        for i, phrase in enumerate(self.conditions[note_id]):
+            for term in phrase:
+                self.postings[term].add((note_id, i))
+
+    def remove(self, note_id: str):
+        for i, phrase in enumerate(self.conditions.pop(note_id, [])):
+            for term in phrase:
+                self.postings[term].discard((note_id, i))
+                if not self.postings[term]:
+                    del self.postings[term]
+        self.interventions.pop(note_id, None)
+        self.trials.pop(note_id, None)
+
+    def match(self, trial: dict) -> List[str]:
+        """IDs of the notes `trial` matches and does not already list."""
+        condition_terms = set(tokenize(trial.get("conditions", "")))
+        intervention_terms = set(tokenize(trial.get("interventions", "")))
+        candidates = {posting for term in condition_terms for posting in self.postings.get(term, ())}
+        matched = []
+        for note_id in {note_id for note_id, i in candidates if self.conditions[note_id][i] <= condition_terms}:
+            if trial["nct_id"] in self.trials[note_id]:
+                continue
+            interventions = self.interventions[note_id]
+            if interventions and not any(phrase <= intervention_terms for phrase in interventions):
+                continue
+            matched.append(note_id)
+        return matched
+
+    async def sync(self) -> Tuple[int, int]:
+        """Index notes added since the last sync and drop deleted ones; returns (added, removed)."""
+        note_ids = {key[len('notes/'):-len('.json')] for key in await list_keys_async('notes/')}
+        removed = set(self.conditions) - note_ids
+        for note_id in removed:
+            self.remove(note_id)
+        new = sorted(note_ids - set(self.conditions))
+        for i in range(0, len(new), 500):
+            loaded = await load_many_async([f'notes/{note_id}.json' for note_id in new[i:i + 500]])
+            for key, note in loaded.items():
+                if note:
+                    self.add(key[len('notes/'):-len('.json')], note)
+        return len(new), len(removed)
+
+note_index = NoteIndex()
+
+def note_lock(note_id: str):
+    """Serializes read-modify-write updates of a note (re-matching, storing a ranking) across workers."""
+    return shared_lock("note", note_id)
+
+def rematch_running() -> bool:
+    return is_locked("rematch")
+
+async def changed_trials(base_url: str, since: str):
+    """Yield pages of short records for studies updated on or after `since` (YYYY-MM-DD)."""
+    params = {"filter.advanced": f"AREA[LastUpdatePostDate]RANGE[{since},MAX]", "pageSize": MAX_PAGE_SIZE}
+    if REMATCH_STATUSES:
+        params["filter.overallStatus"] = REMATCH_STATUSES
+    for _ in range(REMATCH_MAX_PAGES):
+        data = await get_json(base_url, params)
+        yield [short_trial(study) for study in data.get('studies', [])]
+        if not data.get('nextPageToken'):
+            return
+        params = {**params, "pageToken": data['nextPageToken']}
+    logger.warning(f"Re-match stopped after {REMATCH_MAX_PAGES} pages of changes since {since}")
+
+async def append_matches(note_id: str, trials: List[dict], now: str) -> int:
+    key = f'notes/{note_id}.json'
+    async with note_lock(note_id):
+        note = await load_data_async(key)
+        if not note:
+            return 0
+        patient_data = note.get("patient_data") or {}
+        known = {trial["nct_id"] for trial in note.get("trials", [])}
+        matched = [trial for trial in eligible_trials(trials, patient_data) if trial["nct_id"] not in known]
+        # re-seen studies are skipped on later runs whether or not they make the cut
+        note_index.trials.setdefault(note_id, set()).update(trial["nct_id"] for trial in matched)
+        if not matched:
+            return 0
+        combined = note.get("trials", []) + matched
+        note["trials"] = prerank_trials(combined, patient_data, max(REMATCH_MAX_TRIALS, len(note.get("trials", []))))
+        added = [trial["nct_id"] for trial in note["trials"] if trial["nct_id"] not in known]
+        if not added:
+            return 0
+        note["rematch"] = {"updated_at": now, "added": added}
+        # the stored ranking no longer covers the list; the ranking endpoint recomputes a missing one
+        note.pop("ranking", None)
+        note["list_index"] = build_list_index(note["trials"])
+        if not await save_data_async(key, note):
+            return 0
+        return len(added)
+
+async def run_rematch(base_url: str, since: Optional[str] = None) -> Dict:
+    """Match studies updated since the last run (or `since`) against all stored notes."""
+    async with shared_lock("rematch"):
+        started = time.perf_counter()
+        run_at = datetime.utcnow()
+        state = await load_data_async(STATE_KEY) or {}
+        since = since or state.get("last_run_date") or (run_at - timedelta(days=REMATCH_LOOKBACK_DAYS)).date().isoformat()
+
+        with span("rematch"):
+            indexed, removed = await note_index.sync()
+            matches: Dict[str, List[dict]] = defaultdict(list)
+            studies = 0
+            async for page in changed_trials(base_url, since):
+                studies += len(page)
+                for trial in page:
+                    for note_id in note_index.match(trial):
+                        matches[note_id].append(trial)
+            added = await asyncio.gather(
+                *(append_matches(note_id, trials, run_at.isoformat()) for note_id, trials in matches.items())
+            )
+
+        summary = {
+            "since": since,
+            "changed_studies": studies,
+            "notes_indexed": len(note_index),
+            "notes_newly_indexed": indexed,
+            "notes_removed": removed,
+            "notes_updated": sum(1 for n in added if n),
+            "trials_added": sum(added),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        # the API filters by day, so the next run starts from today's date again; re-seen studies are skipped
+        await save_data_async(STATE_KEY, {**summary, "last_run_date": run_at.date().isoformat(), "last_run_at": run_at.isoformat()})
+        logger.info(f"Re-match since {since}: {summary}")
+        return summary
+
+async def rematch_loop(base_url: str, interval: float):
+    """Run the re-match every `interval` seconds until cancelled."""
+    while True:
+        try:
+            await run_rematch(base_url)
+        except Exception as e:
+            logger.error(f"Scheduled re-match failed: {e}")
+        await asyncio.sleep(interval)
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Match studies updated on ClinicalTrials.gov against stored notes")
+    parser.add_argument("--since", help="only studies updated on or after this date (YYYY-MM-DD); default: last run")
+    parser.add_argument("--base-url", default=os.getenv("CLINICAL_TRIALS_API_URL", "https://clinicaltrials.gov/api/v2/studies"))
+    args = parser.parse_args()
+    asyncio.run(run_rematch(args.base_url, args.since))
+
+if __name__ == "__main__":
+    main()
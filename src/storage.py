@@ -1,125 +1,421 @@
 import os
 import json
+import asyncio
 import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
-import boto3
-from botocore.exceptions import ClientError
+from .telemetry import storage_seconds
 
 logger = logging.getLogger(__name__)
 
 # Configuration
+# STORAGE_BACKEND: sqlite (local durable store, default), s3 or memory (tests/benchmarks only).
+# USE_S3=true is kept as a shorthand for STORAGE_BACKEND=s3.
 USE_S3 = os.getenv('USE_S3', 'false').lower() == 'true'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 's3' if USE_S3 else 'sqlite').lower()
+STORAGE_SQLITE_PATH = os.getenv('STORAGE_SQLITE_PATH', 'storage.db')
 S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME', 'clinical-trial-matcher-data')
 AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
+# Read-through cache of S3 objects (raw bodies, revalidated by ETag) and parallel loads
+STORAGE_CACHE_MAX_BYTES = int(os.getenv('STORAGE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+STORAGE_CACHE_FRESH_SECONDS = float(os.getenv('STORAGE_CACHE_FRESH_SECONDS', '0'))
+STORAGE_CONCURRENCY = int(os.getenv('STORAGE_CONCURRENCY', '16'))
 
-# In-memory storage for local development
-in_memory_storage: Dict[str, dict] = {}
+class StorageBackend(ABC):
+    """Key/value store for JSON documents. Missing keys load as None; other failures raise.
 
-# S3 client (initialized only if USE_S3 is true)
-s3_client = None
-if USE_S3:
+    Backends implement save, load, delete and list_keys; one missing any of them fails when it is created.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def save(self, key: str, data: dict):
+        """Store `data` under `key`, replacing what was there."""
+
+    @abstractmethod
+    def load(self, key: str) -> Optional[dict]:
+        """The document stored under `key`, or None."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove `key`; removing a missing key is not an error."""
+
+    @abstractmethod
+    def list_keys(self, prefix: str) -> List[str]:
+        """All keys starting with `prefix`."""
+
+    def load_many(self, keys: List[str]) -> Dict[str, Optional[dict]]:
+        return {key: self.load(key) for key in keys}
+
+    def check(self):
+        """Raise if the store can't be reached (used by the readiness endpoint)."""
+
+    def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+class MemoryBackend(StorageBackend):
+    """Process-local dict. Not durable and not shared between workers."""
+
+    name = "memory"
+
+    def __init__(self):
+        self.data: Dict[str, dict] = {}
+
+    def save(self, key: str, data: dict):
+        self.data[key] = data
+
+    def load(self, key: str) -> Optional[dict]:
+        return self.data.get(key)
+
+    def delete(self, key: str):
+        self.data.pop(key, None)
+
+    def list_keys(self, prefix: str) -> List[str]:
+        return [k for k in self.data.keys() if k.startswith(prefix)]
+
+    def stats(self) -> dict:
+        return {"entries": len(self.data)}
+
+class SQLiteBackend(StorageBackend):
+    """Local durable store: one SQLite file in WAL mode.
+
+    Writes are atomic, readers don't block the writer, and several
+    processes (uvicorn workers) can share the file. Keys are the primary
+    key, so prefix listings are index range scans.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread; calls arrive on the asyncio.to_thread pool
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def save(self, key: str, data: dict):
+        with self._connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO objects (key, value, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(data), time.time()),
+            )
+
+    def load(self, key: str) -> Optional[dict]:
+        row = self._connection().execute("SELECT value FROM objects WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, key: str):
+        with self._connection() as db:
+            db.execute("DELETE FROM objects WHERE key = ?", (key,))
+
+    def list_keys(self, prefix: str) -> List[str]:
+        rows = self._connection().execute(
+            "SELECT key FROM objects WHERE key >= ? AND key < ? ORDER BY key", (prefix, prefix + '\U0010ffff')
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def load_many(self, keys: List[str]) -> Dict[str, Optional[dict]]:
+        found = {}
+        db = self._connection()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = db.execute(
+                f"SELECT key, value FROM objects WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((key, json.loads(value)) for key, value in rows)
+        return {key: found.get(key) for key in keys}
+
+    def check(self):
+        self._connection().execute("SELECT 1").fetchone()
+
+    def stats(self) -> dict:
+        return {"path": self.path}
+
+class ObjectCache:
+    """Size-bounded LRU of raw S3 object bodies with their ETags.
+
+    Bodies are kept as bytes and decoded on every hit, so callers can't
+    modify a cached object by mutating what load_data returned.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[tuple]:
+        """(etag, body, stored_at) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, etag: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (etag, body, time.monotonic())
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                evicted = next(iter(self._entries))
+                self._discard(evicted)
+                self.evictions += 1
+
+    def discard(self, key: str):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.revalidated) / lookups if lookups else 0.0,
+        }
+
+class S3Backend(StorageBackend):
+    """S3 bucket with a read-through cache of object bodies, revalidated by ETag."""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, region: str):
+        # boto3 is imported here rather than at module load: it is only needed for this backend
+        # and costs a few hundred milliseconds of startup
+        import boto3
+        from botocore.config import Config
+        if boto3.Session().get_credentials() is None:
+            raise RuntimeError("No AWS credentials configured")
+        self.bucket = bucket
+        self.client = boto3.client(
+            's3', region_name=region, config=Config(max_pool_connections=STORAGE_CONCURRENCY)
+        )
+        self.cache = ObjectCache(STORAGE_CACHE_MAX_BYTES)
+        self.executor = ThreadPoolExecutor(max_workers=STORAGE_CONCURRENCY, thread_name_prefix="storage")
+
+    def save(self, key: str, data: dict):
+        body = json.dumps(data).encode()
+        try:
+            response = self.client.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=body,
+                ContentType='application/json'
+            )
+        except Exception:
+            self.cache.discard(key)
+            raise
+        self.cache.put(key, response['ETag'], body)
+
+    def load(self, key: str) -> Optional[dict]:
+        from botocore.exceptions import ClientError
+        try:
+            cached = self.cache.get(key)
+            if cached is not None:
+                etag, body, stored_at = cached
+                if time.monotonic() - stored_at < STORAGE_CACHE_FRESH_SECONDS:
+                    self.cache.hits += 1
+                    return json.loads(body)
+                try:
+                    response = self.client.get_object(Bucket=self.bucket, Key=key, IfNoneMatch=etag)
+                except ClientError as e:
+                    if e.response['Error']['Code'] in ('304', 'NotModified'):
+                        self.cache.revalidated += 1
+                        self.cache.put(key, etag, body)
+                        return json.loads(body)
+                    raise
+            else:
+                response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                self.cache.discard(key)
+                return None
+            raise
+        self.cache.misses += 1
+        body = response['Body'].read()
+        self.cache.put(key, response['ETag'], body)
+        return json.loads(body)
+
+    def delete(self, key: str):
+        self.cache.discard(key)
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list_keys(self, prefix: str) -> List[str]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        return [
+            obj['Key']
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+            for obj in page.get('Contents', [])
+        ]
+
+    def load_many(self, keys: List[str]) -> Dict[str, Optional[dict]]:
+        # at most STORAGE_CONCURRENCY requests in flight
+        return dict(zip(keys, self.executor.map(load_data, keys)))
+
+    def check(self):
+        self.client.head_bucket(Bucket=self.bucket)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {"bucket": self.bucket, **self.cache.stats()}
+
+def create_backend(name: str) -> StorageBackend:
+    if name == 's3':
+        try:
+            backend = S3Backend(S3_BUCKET_NAME, AWS_REGION)
+            logger.info(f"S3 client initialized for bucket: {S3_BUCKET_NAME}")
+            return backend
+        except Exception as e:
+            logger.error(f"Failed to initialize S3 client: {e}")
+            logger.warning(f"Falling back to local SQLite storage at {STORAGE_SQLITE_PATH}")
+            name = 'sqlite'
+    if name == 'sqlite':
+        return SQLiteBackend(STORAGE_SQLITE_PATH)
+    if name == 'memory':
+        return MemoryBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> StorageBackend:
+    """The configured backend, created on first use (no network calls until then)."""
+    global backend
+    if backend is None:
+        with _backend_lock:
+            if backend is None:
+                backend = create_backend(STORAGE_BACKEND)
+    return backend
+
+def check_storage() -> dict:
+    """Readiness of the storage backend: {"backend", "ok"[, "error"]}."""
     try:
-        s3_client = boto3.client('s3', region_name=AWS_REGION)
-        # Test credentials by attempting to list buckets
-        s3_client.list_buckets()
-        logger.info(f"S3 client initialized for bucket: {S3_BUCKET_NAME}")
+        store = get_backend()
+        store.check()
+        return {"backend": store.name, "ok": True}
     except Exception as e:
-        logger.error(f"Failed to initialize S3 client: {e}")
-        s3_client = None
-        USE_S3 = False
-        logger.warning("Falling back to in-memory storage")
+        logger.error(f"Storage check failed: {e}")
+        return {"backend": STORAGE_BACKEND, "ok": False, "error": str(e)}
+
+def close_storage():
+    global backend
+    if backend is not None:
+        backend.close()
+        backend = None
 
 def save_data(key: str, data: dict) -> bool:
+    store = get_backend()
     try:
-        if USE_S3 and s3_client:
-            try:
-                s3_client.put_object(
-                    Bucket=S3_BUCKET_NAME,
-                    Key=key,
-                    Body=json.dumps(data),
-                    ContentType='application/json'
-                )
-                logger.info(f"Saved to S3: {key}")
-                return True
-            except Exception as s3_error:
-                logger.error(f"S3 error saving {key}: {s3_error}")
-                in_memory_storage[key] = data
-                return True
-        else:
-            in_memory_storage[key] = data
-            logger.debug(f"Saved to memory: {key}")
+        with storage_seconds.time(backend=store.name, op="save"):
+            store.save(key, data)
+        logger.debug(f"Saved to {store.name}: {key}")
         return True
     except Exception as e:
         logger.error(f"Error saving data to {key}: {e}")
         return False
 
 def load_data(key: str) -> Optional[dict]:
+    store = get_backend()
     try:
-        if USE_S3 and s3_client:
-            try:
-                response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=key)
-                data = json.loads(response['Body'].read())
-                logger.debug(f"Loaded from S3: {key}")
-                return data
-            except ClientError as e:
-                if e.response['Error']['Code'] == 'NoSuchKey':
-                    logger.debug(f"Key not found: {key}")
-                    # Try memory storage as fallback
-                    data = in_memory_storage.get(key)
-                    return data
-                else:
-                    logger.error(f"Error loading data from {key}: {e}")
-                    data = in_memory_storage.get(key)
-                    return data
-            except Exception as s3_error:
-                logger.error(f"Error loading data from {key}: {s3_error}")
-                data = in_memory_storage.get(key)
-                return data
-        else:
-            data = in_memory_storage.get(key)
-            logger.debug(f"Loaded from memory: {key}")
-            return data
+        with storage_seconds.time(backend=store.name, op="load"):
+            data = store.load(key)
+        logger.debug(f"Loaded from {store.name}: {key}")
+        return data
     except Exception as e:
         logger.error(f"Error loading data from {key}: {e}")
         return None
 
 def delete_data(key: str) -> bool:
+    store = get_backend()
     try:
-        if USE_S3 and s3_client:
-            try:
-                s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=key)
-                logger.info(f"Deleted from S3: {key}")
-                return True
-            except Exception as s3_error:
-                logger.error(f"Error deleting data from {key}: {s3_error}")
-                if key in in_memory_storage:
-                    del in_memory_storage[key]
-                return True
-        else:
-            if key in in_memory_storage:
-                del in_memory_storage[key]
-                logger.debug(f"Deleted from memory: {key}")
+        with storage_seconds.time(backend=store.name, op="delete"):
+            store.delete(key)
+        logger.debug(f"Deleted from {store.name}: {key}")
         return True
     except Exception as e:
         logger.error(f"Error deleting data from {key}: {e}")
         return False
 
 def list_keys(prefix: str) -> List[str]:
+    store = get_backend()
     try:
-        if USE_S3 and s3_client:
-            try:
-                response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix=prefix)
-                keys = [obj['Key'] for obj in response.get('Contents', [])]
-                logger.debug(f"Listed {len(keys)} keys from S3 with prefix: {prefix}")
-                return keys
-            except Exception as s3_error:
-                logger.error(f"Error listing keys with prefix {prefix}: {s3_error}")
-                keys = [k for k in in_memory_storage.keys() if k.startswith(prefix)]
-                return keys
-        else:
-            keys = [k for k in in_memory_storage.keys() if k.startswith(prefix)]
-            logger.debug(f"Listed {len(keys)} keys from memory with prefix: {prefix}")
-            return keys
+        with storage_seconds.time(backend=store.name, op="list"):
+            keys = store.list_keys(prefix)
+        logger.debug(f"Listed {len(keys)} keys from {store.name} with prefix: {prefix}")
+        return keys
     except Exception as e:
         logger.error(f"Error listing keys with prefix {prefix}: {e}")
         return []
+
+def load_many(keys: List[str]) -> Dict[str, Optional[dict]]:
+    """Load several keys at once (one query for SQLite, bounded parallel GETs for S3)."""
+    store = get_backend()
+    try:
+        with storage_seconds.time(backend=store.name, op="load_many"):
+            return store.load_many(keys)
+    except Exception as e:
+        logger.error(f"Error loading {len(keys)} keys: {e}")
+        return {key: load_data(key) for key in keys}
+
+def storage_stats() -> dict:
+    # stats never create the backend: with s3 that is a blocking client and credential set-up,
+    # which belongs to the warm-up rather than to whoever scrapes /metrics first
+    if backend is None:
+        return {"backend": STORAGE_BACKEND, "status": "not initialized"}
+    return {"backend": backend.name, **backend.stats()}
+
+# Async wrappers - the backends are blocking, so offload every call to a worker thread
+# to keep the event loop free while S3 round-trips or disk writes are in flight
+async def save_data_async(key: str, data: dict) -> bool:
+    return await asyncio.to_thread(save_data, key, data)
+
+async def load_data_async(key: str) -> Optional[dict]:
+    return await asyncio.to_thread(load_data, key)
+
+async def delete_data_async(key: str) -> bool:
+    return await asyncio.to_thread(delete_data, key)
+
+async def list_keys_async(prefix: str) -> List[str]:
+    return await asyncio.to_thread(list_keys, prefix)
+
+async def load_many_async(keys: List[str]) -> Dict[str, Optional[dict]]:
+    return await asyncio.to_thread(load_many, keys)
+
+async def check_storage_async() -> dict:
+    return await asyncio.to_thread(check_storage)
@@ -0,0 +1,182 @@
+# Structured LLM output: JSON schemas for OpenAI's schema-constrained responses, built from the
+# pydantic models, and a tolerant parser that repairs malformed or truncated JSON locally
+# instead of sending it back to the model.
+import json
+import os
+import re
+import typing
+from typing import Any, Dict, Iterable, Optional, Type
+from pydantic import BaseModel
+
+# LLM_STRUCTURED_OUTPUT=false for OpenAI-compatible servers without json_schema support;
+# their output still goes through the tolerant parser
+STRUCTURED_OUTPUT = os.getenv('LLM_STRUCTURED_OUTPUT', 'true').lower() == 'true'
+
+FENCE_RE = re.compile(r"```(?:json)?\s*\n?(.*?)(?:\n?```|$)", re.DOTALL)
+PARTIAL_LITERAL_RE = re.compile(r"(?<=[\[:,])\s*(?:t|tr|tru|f|fa|fal|fals|n|nu|nul)$")
+NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+parse_stats = {"parsed": 0, "repaired": 0, "failed": 0}
+
+def strict_schema(model: Type[BaseModel], fields: Optional[Iterable[str]] = None) -> Dict:
+    """JSON schema of `model` (optionally only `fields`) in the form strict mode accepts:
+    every property required, no additional properties, no defaults."""
+    schema = model.model_json_schema()
+    if fields is not None:
+        schema["properties"] = {k: v for k, v in schema["properties"].items() if k in fields}
+
+    def tighten(node):
+        if isinstance(node, dict):
+            node.pop("default", None)
+            if node.get("type") == "object" and isinstance(node.get("properties"), dict):
+                node["required"] = list(node["properties"])
+                node["additionalProperties"] = False
+            for value in node.values():
+                tighten(value)
+        elif isinstance(node, list):
+            for value in node:
+                tighten(value)
+
+    tighten(schema)
+    return schema
+
+def response_format(model: Type[BaseModel], name: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict]:
+    if not STRUCTURED_OUTPUT:
+        return None
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": strict_schema(model, fields), "strict": True},
+    }
+
+def strip_fences(text: str) -> str:
+    match = FENCE_RE.search(text)
+    return match.group(1) if match else text
+
+def trim_dangling(text: str, closer: str) -> str:
+    """Drop an incomplete trailing member (a lone comma, a key without a value, a cut-off literal)."""
+    while True:
+        trimmed = PARTIAL_LITERAL_RE.sub('', text.rstrip()).rstrip()
+        if trimmed.endswith(','):
+            trimmed = trimmed[:-1].rstrip()
+        if trimmed.endswith(':'):
+            trimmed = trimmed[:-1].rstrip()
+            trimmed = trimmed[:trimmed.rfind('"', 0, len(trimmed) - 1)].rstrip()
+        elif closer == '}' and trimmed.endswith('"'):
+            # a string right after `{` or `,` inside an object is a key with no value
+            start = trimmed.rfind('"', 0, len(trimmed) - 1)
+            while start > 0 and trimmed[start - 1] == '\\':
+                start = trimmed.rfind('"', 0, start - 1)
+            before = trimmed[:start].rstrip()
+            if before.endswith((',', '{')):
+                trimmed = before
+        if trimmed == text:
+            return text
+        text = trimmed
+
+def repair_json(text: str) -> str:
+    """Close what a truncated or sloppy JSON value left open.
+
+    Scans once, tracking strings and open brackets: trailing commas are
+    dropped, mismatched closers replaced, text after the first complete value
+    ignored, and an unterminated string, member or container closed.
+    """
+    out = []
+    stack = []
+    in_string = escape = False
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            if not stack:
+                break
+            body = ''.join(out).rstrip()
+            out = [body[:-1] if body.endswith(',') else body, stack.pop()]
+            if not stack:
+                break
+        else:
+            out.append(ch)
+    repaired = ''.join(out)
+    if in_string:
+        repaired = (repaired[:-1] if escape else repaired) + '"'
+    while stack:
+        closer = stack.pop()
+        repaired = trim_dangling(repaired, closer) + closer
+    return repaired
+
+def parse_json(text: str) -> Any:
+    """Parse model output: plain JSON, JSON in a code fence or surrounded by prose, or JSON that
+    needs repair_json. Raises json.JSONDecodeError when nothing usable is left."""
+    cleaned = strip_fences(text or '')
+    starts = [i for i in (cleaned.find('{'), cleaned.find('[')) if i >= 0]
+    if not starts:
+        parse_stats["failed"] += 1
+        raise json.JSONDecodeError("No JSON object in model output", cleaned, 0)
+    cleaned = cleaned[min(starts):]
+    decoder = json.JSONDecoder(strict=False)
+    try:
+        value = decoder.raw_decode(cleaned)[0]
+        parse_stats["parsed"] += 1
+        return value
+    except json.JSONDecodeError:
+        pass
+    try:
+        value = decoder.decode(repair_json(cleaned))
+    except json.JSONDecodeError:
+        parse_stats["failed"] += 1
+        raise
+    parse_stats["repaired"] += 1
+    return value
+
+def conform(data: Any, model: Type[BaseModel]) -> Dict:
+    """Coerce parsed output towards `model`'s fields: missing strings become "", missing lists [],
+    a lone string where a list is expected is wrapped, a list where a string is expected joined,
+    and numbers are pulled out of strings like "8/10"."""
+    data = data if isinstance(data, dict) else {}
+    fixed = {}
+    for name, field in model.model_fields.items():
+        value = data.get(name)
+        annotation = field.annotation
+        origin = typing.get_origin(annotation)
+        if origin is typing.Union:
+            args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+            annotation = args[0] if len(args) == 1 else annotation
+            origin = typing.get_origin(annotation)
+        if origin in (list, typing.List):
+            if value is None:
+                value = []
+            elif not isinstance(value, list):
+                value = [value]
+            if typing.get_args(annotation) == (str,):
+                value = [str(item) for item in value if item not in (None, "")]
+        elif annotation is str:
+            if value is None:
+                value = "" if field.is_required() else field.default
+            elif isinstance(value, list):
+                value = ', '.join(str(item) for item in value)
+            else:
+                value = str(value)
+        elif annotation in (int, float):
+            if isinstance(value, str):
+                match = NUMBER_RE.search(value)
+                value = annotation(float(match.group())) if match else None
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = annotation(value)
+            if value is None:
+                value = 0 if field.is_required() else field.default
+        elif value is None and not field.is_required():
+            value = field.default
+        fixed[name] = value
+    return fixed
@@ -0,0 +1,170 @@
+# Metrics and tracing: in-process counters and histograms rendered in the Prometheus text format,
+# per-request stage timings, and spans that are also reported to OpenTelemetry when
+# opentelemetry-api is installed (they are exported once an SDK is configured).
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import trace
+    tracer = trace.get_tracer("clinical-trial-matcher")
+except ImportError:
+    tracer = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{format_labels(labels)} {format_value(v)}" for labels, v in self.values.items()]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for labels, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = ("le", "+Inf" if bound == float("inf") else repr(float(bound)))
+                    lines.append(f"{self.name}_bucket{format_labels(labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+class Collected:
+    """A metric read at scrape time from `collect()`, which returns {labels dict as tuple: value}."""
+
+    def __init__(self, name: str, help: str, kind: str, collect: Callable[[], Dict[Labels, float]]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.error(f"Collecting {self.name} failed: {e}")
+            return []
+        return [f"{self.name}{format_labels(labels)} {format_value(v)}" for labels, v in values.items()]
+
+registry: List = []
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+# metrics shared across modules
+llm_seconds = register(Histogram("llm_request_seconds", "OpenAI request latency by calling function."))
+llm_tokens = register(Histogram("llm_tokens", "OpenAI token usage per request by function and kind.", TOKEN_BUCKETS))
+llm_cache_lookups = register(Counter("llm_cache_lookups_total", "LLM response cache lookups by function and result."))
+ctgov_seconds = register(Histogram("ctgov_request_seconds", "ClinicalTrials.gov request attempt latency by status."))
+ctgov_page_seconds = register(Histogram("ctgov_page_seconds", "ClinicalTrials.gov search page fetch latency."))
+storage_seconds = register(Histogram("storage_op_seconds", "Storage operation latency by backend and op."))
+stage_seconds = register(Histogram("stage_seconds", "Pipeline stage latency (extract, search, store, rank, ...)."))
+http_seconds = register(Histogram("http_request_seconds", "API request latency by method, route and status."))
+
+def register_caches(caches: Callable[[], Dict[str, dict]]):
+    """Expose hit/miss counters and hit ratios of the caches returned by `caches()` (name -> stats())."""
+    def counts(field):
+        return lambda: {(("cache", name),): stats[field] for name, stats in caches().items() if field in stats}
+    register(Collected("cache_hits_total", "Cache hits.", "counter", counts("hits")))
+    register(Collected("cache_misses_total", "Cache misses.", "counter", counts("misses")))
+    register(Collected("cache_coalesced_total", "Lookups that waited on an in-flight fetch.", "counter", counts("coalesced")))
+    register(Collected("cache_hit_ratio", "Cache hits / lookups.", "gauge", counts("hit_rate")))
+
+# stage timings (ms) of the request being handled, set by the API middleware
+request_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a pipeline stage: records it in stage_seconds and the current request's timings,
+    and opens an OpenTelemetry span of the same name when opentelemetry-api is installed."""
+    started = time.perf_counter()
+    with tracer.start_as_current_span(name, attributes=attributes) if tracer is not None else nullcontext():
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            stage_seconds.observe(elapsed, stage=name)
+            timings = request_timings.get()
+            if timings is not None:
+                timings[name] = round(timings.get(name, 0.0) + elapsed * 1000, 1)
+            logger.debug(f"{name} took {elapsed * 1000:.1f} ms {attributes or ''}")
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Server-Timing header value for the stage timings of a request."""
+    return ", ".join(f"{name};dur={ms}" for name, ms in timings.items())
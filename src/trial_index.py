@@ -0,0 +1,230 @@
+# Local ClinicalTrials.gov index: SQLite FTS5 over conditions and interventions, with
+# status, phase, sex and age columns for filtering. Built from a bulk studies export
+# (https://clinicaltrials.gov/data-api/how-download-study-records) and kept current
+# with incremental refreshes by last update date. Queries run on the asyncio.to_thread pool,
+# each thread with its own read connection.
+#
+#   python -m src.trial_index build ctg-studies.json.zip [--db trials.db]
+#   python -m src.trial_index refresh [--db trials.db] [--since 2024-01-01]
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zipfile
+from typing import Dict, Iterator, List, Optional
+import httpx
+from .eligibility import parse_age
+from .records import compact
+from .trial_service import long_trial, short_trial
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    nct_id TEXT PRIMARY KEY,
+    status TEXT,
+    phases TEXT,
+    sex TEXT,
+    min_age REAL,
+    max_age REAL,
+    last_update TEXT,
+    short TEXT,
+    long TEXT
+);
+CREATE INDEX IF NOT EXISTS studies_last_update ON studies(last_update);
+CREATE VIRTUAL TABLE IF NOT EXISTS studies_fts USING fts5(
+    conditions, interventions, tokenize = 'porter unicode61'
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def fts_phrases(value: str) -> str:
+    # "Type 2 Diabetes OR Hypertension" -> ("Type 2 Diabetes" OR "Hypertension")
+    terms = [term.strip() for term in value.split(' OR ') if term.strip()]
+    return '(' + ' OR '.join('"' + term.replace('"', '""') + '"' for term in terms) + ')' if terms else ''
+
+def iter_export(path: str) -> Iterator[dict]:
+    """Yield studies from a bulk export: a ZIP of per-study JSON files, or a JSON list / {"studies": [...]}."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.endswith('.json'):
+                    yield json.loads(archive.read(name))
+    else:
+        with open(path, 'r', encoding="utf8") as file:
+            data = json.load(file)
+        yield from data.get('studies', []) if isinstance(data, dict) else data
+
+class TrialIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        # indexes built before unknown dates were stored as NULL have 'Unknown', which sorts after every date
+        with self._db:
+            self._db.execute("UPDATE studies SET last_update = NULL WHERE last_update NOT GLOB '[0-9]*'")
+        self._local = threading.local()
+
+    def _reader(self) -> sqlite3.Connection:
+        # one connection per thread; queries arrive on the asyncio.to_thread pool
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM studies").fetchone()[0]
+
+    def last_update(self) -> Optional[str]:
+        """The newest last update date stored (studies with an unknown date don't count)."""
+        return self._db.execute("SELECT MAX(last_update) FROM studies").fetchone()[0]
+
+    def upsert(self, study: dict) -> bool:
+        """Insert or update one study; returns False when the stored copy is already as recent."""
+        protocol = study.get('protocolSection', {})
+        nct_id = protocol.get('identificationModule', {}).get('nctId')
+        if not nct_id:
+            return False
+        trial = long_trial(study, nct_id)
+        # ISO dates (YYYY-MM-DD or YYYY-MM) compare as strings; an unknown date is stored as NULL
+        last_update = trial["last_update_post_date"] if trial["last_update_post_date"][:1].isdigit() else None
+        existing = self._db.execute(
+            "SELECT rowid, last_update FROM studies WHERE nct_id = ?", (nct_id,)
+        ).fetchone()
+        if existing and existing[1] and last_update and existing[1] >= last_update:
+            return False
+
+        eligibility = protocol.get('eligibilityModule', {})
+        conditions = protocol.get('conditionsModule', {}).get('conditions', [])
+        interventions = [
+            inter.get('name', '') for inter in protocol.get('armsInterventionsModule', {}).get('interventions', [])
+            if isinstance(inter, dict)
+        ]
+        row = (
+            trial["status"], trial["phases"], eligibility.get('sex', 'ALL').upper(),
+            parse_age(eligibility.get('minimumAge')), parse_age(eligibility.get('maximumAge')),
+            last_update, json.dumps(short_trial(study)), json.dumps(trial),
+        )
+        if existing:
+            rowid = existing[0]
+            self._db.execute(
+                "UPDATE studies SET status = ?, phases = ?, sex = ?, min_age = ?, max_age = ?, "
+                "last_update = ?, short = ?, long = ? WHERE rowid = ?", row + (rowid,)
+            )
+            self._db.execute("DELETE FROM studies_fts WHERE rowid = ?", (rowid,))
+        else:
+            rowid = self._db.execute(
+                "INSERT INTO studies (nct_id, status, phases, sex, min_age, max_age, last_update, short, long) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (nct_id,) + row
+            ).lastrowid
+        self._db.execute(
+            "INSERT INTO studies_fts (rowid, conditions, interventions) VALUES (?, ?, ?)",
+            (rowid, ' ; '.join(conditions), ' ; '.join(interventions)),
+        )
+        return True
+
+    def load(self, studies) -> tuple:
+        """Upsert an iterable of studies in one transaction; returns (seen, changed)."""
+        seen = changed = 0
+        with self._lock, self._db:
+            for study in studies:
+                seen += 1
+                changed += self.upsert(study)
+        return seen, changed
+
+    def refresh_from_api(self, base_url: str, since: Optional[str] = None) -> tuple:
+        """Pull studies updated on or after `since` (default: newest stored update) from the live API."""
+        since = since or self.last_update() or "1900-01-01"
+        params = {"filter.advanced": f"AREA[LastUpdatePostDate]RANGE[{since},MAX]", "pageSize": 1000}
+        seen = changed = 0
+        with httpx.Client(timeout=30) as http:
+            while True:
+                response = http.get(base_url, params=params)
+                response.raise_for_status()
+                data = response.json()
+                page_seen, page_changed = self.load(data.get('studies', []))
+                seen += page_seen
+                changed += page_changed
+                if not data.get('nextPageToken'):
+                    break
+                params['pageToken'] = data['nextPageToken']
+        return seen, changed
+
+    def search(self, params: dict, limit: int = 40) -> List[Dict]:
+        """Answer a get_params-style query with short trial records, best BM25 match first.
+
+        Understands query.cond, query.intr and filter.overallStatus like the live API,
+        plus filter.phase, filter.sex and filter.age (patient age in years).
+        """
+        match = ' AND '.join(
+            f"{column} : {phrases}" for column, phrases in (
+                ("conditions", fts_phrases(params.get('query.cond', ''))),
+                ("interventions", fts_phrases(params.get('query.intr', ''))),
+            ) if phrases
+        )
+        where, args = [], []
+        if match:
+            where.append("studies_fts MATCH ?")
+            args.append(match)
+        statuses = [s for s in re.split(r'[,|]', params.get('filter.overallStatus', '')) if s]
+        if statuses:
+            where.append(f"s.status IN ({','.join('?' * len(statuses))})")
+            args.extend(statuses)
+        if params.get('filter.phase'):
+            where.append("s.phases LIKE ?")
+            args.append(f"%{params['filter.phase']}%")
+        if params.get('filter.sex'):
+            where.append("s.sex IN ('ALL', ?)")
+            args.append(params['filter.sex'].upper())
+        if params.get('filter.age') is not None:
+            where.append("(s.min_age IS NULL OR s.min_age <= ?) AND (s.max_age IS NULL OR s.max_age >= ?)")
+            args.extend([float(params['filter.age'])] * 2)
+
+        sql = "SELECT s.short FROM studies s"
+        if match:
+            sql += " JOIN studies_fts ON studies_fts.rowid = s.rowid"
+        if where:
+            sql += " WHERE " + ' AND '.join(where)
+        sql += " ORDER BY studies_fts.rank" if match else " ORDER BY s.last_update DESC"
+        sql += " LIMIT ?"
+        rows = self._reader().execute(sql, args + [limit]).fetchall()
+        return [compact(json.loads(row[0])) for row in rows]
+
+    def get(self, nct_id: str) -> Optional[Dict]:
+        row = self._reader().execute("SELECT long FROM studies WHERE nct_id = ?", (nct_id,)).fetchone()
+        return compact(json.loads(row[0])) if row else None
+
+    async def search_async(self, params: dict, limit: int = 40) -> List[Dict]:
+        return await asyncio.to_thread(self.search, params, limit)
+
+    async def get_async(self, nct_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.get, nct_id)
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Build or refresh the local ClinicalTrials.gov index")
+    parser.add_argument("command", choices=["build", "refresh"])
+    parser.add_argument("export", nargs="?", help="bulk export (ZIP or JSON); refresh uses the live API without it")
+    parser.add_argument("--db", default=os.getenv('TRIAL_INDEX_PATH', 'trials.db'))
+    parser.add_argument("--since", help="refresh: only studies updated on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--base-url", default=os.getenv("CLINICAL_TRIALS_API_URL", "https://clinicaltrials.gov/api/v2/studies"))
+    args = parser.parse_args()
+
+    index = TrialIndex(args.db)
+    if args.command == "build" and not args.export:
+        parser.error("build needs an export file")
+    if args.export:
+        # rebuilds and refreshes from an export are the same operation: only newer records are written
+        seen, changed = index.load(iter_export(args.export))
+    else:
+        seen, changed = index.refresh_from_api(args.base_url, args.since)
+    logger.info(f"Processed {seen} studies, {changed} added or updated, {index.count()} in {args.db}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# Server-side filtering, sorting and cursor pagination for trial lists. A note's list index is
+# computed when its trials are stored: one precomputed position order per sort key, and posting
+# lists (value -> positions) for the filterable fields. A page walks the requested order from
+# the cursor and keeps the positions that pass the filters, so nothing is sorted or scanned
+# before the cursor at request time. The distance sort and radius filter depend on the query
+# point, so they are computed per request from the list's site grid (see geo.py).
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .geo import build_site_index, trial_distances
+
+SORTS = ("score", "relevance", "date", "distance")
+# query parameter -> posting list name; a parameter takes comma-separated values (any may match)
+FILTERS = {"status": "status", "phase": "phase", "sex": "sex", "country": "country"}
+MAX_PAGE_SIZE = 500
+# attributes stored with each trial for the list index (filters, sorts, site grid); responses
+# leave them out unless `fields` asks for them
+INDEX_FIELDS = ("min_age", "max_age", "countries", "sites", "prerank_score")
+# filtered totals by list version and filter combination, so paging through a filtered list counts it once
+MAX_CACHED_TOTALS = 1024
+_totals: "OrderedDict[tuple, int]" = OrderedDict()
+
+def values_of(trial: Dict, name: str) -> List[str]:
+    """The normalized values a trial is listed under for one filter (upper case, countries case-folded)."""
+    if name == "status":
+        return [str(trial.get("status") or "Unknown").upper()]
+    if name == "phase":
+        phases = trial.get("phases") or ""
+        phases = phases if isinstance(phases, list) else [p.strip() for p in phases.split(",")]
+        return [p.upper() for p in phases if p and p != "Not Available"]
+    if name == "sex":
+        return [str(trial.get("sex") or "All").upper()]
+    if name == "country":
+        return [country.casefold() for country in trial.get("countries") or []]
+    return []
+
+def list_version(trials: List[Dict]) -> str:
+    return hashlib.sha1(",".join(t.get("nct_id", "") for t in trials).encode()).hexdigest()[:12]
+
+def relevance_order(trials: List[Dict], ranking: Optional[Dict]) -> List[int]:
+    """AI-ranked trials by relevance score, then the unranked ones in pre-rank order."""
+    scores = {}
+    if ranking and ranking.get("status") == "ready":
+        scores = {t["nct_id"]: t.get("relevance_score", 0) for t in ranking.get("trials", [])}
+    by_score = sorted(range(len(trials)), key=lambda i: -(trials[i].get("prerank_score") or 0))
+    return sorted(by_score, key=lambda i: (trials[i]["nct_id"] not in scores, -scores.get(trials[i]["nct_id"], 0)))
+
+def build_list_index(trials: List[Dict], ranking: Optional[Dict] = None) -> Dict:
+    """Sort orders and filter postings for a trial list (stored with the note as JSON)."""
+    positions = range(len(trials))
+    postings: Dict[str, Dict[str, List[int]]] = {name: {} for name in FILTERS.values()}
+    for i, trial in enumerate(trials):
+        for name in postings:
+            for value in values_of(trial, name):
+                postings[name].setdefault(value, []).append(i)
+    # dates are ISO (YYYY-MM or YYYY-MM-DD); unknown dates sort last
+    dated = {i for i in positions if str(trials[i].get("last_update_post_date", ""))[:1].isdigit()}
+    by_date = sorted(dated, key=lambda i: (trials[i]["last_update_post_date"], -i), reverse=True)
+    undated = [i for i in positions if i not in dated]
+    return {
+        "version": list_version(trials),
+        "size": len(trials),
+        "orders": {
+            "score": sorted(positions, key=lambda i: -(trials[i].get("prerank_score") or 0)),
+            "relevance": relevance_order(trials, ranking),
+            "date": by_date + undated,
+        },
+        "postings": postings,
+        "geo": build_site_index(trials),
+    }
+
+def current_index(trials: List[Dict], index: Optional[Dict], ranking: Optional[Dict] = None) -> Dict:
+    """`index` if it still describes `trials`, otherwise a fresh one (notes stored before list indexes)."""
+    if index and index.get("size") == len(trials) and index.get("version") == list_version(trials):
+        return index
+    return build_list_index(trials, ranking)
+
+def encode_cursor(sort: str, offset: int, version: str) -> str:
+    data = json.dumps({"s": sort, "o": offset, "v": version}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str, version: str) -> int:
+    """The order offset a cursor points to; raises ValueError for a malformed or outdated cursor."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        offset = int(data["o"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+    if data.get("s") != sort:
+        raise ValueError("Cursor was issued for a different sort order")
+    if data.get("v") != version:
+        raise ValueError("The trial list changed since this cursor was issued; start again from the first page")
+    return offset
+
+def parse_filters(query: Dict[str, Optional[str]]) -> Dict[str, List[str]]:
+    filters = {}
+    for param, name in FILTERS.items():
+        if query.get(param):
+            values = [v.strip() for v in query[param].split(",") if v.strip()]
+            filters[name] = [v.casefold() for v in values] if name == "country" else [v.upper() for v in values]
+    return filters
+
+def allowed_positions(index: Dict, filters: Dict[str, List[str]]) -> Optional[set]:
+    """Positions passing all posting-list filters, or None when there are none."""
+    allowed = None
+    for name, values in filters.items():
+        postings = index["postings"].get(name, {})
+        if name == "sex" and "ALL" not in values:
+            # a trial open to all sexes matches either
+            values = values + ["ALL"]
+        matching = {i for value in values for i in postings.get(value, ())}
+        allowed = matching if allowed is None else allowed & matching
+    return allowed
+
+def within_age(trial: Dict, min_age: Optional[float], max_age: Optional[float]) -> bool:
+    # a trial's unknown age bound is treated as open, like the local trial index does
+    if min_age is not None and trial.get("max_age") is not None and trial["max_age"] < min_age:
+        return False
+    if max_age is not None and trial.get("min_age") is not None and trial["min_age"] > max_age:
+        return False
+    return True
+
+def trim(trial: Dict, fields: Optional[Iterable[str]] = None) -> Dict:
+    """The trial as sent in responses: nct_id and `fields`, or everything but INDEX_FIELDS."""
+    if not fields:
+        return {k: v for k, v in trial.items() if k not in INDEX_FIELDS}
+    return {k: trial[k] for k in dict.fromkeys(["nct_id", *fields]) if k in trial}
+
+def count_matching(
+    trials: List[Dict], allowed: Optional[set], min_age: Optional[float], max_age: Optional[float],
+    within_radius: Optional[np.ndarray],
+) -> int:
+    """Trials passing the filters, counted on arrays rather than trial by trial (same rules as page_trials)."""
+    mask = np.ones(len(trials), dtype=bool)
+    if allowed is not None:
+        mask[:] = False
+        mask[np.fromiter(allowed, dtype=np.int64, count=len(allowed))] = True
+    if within_radius is not None:
+        mask &= within_radius
+    # unknown bounds are NaN, which never compares true, so they stay open as in within_age
+    if min_age is not None:
+        mask &= ~(np.array([t.get("max_age") for t in trials], dtype=float) < min_age)
+    if max_age is not None:
+        mask &= ~(np.array([t.get("min_age") for t in trials], dtype=float) > max_age)
+    return int(mask.sum())
+
+def filtered_total(
+    trials: List[Dict], index: Dict, filters: Dict[str, List[str]], allowed: Optional[set],
+    min_age: Optional[float], max_age: Optional[float], near: Optional[Tuple[float, float]],
+    radius_km: Optional[float], distances: Optional[np.ndarray],
+) -> int:
+    key = (index["version"], len(trials), json.dumps(filters, sort_keys=True), min_age, max_age,
+           near if radius_km is not None else None, radius_km)
+    total = _totals.get(key)
+    if total is None:
+        within_radius = np.isfinite(distances) if radius_km is not None else None
+        total = _totals[key] = count_matching(trials, allowed, min_age, max_age, within_radius)
+        while len(_totals) > MAX_CACHED_TOTALS:
+            _totals.popitem(last=False)
+    else:
+        _totals.move_to_end(key)
+    return total
+
+def distance_order(distances: np.ndarray) -> List[int]:
+    """Positions by nearest-site distance; trials without (matching) sites last, in list order."""
+    located = np.flatnonzero(np.isfinite(distances))
+    nearest = located[np.argsort(distances[located], kind="stable")]
+    return nearest.tolist() + np.flatnonzero(~np.isfinite(distances)).tolist()
+
+def page_trials(
+    trials: List[Dict], index: Dict, sort: str = "score", cursor: Optional[str] = None, limit: int = 50,
+    filters: Optional[Dict[str, List[str]]] = None, min_age: Optional[float] = None,
+    max_age: Optional[float] = None, fields: Optional[List[str]] = None,
+    near: Optional[Tuple[float, float]] = None, radius_km: Optional[float] = None,
+) -> Dict:
+    """One page of `trials` in `sort` order that passes the filters, with the cursor of the next page
+    and the number of trials passing the filters.
+
+    min_age/max_age select trials whose eligible age range overlaps the given
+    range (years). With `near` (lat, lon) every trial gets distance_km to its
+    nearest site, radius_km keeps trials with a site within that distance and
+    sort=distance orders by it. Raises ValueError for an unknown sort, a
+    distance query without `near` or a bad cursor.
+    """
+    if sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    if near is None and (sort == "distance" or radius_km is not None):
+        raise ValueError("sort=distance and radius_km need near=latitude,longitude")
+    distances = None
+    if near is not None:
+        # notes stored before site grids were added get one built on the fly
+        distances = trial_distances(index.get("geo") or build_site_index(trials), len(trials), *near, radius_km)
+    if sort == "distance":
+        order = distance_order(distances)
+        if radius_km is not None:
+            # nothing past the last trial within the radius can match
+            order = order[:int(np.isfinite(distances).sum())]
+        # the order depends on the query point, so a cursor is only valid for the same point
+        sort_key = f"distance:{near[0]},{near[1]}"
+    else:
+        order = index["orders"][sort]
+        sort_key = sort
+    offset = decode_cursor(cursor, sort_key, index["version"]) if cursor else 0
+    allowed = allowed_positions(index, filters or {})
+    filtered = allowed is not None or min_age is not None or max_age is not None or radius_km is not None
+
+    def matches(i: int) -> bool:
+        if radius_km is not None and not np.isfinite(distances[i]):
+            return False
+        return (allowed is None or i in allowed) and within_age(trials[i], min_age, max_age)
+
+    page = []
+    while offset < len(order) and len(page) < limit:
+        i = order[offset]
+        offset += 1
+        if matches(i):
+            trial = trim(trials[i], fields)
+            if distances is not None:
+                trial = {**trial, "distance_km": round(float(distances[i]), 1) if np.isfinite(distances[i]) else None}
+            page.append(trial)
+    return {
+        "trials": page,
+        "next_cursor": encode_cursor(sort_key, offset, index["version"]) if offset < len(order) else None,
+        # trials passing the filters, not just those on this page
+        "total": filtered_total(trials, index, filters or {}, allowed, min_age, max_age, near, radius_km, distances)
+        if filtered else len(trials),
+    }
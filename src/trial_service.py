@@ -1,158 +1,368 @@
 # imports
-import requests
+import asyncio
+import httpx
 import json
+import os
+import re
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from .cache import TTLCache
+from .eligibility import parse_age
+from .geo import site_points
+from .http_client import get_json
+from .records import compact
+from .telemetry import ctgov_page_seconds
+from .workers import shared_path
 
-def get_params(llm_output: str) -> dict:
+# ClinicalTrials.gov rejects page sizes above 1000
+MAX_PAGE_SIZE = 1000
+NCT_ID = re.compile(r"^NCT\d{8}$")
+
+# Trial detail cache configuration (TRIAL_CACHE_PATH enables on-disk persistence)
+TRIAL_CACHE_SIZE = int(os.getenv('TRIAL_CACHE_SIZE', '2048'))
+TRIAL_CACHE_MIN_TTL = float(os.getenv('TRIAL_CACHE_MIN_TTL', '3600'))
+TRIAL_CACHE_MAX_TTL = float(os.getenv('TRIAL_CACHE_MAX_TTL', '604800'))
+TRIAL_CACHE_TTL_FACTOR = float(os.getenv('TRIAL_CACHE_TTL_FACTOR', '0.1'))
+TRIAL_CACHE_PATH = os.getenv('TRIAL_CACHE_PATH', '')
+
+# Local trial index (see trial_index.py); when set, searches and detail lookups are served from it
+TRIAL_INDEX_PATH = os.getenv('TRIAL_INDEX_PATH', '')
+
+# Search result cache: identical normalized queries within SEARCH_CACHE_TTL seconds share one upstream search
+# (SEARCH_CACHE_PATH enables on-disk persistence)
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '512'))
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '300'))
+SEARCH_CACHE_PATH = os.getenv('SEARCH_CACHE_PATH', '')
+
+# Batch detail lookups: IDs per bulk filter.ids query and parallel single lookups
+BATCH_CHUNK_SIZE = int(os.getenv('TRIAL_BATCH_CHUNK_SIZE', '100'))
+BATCH_CONCURRENCY = int(os.getenv('TRIAL_BATCH_CONCURRENCY', '8'))
+
+def get_params(patient_data: dict) -> dict:
+    """Search params from the extracted patient data (conditions and interventions, OR-joined)."""
+    conditions = patient_data.get('conditions') or []
+    interventions = patient_data.get('interventions') or []
+    return {
+        "query.cond": ' OR '.join(conditions),
+        "query.intr": ' OR '.join(interventions),
+    }
+
+def list_attributes(protocol: dict) -> dict:
+    """Fields trial lists are filtered and sorted on (see trial_lists.py), shared by short and long records."""
+    eligibility = protocol.get('eligibilityModule', {})
+    locations = protocol.get('contactsLocationsModule', {}).get('locations', [])
+    return {
+        "min_age": parse_age(eligibility.get('minimumAge')),
+        "max_age": parse_age(eligibility.get('maximumAge')),
+        "countries": list(dict.fromkeys(loc['country'] for loc in locations if isinstance(loc, dict) and loc.get('country'))),
+        "sites": site_points(locations),
+    }
+
+_trial_index = None
+
+def trial_index():
+    """The local trial index, opened on first use, or None when TRIAL_INDEX_PATH is unset."""
+    global _trial_index
+    if _trial_index is None and TRIAL_INDEX_PATH:
+        from .trial_index import TrialIndex
+        _trial_index = TrialIndex(TRIAL_INDEX_PATH)
+    return _trial_index
+
+def short_trial(study: dict) -> dict:
+    protocol = study.get('protocolSection', {})
+    nct_id = protocol.get('identificationModule', {}).get('nctId', 'Unknown')
+    conditions_list = protocol.get('conditionsModule', {}).get('conditions', [])
+    conditions = ', '.join(conditions_list[:4]) if conditions_list else 'No conditions listed'
+    interventions_list = protocol.get('armsInterventionsModule', {}).get('interventions', [])
+    interventions_names = [inv.get('name', 'Unknown') for inv in interventions_list[:4]]
+    interventions = ', '.join(interventions_names) if interventions_names else 'No interventions listed'
+    status_module = protocol.get('statusModule', {})
+    phases_list = protocol.get('designModule', {}).get('phases', [])
+    return compact({
+        "nct_id": nct_id,
+        "conditions": conditions,
+        "interventions": interventions,
+        "status": status_module.get('overallStatus', 'Unknown'),
+        "phases": ', '.join(phases_list) if phases_list else 'Not Available',
+        "sex": protocol.get('eligibilityModule', {}).get('sex', 'All'),
+        "last_update_post_date": status_module.get('lastUpdatePostDateStruct', {}).get('date', 'Unknown'),
+        **list_attributes(protocol)
+    })
+
+async def stream_trials(base_url: str, params: dict, limit: int = 40, pages: int = 10):
+    """Yield pages of short trial records until `limit` trials have been produced.
+
+    The page size is derived from `limit`, and the request for the next page is
+    started as soon as its token is known; the current page is parsed on a worker
+    thread meanwhile, so the loop keeps that round-trip going. `params` is never modified. With a local
+    trial index configured, the whole result comes from it as a single page.
+    """
+    index = trial_index()
+    if index is not None:
+        yield await index.search_async(params, limit)
+        return
+
+    query = {k: v for k, v in params.items() if k not in ('pageToken', 'pageSize')}
+    page_size = max(1, min(limit, MAX_PAGE_SIZE))
+    remaining = limit
+
+    async def fetch_page(page_token):
+        page_params = {**query, "pageSize": page_size}
+        if page_token:
+            page_params['pageToken'] = page_token
+        with ctgov_page_seconds.time():
+            return await get_json(base_url, page_params)
+
+    pending = asyncio.create_task(fetch_page(None))
+    search_metrics["upstream_searches"] += 1
+    i = 1
     try:
-        data = json.loads(llm_output)
-        conditions = data.get('conditions', [])
-        conditions_str = ' OR '.join(conditions) if conditions else ''
-        interventions = data.get('interventions', [])
-        interventions_str = ' OR '.join(interventions) if interventions else ''
-        params = {
-            "query.cond": conditions_str,
-            "query.intr": interventions_str,
-            "pageSize": 30,
-        }
-        return params
-    except json.JSONDecodeError as e:
-        print(f"Error parsing LLM output: {e}")
-    except Exception as e:
-        print(f"Unexpected error in get_params: {e}")
+        while pending is not None:
+            data = await pending
+            pending = None
+            studies = data.get('studies', [])[:remaining]
+            remaining -= len(studies)
+            next_page_token = data.get('nextPageToken')
+            if next_page_token and remaining > 0 and i < pages:
+                pending = asyncio.create_task(fetch_page(next_page_token))
+                i += 1
+            search_metrics["upstream_pages"] += 1
+            # parsed on a worker thread so the loop keeps sending the next request meanwhile
+            yield await asyncio.to_thread(lambda: [short_trial(study) for study in studies])
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+def normalize_terms(value: str) -> str:
+    terms = {' '.join(term.split()).casefold() for term in value.split(' OR ')}
+    return ' OR '.join(sorted(term for term in terms if term))
+
+def normalize_params(params: dict) -> dict:
+    """Search params with condition/intervention terms de-duplicated, case-folded and sorted."""
+    return {
+        k: normalize_terms(v) if k in ('query.cond', 'query.intr') else v
+        for k, v in params.items() if k not in ('pageToken', 'pageSize')
+    }
+
+def search_key(params: dict, limit: int, pages: int) -> str:
+    return json.dumps({"params": normalize_params(params), "limit": limit, "pages": pages}, sort_keys=True)
 
-def relevant_trials(base_url: str, params: dict, pages: int = 10) -> list:
+# results are {"trials": [...], "complete": bool}; searches cut short by an error are not cached
+search_cache = TTLCache(
+    "searches",
+    max_entries=SEARCH_CACHE_SIZE,
+    ttl=lambda result: SEARCH_CACHE_TTL if result["complete"] else 0,
+    path=shared_path("search-cache", SEARCH_CACHE_PATH),
+)
+search_metrics = {"upstream_searches": 0, "upstream_pages": 0}
+
+def search_cache_stats() -> dict:
+    stats = search_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        **search_metrics,
+        "upstream_searches_avoided": stats["hits"] + stats["coalesced"],
+        # share of lookups answered without a new upstream search (cache hits plus coalesced waiters)
+        "avoided_rate": (stats["hits"] + stats["coalesced"]) / lookups if lookups else 0.0,
+    }
+
+async def search_trials(
+    base_url: str, params: dict, limit: int, pages: int, on_page: Optional[Callable[[list], None]] = None
+) -> dict:
+    """All pages of a search; `on_page` is called with each page as it arrives."""
     trials = []
-    i = 0
     try:
-        while i < pages:
-            response = requests.get(base_url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            studies = data.get('studies', [])
-            for study in studies:
-                protocol = study.get('protocolSection', {})
-                nct_id = protocol.get('identificationModule', {}).get('nctId', 'Unknown')
-                conditions_list = protocol.get('conditionsModule', {}).get('conditions', [])
-                conditions = ', '.join(conditions_list[:4]) if conditions_list else 'No conditions listed'
-                interventions_list = protocol.get('armsInterventionsModule', {}).get('interventions', [])
-                interventions_names = [inv.get('name', 'Unknown') for inv in interventions_list[:4]]
-                interventions = ', '.join(interventions_names) if interventions_names else 'No interventions listed'
-                trials.append({
-                    "nct_id": nct_id,
-                    "conditions": conditions,
-                    "interventions": interventions
-                })
-            next_page_token = data.get('nextPageToken')
-            if not next_page_token:
-                break
-            params['pageToken'] = next_page_token
-            i += 1
-    except requests.exceptions.RequestException as e:
+        async for page in stream_trials(base_url, params, limit, pages):
+            trials.extend(page)
+            if on_page is not None:
+                on_page(page)
+    except httpx.HTTPError as e:
         print(f"Error fetching trials: {e}")
+        return {"trials": trials, "complete": False}
+    return {"trials": trials, "complete": True}
+
+async def relevant_trials(base_url: str, params: dict, limit: int = 40, pages: int = 10) -> list:
+    try:
+        params = normalize_params(params)
+        result = await search_cache.get_or_fetch(
+            search_key(params, limit, pages), lambda: search_trials(base_url, params, limit, pages)
+        )
+        # copy so callers can't modify the cached list
+        return list(result["trials"])
     except Exception as e:
         print(f"Unexpected error in relevant_trials: {e}")
-    return trials[:40]
+        return []
+
+async def stream_search(base_url: str, params: dict, limit: int = 40, pages: int = 10):
+    """stream_trials through the search cache.
 
-def trials_long(base_url: str, nct_id: str) -> dict:
+    The search runs as the cache's single-flight fetch, so concurrent streams
+    and relevant_trials calls for the same search share one upstream search.
+    The stream that starts it yields pages as they arrive; a cached result, or
+    one another request is already fetching, is yielded as a single page. The
+    search runs to completion (and is cached) even if the stream is closed early.
+    """
+    params = normalize_params(params)
+    key = search_key(params, limit, pages)
+    cached = search_cache.get(key)
+    if cached is not None:
+        yield list(cached["trials"])
+        return
+    pages_seen: asyncio.Queue = asyncio.Queue()
+    started = False
+
+    def fetch():
+        nonlocal started
+        started = True
+        return search_trials(base_url, params, limit, pages, on_page=pages_seen.put_nowait)
+
+    search = search_cache.fetching(key, fetch)
+    # marks the end of the pages once the search is done (or failed)
+    search.add_done_callback(lambda _: pages_seen.put_nowait(None))
     try:
-        query_url = f"{base_url}/{nct_id}"
-        
-        response = requests.get(query_url, timeout=10)
-        response.raise_for_status()
-        
-        json_data = response.json()
-        
-        if "protocolSection" in json_data:
-            protocol = json_data.get("protocolSection", {})
-        elif "studies" in json_data and json_data["studies"]:
-            study = json_data["studies"][0]
-            protocol = study.get("protocolSection", {})
-        else:
-            return {
-                "nct_id": nct_id,
-                "acronym": "Not Found",
-                "title": "Not Found",
-                "primary_completion_date": "Unknown",
-                "study_first_post_date": "Unknown",
-                "last_update_post_date": "Unknown",
-                "study_type": "Unknown",
-                "status": "Unknown",
-                "sponsor": "Unknown",
-                "conditions": "Unknown",
-                "interventions": "Unknown",
-                "locations": "Unknown",
-                "age": "Unknown",
-                "sex": "Unknown",
-                "phases": "Unknown",
-                "eligibility_criteria": "Not available"
-            }
-        
-        id_module = protocol.get("identificationModule", {})
-        nct_id_result = id_module.get("nctId", nct_id)
-        acronym = id_module.get("acronym", "Unknown")
-        title = id_module.get("briefTitle", "Unknown")
-
-        status_module = protocol.get("statusModule", {})
-        status = status_module.get("overallStatus", "Unknown")
-        primary_completion_date = status_module.get("primaryCompletionDateStruct", {}).get("date", "Unknown")
-        study_first_post_date = status_module.get("studyFirstPostDateStruct", {}).get("date", "Unknown")
-        last_update_post_date = status_module.get("lastUpdatePostDateStruct", {}).get("date", "Unknown")
-        
-        design_module = protocol.get("designModule", {})
-        study_type = design_module.get("studyType", "Unknown")
-        phases_list = design_module.get("phases", [])
-        phases = ', '.join(phases_list) if phases_list else "Not Available"
-        
-        sponsor_module = protocol.get("sponsorCollaboratorsModule", {})
-        sponsor = sponsor_module.get("leadSponsor", {}).get("name", "Unknown")
-        
-        conditions_module = protocol.get("conditionsModule", {})
-        conditions_list = conditions_module.get("conditions", [])
-        conditions = ', '.join(conditions_list) if conditions_list else "No conditions listed"
-        
-        interventions_module = protocol.get("armsInterventionsModule", {})
-        interventions_raw = interventions_module.get("interventions", [])
-        interventions_list = [
-            inter.get("name", "Unknown") if isinstance(inter, dict) else str(inter)
-            for inter in interventions_raw
-        ]
-        interventions = ', '.join(interventions_list) if interventions_list else "No interventions listed"
-        
-        eligibility_module = protocol.get("eligibilityModule", {})
-        min_age = eligibility_module.get("minimumAge", "Unknown")
-        max_age = eligibility_module.get("maximumAge", "Unknown")
-        age = f"{min_age} to {max_age}" if min_age != "Unknown" or max_age != "Unknown" else "Unknown"
-        sex = eligibility_module.get("sex", "All")
-        eligibility_criteria = eligibility_module.get("eligibilityCriteria", "")
-        
-        contacts_locations_module = protocol.get("contactsLocationsModule", {})
-        locations_raw = contacts_locations_module.get("locations", [])
-        locations_list = [
-            f"{loc.get('city', 'Unknown')}, {loc.get('country', 'Unknown')}"
-            for loc in locations_raw[:10] if isinstance(loc, dict)
-        ]
-        locations = ', '.join(locations_list) if locations_list else "No locations listed"
-        
+        while (page := await pages_seen.get()) is not None:
+            yield page
+        result = search.result()
+        if not started:
+            yield list(result["trials"])
+    finally:
+        if not search.done():
+            # nobody reads the outcome of a search left to finish for the cache
+            search.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+def trial_ttl(trial: dict) -> float:
+    """Cache lifetime for a detail record, based on how recently the study changed.
+
+    Studies that were updated recently tend to be updated again soon, so they
+    get a short lifetime; dormant studies can be kept for longer.
+    """
+    if trial.get("title") == "Not Found":
+        return 0
+    last_update = trial.get("last_update_post_date", "Unknown")
+    for fmt in ("%Y-%m-%d", "%Y-%m"):
+        try:
+            updated = datetime.strptime(last_update, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        return TRIAL_CACHE_MIN_TTL
+    age = (datetime.utcnow() - updated).total_seconds()
+    return min(TRIAL_CACHE_MAX_TTL, max(TRIAL_CACHE_MIN_TTL, age * TRIAL_CACHE_TTL_FACTOR))
+
+trial_cache = TTLCache(
+    "trials",
+    max_entries=TRIAL_CACHE_SIZE,
+    ttl=trial_ttl,
+    path=shared_path("trial-cache", TRIAL_CACHE_PATH),
+)
+
+def long_trial(json_data: dict, nct_id: str) -> dict:
+    if "protocolSection" in json_data:
+        protocol = json_data.get("protocolSection", {})
+    elif "studies" in json_data and json_data["studies"]:
+        study = json_data["studies"][0]
+        protocol = study.get("protocolSection", {})
+    else:
         return {
-            "nct_id": nct_id_result,
-            "acronym": acronym,
-            "title": title,
-            "primary_completion_date": primary_completion_date,
-            "study_first_post_date": study_first_post_date,
-            "last_update_post_date": last_update_post_date,
-            "study_type": study_type,
-            "status": status,
-            "sponsor": sponsor,
-            "conditions": conditions,
-            "interventions": interventions,
-            "locations": locations,
-            "age": age,
-            "sex": sex,
-            "phases": phases,
-            "eligibility_criteria": eligibility_criteria
+            "nct_id": nct_id,
+            "acronym": "Not Found",
+            "title": "Not Found",
+            "primary_completion_date": "Unknown",
+            "study_first_post_date": "Unknown",
+            "last_update_post_date": "Unknown",
+            "study_type": "Unknown",
+            "status": "Unknown",
+            "sponsor": "Unknown",
+            "conditions": "Unknown",
+            "interventions": "Unknown",
+            "locations": "Unknown",
+            "age": "Unknown",
+            "sex": "Unknown",
+            "phases": "Unknown",
+            "eligibility_criteria": "Not available"
         }
-        
-    except requests.exceptions.RequestException as e:
+    
+    id_module = protocol.get("identificationModule", {})
+    nct_id_result = id_module.get("nctId", nct_id)
+    acronym = id_module.get("acronym", "Unknown")
+    title = id_module.get("briefTitle", "Unknown")
+
+    status_module = protocol.get("statusModule", {})
+    status = status_module.get("overallStatus", "Unknown")
+    primary_completion_date = status_module.get("primaryCompletionDateStruct", {}).get("date", "Unknown")
+    study_first_post_date = status_module.get("studyFirstPostDateStruct", {}).get("date", "Unknown")
+    last_update_post_date = status_module.get("lastUpdatePostDateStruct", {}).get("date", "Unknown")
+    
+    design_module = protocol.get("designModule", {})
+    study_type = design_module.get("studyType", "Unknown")
+    phases_list = design_module.get("phases", [])
+    phases = ', '.join(phases_list) if phases_list else "Not Available"
+    
+    sponsor_module = protocol.get("sponsorCollaboratorsModule", {})
+    sponsor = sponsor_module.get("leadSponsor", {}).get("name", "Unknown")
+    
+    conditions_module = protocol.get("conditionsModule", {})
+    conditions_list = conditions_module.get("conditions", [])
+    conditions = ', '.join(conditions_list) if conditions_list else "No conditions listed"
+    
+    interventions_module = protocol.get("armsInterventionsModule", {})
+    interventions_raw = interventions_module.get("interventions", [])
+    interventions_list = [
+        inter.get("name", "Unknown") if isinstance(inter, dict) else str(inter)
+        for inter in interventions_raw
+    ]
+    interventions = ', '.join(interventions_list) if interventions_list else "No interventions listed"
+    
+    eligibility_module = protocol.get("eligibilityModule", {})
+    min_age = eligibility_module.get("minimumAge", "Unknown")
+    max_age = eligibility_module.get("maximumAge", "Unknown")
+    age = f"{min_age} to {max_age}" if min_age != "Unknown" or max_age != "Unknown" else "Unknown"
+    sex = eligibility_module.get("sex", "All")
+    eligibility_criteria = eligibility_module.get("eligibilityCriteria", "")
+    
+    contacts_locations_module = protocol.get("contactsLocationsModule", {})
+    locations_raw = contacts_locations_module.get("locations", [])
+    locations_list = [
+        f"{loc.get('city', 'Unknown')}, {loc.get('country', 'Unknown')}"
+        for loc in locations_raw[:10] if isinstance(loc, dict)
+    ]
+    locations = ', '.join(locations_list) if locations_list else "No locations listed"
+    
+    return compact({
+        "nct_id": nct_id_result,
+        "acronym": acronym,
+        "title": title,
+        "primary_completion_date": primary_completion_date,
+        "study_first_post_date": study_first_post_date,
+        "last_update_post_date": last_update_post_date,
+        "study_type": study_type,
+        "status": status,
+        "sponsor": sponsor,
+        "conditions": conditions,
+        "interventions": interventions,
+        "locations": locations,
+        "age": age,
+        "sex": sex,
+        "phases": phases,
+        "eligibility_criteria": eligibility_criteria,
+        **list_attributes(protocol)
+    })
+
+async def fetch_trial_long(base_url: str, nct_id: str) -> dict:
+    index = trial_index()
+    indexed = await index.get_async(nct_id) if index is not None else None
+    if indexed is not None:
+        return indexed
+    return long_trial(await get_json(f"{base_url}/{nct_id}"), nct_id)
+
+async def trials_long(base_url: str, nct_id: str) -> dict:
+    try:
+        # copy so callers can't modify the cached record
+        return dict(await trial_cache.get_or_fetch(nct_id, lambda: fetch_trial_long(base_url, nct_id)))
+    except (httpx.HTTPError, ValueError) as e:
+        # ValueError: a response body that isn't JSON; like HTTP errors, the error record isn't cached
         print(f"API request error for NCT ID {nct_id}: {e}")
         return {
             "nct_id": nct_id,
@@ -172,3 +382,55 @@ def trials_long(base_url: str, nct_id: str) -> dict:
             "phases": "Unknown",
             "eligibility_criteria": "Error fetching data"
         }
+
+async def fetch_trials_bulk(base_url: str, nct_ids: List[str]) -> Dict[str, dict]:
+    """Fetch detail records with filter.ids queries, one request per chunk of IDs."""
+    found = {}
+    for i in range(0, len(nct_ids), BATCH_CHUNK_SIZE):
+        chunk = nct_ids[i:i + BATCH_CHUNK_SIZE]
+        data = await get_json(base_url, {"filter.ids": ','.join(chunk), "pageSize": len(chunk)})
+        for study in data.get('studies', []):
+            nct_id = study.get('protocolSection', {}).get('identificationModule', {}).get('nctId')
+            if nct_id:
+                found[nct_id] = long_trial(study, nct_id)
+    return found
+
+async def trials_long_many(base_url: str, nct_ids: List[str]) -> Dict[str, dict]:
+    """Detail records for many NCT IDs, keyed by NCT ID.
+
+    Cached records are served directly; the rest are fetched with bulk
+    filter.ids queries. IDs the bulk query did not return (or all of them, if
+    it fails) fall back to individual lookups with bounded concurrency.
+    Malformed IDs get the Not Found record without a request.
+    """
+    nct_ids = list(dict.fromkeys(nct_ids))
+    trials = {}
+    missing = []
+    for nct_id in nct_ids:
+        if not NCT_ID.match(nct_id):
+            # one bad ID would otherwise fail the bulk query for its whole chunk
+            trials[nct_id] = long_trial({}, nct_id)
+            continue
+        cached = trial_cache.get(nct_id)
+        if cached is not None:
+            trials[nct_id] = dict(cached)
+        else:
+            missing.append(nct_id)
+
+    if missing:
+        try:
+            fetched = await fetch_trials_bulk(base_url, missing)
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Bulk trial request failed, falling back to single lookups: {e}")
+            fetched = {}
+        for nct_id, trial in fetched.items():
+            trial_cache.set(nct_id, trial)
+            trials[nct_id] = dict(trial)
+
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        async def single(nct_id):
+            async with semaphore:
+                trials[nct_id] = await trials_long(base_url, nct_id)
+        await asyncio.gather(*(single(nct_id) for nct_id in missing if nct_id not in trials))
+
+    return {nct_id: trials[nct_id] for nct_id in nct_ids}
@@ -0,0 +1,112 @@
+# Multi-worker deployment: the API runs as WEB_CONCURRENCY uvicorn (or gunicorn) worker processes,
+# the variable both servers read for their worker count. Workers share notes, jobs and rankings
+# through the storage backend and the response caches through SQLite files in SHARED_STATE_DIR;
+# upstream budgets (LLM concurrency and rate, ClinicalTrials.gov rate) are split between workers.
+# Read-modify-write updates of shared records take a shared_lock, which also covers other
+# processes (such as `python -m src.rematch`) using the same SHARED_STATE_DIR.
+import asyncio
+import fcntl
+import logging
+import os
+import weakref
+import zlib
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+WEB_CONCURRENCY = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+# directory for the shared cache files and worker locks; defaults to .state when running several workers
+SHARED_STATE_DIR = os.getenv('SHARED_STATE_DIR', '.state' if WEB_CONCURRENCY > 1 else '')
+HOST = os.getenv('HOST', '0.0.0.0')
+PORT = int(os.getenv('PORT', '8007'))
+# keys of one kind share this many lock files in SHARED_STATE_DIR/locks
+LOCK_STRIPES = 64
+LOCK_POLL_INTERVAL = 0.02
+
+def worker_slots(total: int) -> int:
+    """This worker's share of a concurrency budget for the whole deployment (at least 1)."""
+    return max(1, total // WEB_CONCURRENCY)
+
+def worker_rate(total: float) -> float:
+    """This worker's share of a requests/second budget for the whole deployment (0 stays unlimited)."""
+    return total / WEB_CONCURRENCY
+
+def shared_path(name: str, path: str = '') -> Optional[str]:
+    """`path` if set, else <SHARED_STATE_DIR>/<name>.db when there is a shared directory, else None."""
+    if path:
+        return path
+    if not SHARED_STATE_DIR:
+        return None
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    return os.path.join(SHARED_STATE_DIR, f"{name}.db")
+
+def check_shared_state(storage_backend: str):
+    """Refuse to serve from several workers with state that only one of them can see."""
+    if WEB_CONCURRENCY > 1 and storage_backend == 'memory':
+        raise RuntimeError(
+            "STORAGE_BACKEND=memory keeps notes in one process; use sqlite or s3 with WEB_CONCURRENCY > 1"
+        )
+
+_leader_files: Dict[str, TextIO] = {}
+
+def is_leader(name: str) -> bool:
+    """Whether this worker holds the named lock, for work only one worker should do (such as the
+    scheduled re-match). The first worker to ask gets it and keeps it until it exits."""
+    if name in _leader_files:
+        return True
+    if WEB_CONCURRENCY == 1 or not SHARED_STATE_DIR:
+        return True
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    lock_file = open(os.path.join(SHARED_STATE_DIR, f"{name}.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _leader_files[name] = lock_file
+    logger.info(f"Worker {os.getpid()} holds the {name} lock")
+    return True
+
+_process_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _lock_path(kind: str, key: str) -> str:
+    directory = os.path.join(SHARED_STATE_DIR, "locks")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{kind}-{zlib.crc32(key.encode()) % LOCK_STRIPES}.lock")
+
+def _try_flock(lock_file: TextIO) -> bool:
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+@asynccontextmanager
+async def shared_lock(kind: str, key: str = ""):
+    """Hold the lock for `key` of `kind` (e.g. a note ID) in this process and, when there is a
+    SHARED_STATE_DIR, across the processes using it. The file lock is polled rather than waited on
+    in a thread, so a cancelled waiter leaves nothing behind."""
+    name = f"{kind}/{key}"
+    lock = _process_locks.get(name)
+    if lock is None:
+        lock = _process_locks[name] = asyncio.Lock()
+    async with lock:
+        if not SHARED_STATE_DIR:
+            yield
+            return
+        with open(_lock_path(kind, key), "w") as lock_file:
+            # closing the file releases the lock
+            while not _try_flock(lock_file):
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+            yield
+
+def is_locked(kind: str, key: str = "") -> bool:
+    """Whether some process currently holds shared_lock(kind, key)."""
+    lock = _process_locks.get(f"{kind}/{key}")
+    if lock is not None and lock.locked():
+        return True
+    if not SHARED_STATE_DIR:
+        return False
+    with open(_lock_path(kind, key), "w") as lock_file:
+        return not _try_flock(lock_file)